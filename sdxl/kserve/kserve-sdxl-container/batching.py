@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+_log = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Coalesces the instances of concurrent requests into batched calls of `run_batch`,
+    which takes a list of instances and returns one result per instance. Instances with
+    the same key wait up to `window` seconds for others, and a batch runs as soon as it
+    reaches `max_batch_size`. Batches run one at a time in the executor: arrivals
+    accumulate while one runs, so batches grow with the load.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        key: Callable[[Any], Hashable],
+        max_batch_size: int = 4,
+        window: float = 0.05,
+        executor: Optional[Executor] = None,
+    ):
+        self.run_batch = run_batch
+        self.key = key
+        self.max_batch_size = max(max_batch_size, 1)
+        self.window = window
+        self.executor = executor
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future, float]]] = {}  # key -> (instance, future, arrival)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, instance):
+        """Result of an instance, once the batch it joined ran."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        self._pending.setdefault(self.key(instance), []).append((instance, future, time.monotonic()))
+        self._wakeup.set()
+        return await future
+
+    def _next_batch(self) -> Tuple[Optional[Hashable], float]:
+        """Key of the next batch and how long to wait before running it, a full batch runs first."""
+        now = time.monotonic()
+        oldest_key, oldest = None, None
+        for key, entries in self._pending.items():
+            if len(entries) >= self.max_batch_size:
+                return key, 0.0
+            if oldest is None or entries[0][2] < oldest:
+                oldest_key, oldest = key, entries[0][2]
+        if oldest_key is None:
+            return None, 0.0
+        return oldest_key, max(0.0, oldest + self.window - now)
+
+    def _take(self, key: Hashable) -> list:
+        entries = self._pending.pop(key)
+        if len(entries) > self.max_batch_size:
+            self._pending[key] = entries[self.max_batch_size :]
+        # Skip the callers that went away while waiting
+        return [entry for entry in entries[: self.max_batch_size] if not entry[1].done()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, delay = self._next_batch()
+            if key is None or delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay if key is not None else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            entries = self._take(key)
+            if not entries:
+                continue
+            _log.debug(f"Running a batch of {len(entries)} instances")
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, [entry[0] for entry in entries])
+            except Exception as e:
+                for _, future, _ in entries:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(entries, results):
+                if not future.done():
+                    future.set_result(result)
@@ -0,0 +1,125 @@
+"""
+CPU benchmark of the KServe micro-batching, with a tiny random-weight SDXL pipeline.
+
+Sends concurrent requests to DiffusersModel.predict, first with a batch size of 1
+(every request runs alone, as before micro-batching) then for each batch size, and
+reports the throughput and the latency percentiles as JSON:
+
+    python benchmarks/bench_batching.py --requests 32 --concurrency 8 --batch-sizes 2 4 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+import torch  # noqa: E402
+from tiny_sdxl import TINY_REQUEST, tiny_sdxl  # noqa: E402
+
+
+def import_server():
+    """Import server.py, which parses its own command line at import time."""
+    argv = sys.argv
+    sys.argv = ["server.py"]
+    try:
+        import server
+    finally:
+        sys.argv = argv
+    return server
+
+
+server = import_server()
+
+
+class TinyModel(server.DiffusersModel):
+    """DiffusersModel serving a tiny random-weight SDXL pipeline."""
+
+    def load(self):
+        torch.manual_seed(0)
+        self.pipeline = tiny_sdxl(tempfile.mkdtemp(prefix="bench-batching-"))
+        self.pipeline.set_progress_bar_config(disable=True)
+        self.ready = True
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def make_payload(model, index, steps):
+    instance = {"prompt": f"a photo of a cat, number {index}", "num_inference_steps": steps, "seed": index}
+    instance.update(TINY_REQUEST)
+    return model.preprocess({"instances": [instance]}, {})
+
+
+async def run_case(model, requests, concurrency, steps):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send(index):
+        async with semaphore:
+            start = time.perf_counter()
+            await model.predict(make_payload(model, index, steps))
+            latencies.append(time.perf_counter() - start)
+
+    # Warm up the pipeline and the batcher
+    await model.predict(make_payload(model, -1, steps))
+    start = time.perf_counter()
+    await asyncio.gather(*(send(index) for index in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": requests / elapsed,
+        "latency_mean": statistics.mean(latencies),
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p99": percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--window-ms", type=float, default=20)
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    bench_args = parser.parse_args()
+
+    results = {}
+    for batch_size in [1] + bench_args.batch_sizes:
+        server.args.max_batch_size = batch_size
+        server.args.batch_window_ms = 0 if batch_size == 1 else bench_args.window_ms
+        model = TinyModel(f"bench-{batch_size}")
+        model.load()
+        case = asyncio.run(run_case(model, bench_args.requests, bench_args.concurrency, bench_args.steps))
+        results[f"batch_{batch_size}"] = case
+        print(
+            f"max batch {batch_size}: {case['requests_per_second']:.2f} req/s, "
+            f"p50 {case['latency_p50']:.3f}s, p99 {case['latency_p99']:.3f}s",
+            file=sys.stderr,
+        )
+
+    report = {
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "requests": bench_args.requests,
+        "concurrency": bench_args.concurrency,
+        "steps": bench_args.steps,
+        "window_ms": bench_args.window_ms,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if bench_args.output:
+        with open(bench_args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Tiny random-weight SDXL pipeline for the CPU benchmarks of the KServe server.
+
+The components follow the dummy configuration used by the diffusers test suite,
+and the tokenizer is built from a byte-level vocabulary written to a temporary
+folder, so no checkpoint or network access is needed.
+"""
+import json
+import os
+
+from diffusers import AutoencoderKL, EulerDiscreteScheduler, StableDiffusionXLPipeline, UNet2DConditionModel
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+# Request size matching the latent grid of the tiny components
+TINY_REQUEST = {"height": 64, "width": 64}
+
+
+def tiny_tokenizer(workdir: str) -> CLIPTokenizer:
+    """Byte-level CLIP tokenizer without merges, every byte is a token."""
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for char in bytes_to_unicode().values():
+        vocab[char] = len(vocab)
+        vocab[char + "</w>"] = len(vocab)
+    vocab_file = os.path.join(workdir, "vocab.json")
+    merges_file = os.path.join(workdir, "merges.txt")
+    with open(vocab_file, "w") as f:
+        json.dump(vocab, f)
+    with open(merges_file, "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_file, merges_file, model_max_length=77)
+
+
+def tiny_clip_config() -> CLIPTextConfig:
+    return CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+        hidden_size=32,
+        intermediate_size=37,
+        layer_norm_eps=1e-05,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        vocab_size=1000,
+        hidden_act="gelu",
+        projection_dim=32,
+    )
+
+
+def tiny_sdxl(workdir: str) -> StableDiffusionXLPipeline:
+    tokenizer = tiny_tokenizer(workdir)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=80,  # 6 * 8 + 32
+        cross_attention_dim=64,
+    )
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        steps_offset=1,
+        beta_schedule="scaled_linear",
+        timestep_spacing="leading",
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+        sample_size=128,
+    )
+    return StableDiffusionXLPipeline(
+        unet=unet,
+        scheduler=scheduler,
+        vae=vae,
+        text_encoder=CLIPTextModel(tiny_clip_config()),
+        tokenizer=tokenizer,
+        text_encoder_2=CLIPTextModelWithProjection(tiny_clip_config()),
+        tokenizer_2=tokenizer,
+    )
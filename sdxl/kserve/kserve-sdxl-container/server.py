@@ -1,110 +1,176 @@
 import argparse
+import asyncio
 import base64
 import io
+import json
 import os
-from typing import Dict, Union
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Union
 
+import numpy as np
 import torch
-from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline
-from kserve import InferRequest, InferResponse, Model, ModelServer, model_server
-from kserve.errors import InvalidInput
+from diffusers import AutoencoderKL, StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline, UNet2DConditionModel
+from kserve import InferOutput, InferRequest, InferResponse, Model, ModelServer, model_server
+from kserve.errors import InferenceError, InvalidInput
+from transformers import CLIPTextModel, CLIPTextModelWithProjection
+
+from batching import MicroBatcher
+
+# Instance fields that can differ within a batched pipeline call
+PER_INSTANCE_KEYS = ("prompt", "prompt_2", "negative_prompt", "negative_prompt_2", "seed")
+# V2 request parameters driving the response, not passed to the pipeline
+OUTPUT_PARAMETERS = ("output_format",)
+# Components loaded concurrently, the tokenizers and the scheduler are small
+BASE_COMPONENTS = {
+    "unet": UNet2DConditionModel,
+    "vae": AutoencoderKL,
+    "text_encoder": CLIPTextModel,
+    "text_encoder_2": CLIPTextModelWithProjection,
+}
+REFINER_COMPONENTS = {
+    "unet": UNet2DConditionModel,
+    "vae": AutoencoderKL,
+    "text_encoder_2": CLIPTextModelWithProjection,
+}
 
 
 class DiffusersModel(Model):
     def __init__(self, name: str):
-        super().__init__(name)
+        super().__init__(name, return_response_headers=True)
         self.model_id = args.model_id or "/mnt/models"
         self.refiner_id = args.refiner_id or None
         self.pipeline = None
         self.refiner = None
         self.ready = False
-        self.load()
-
-    def load(self):
-        # Load the model
-        if args.single_file_model and args.single_file_model != "":
-            pipeline = StableDiffusionXLPipeline.from_single_file(
-                args.single_file_model,
-                torch_dtype=torch.float16,
-                variant="fp16",
-                safety_checker=None,
-                use_safetensors=True,
-            )
-        else:
-            pipeline = StableDiffusionXLPipeline.from_pretrained(
-                self.model_id,
-                torch_dtype=torch.float16,
-                variant="fp16",
-                safety_checker=None,
-                use_safetensors=True,
-            )
-        if args.device:
-            print(f"Loading model on device: {args.device}")
-            if args.device == "cuda":
-                pipeline.to(torch.device("cuda"))
-            elif args.device == "cpu":
-                pipeline.to(torch.device("cpu"))
-            elif args.device == "enable_model_cpu_offload":
-                pipeline.enable_model_cpu_offload()
-            elif args.device == "enable_sequential_cpu_offload":
-                pipeline.enable_sequential_cpu_offload()
-            else:
-                raise ValueError(f"Invalid device: {args.device}")
-        else:
-            pipeline.to(torch.device("cuda"))
-        self.pipeline = pipeline
+        # Pipeline calls run on their own thread, the event loop keeps answering probes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sdxl-inference")
+        # Instances of concurrent requests are generated together
+        self.batcher = MicroBatcher(
+            self.run_batch, batch_key, args.max_batch_size, args.batch_window_ms / 1000, executor=self.executor
+        )
 
-        # Load the refiner model
-        if args.use_refiner:
-            if args.refiner_single_file_model and args.refiner_single_file_model != "":
-                refiner = StableDiffusionXLImg2ImgPipeline.from_single_file(
-                    args.refiner_single_file_model,
+    def load(self) -> bool:
+        """
+        Load the pipelines, once. The components of the base model and of the refiner
+        are read concurrently, their loads are dominated by disk reads and deserialization.
+        """
+        if self.ready:
+            return True
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="sdxl-load") as pool:
+            refiner_components = None
+            if args.use_refiner and not args.refiner_single_file_model:
+                refiner_components = load_components(pool, self.refiner_id, REFINER_COMPONENTS)
+            if args.single_file_model and args.single_file_model != "":
+                pipeline = StableDiffusionXLPipeline.from_single_file(
+                    args.single_file_model,
                     torch_dtype=torch.float16,
                     variant="fp16",
                     safety_checker=None,
                     use_safetensors=True,
-                    text_encoder_2=pipeline.text_encoder_2,
-                    vae=pipeline.vae,
                 )
             else:
-                refiner = StableDiffusionXLImg2ImgPipeline.from_pretrained(
-                    self.refiner_id,
+                components = load_components(pool, self.model_id, BASE_COMPONENTS)
+                pipeline = StableDiffusionXLPipeline.from_pretrained(
+                    self.model_id,
+                    **{name: future.result() for name, future in components.items()},
                     torch_dtype=torch.float16,
                     variant="fp16",
                     safety_checker=None,
                     use_safetensors=True,
                 )
-            if args.device:
-                print(f"Loading refiner model on device: {args.device}")
-                if args.device == "cuda":
-                    refiner.to(torch.device("cuda"))
-                elif args.device == "cpu":
-                    refiner.to(torch.device("cpu"))
-                elif args.device == "enable_model_cpu_offload":
-                    refiner.enable_model_cpu_offload()
-                elif args.device == "enable_sequential_cpu_offload":
-                    refiner.enable_sequential_cpu_offload()
+
+            # Load the refiner model
+            refiner = None
+            if args.use_refiner:
+                if refiner_components is None:
+                    # Shares the second text encoder and the VAE of the base model
+                    refiner = StableDiffusionXLImg2ImgPipeline.from_single_file(
+                        args.refiner_single_file_model,
+                        torch_dtype=torch.float16,
+                        variant="fp16",
+                        safety_checker=None,
+                        use_safetensors=True,
+                        text_encoder_2=pipeline.text_encoder_2,
+                        vae=pipeline.vae,
+                    )
                 else:
-                    raise ValueError(f"Invalid device: {args.device}")
-            else:
-                refiner.to(torch.device("cuda"))
+                    refiner = StableDiffusionXLImg2ImgPipeline.from_pretrained(
+                        self.refiner_id,
+                        **{name: future.result() for name, future in refiner_components.items()},
+                        torch_dtype=torch.float16,
+                        variant="fp16",
+                        safety_checker=None,
+                        use_safetensors=True,
+                    )
+
+        print(f"Loading model on device: {args.device}")
+        place_pipeline(pipeline, args.device)
+        self.pipeline = pipeline
+        if refiner is not None:
+            print(f"Loading refiner model on device: {args.device}")
+            place_pipeline(refiner, args.device)
             self.refiner = refiner
+        print(f"Models loaded in {time.perf_counter() - start:.1f}s")
 
         # The ready flag is used by model ready endpoint for readiness probes,
         # set to True when model is loaded successfully without exceptions.
         self.ready = True
+        return self.ready
 
     def preprocess(
         self, payload: Union[Dict, InferRequest], headers: Dict[str, str] = None
     ) -> Dict:
+        """
+        Normalize V1 and V2 requests to a list of instances, each a dict of pipeline
+        arguments, plus what the response needs.
+        """
         if isinstance(payload, Dict) and "instances" in payload:
-            headers["request-type"] = "v1"
+            protocol = "v1"
+            instances = payload["instances"]
+            request_id, output_format = None, "png"
         elif isinstance(payload, InferRequest):
-            raise InvalidInput("v2 protocol not implemented")
+            protocol = "v2"
+            parameters = dict(payload.parameters or {})
+            output_format = parameters.get("output_format", "png")
+            if output_format not in ("png", "raw"):
+                raise InvalidInput("output_format must be 'png' or 'raw'")
+            instances = self.v2_instances(payload, parameters)
+            request_id = payload.id
         else:
             raise InvalidInput("invalid payload")
+        if headers is not None:
+            headers["request-type"] = protocol
+
+        if not instances or not all(isinstance(instance, dict) and instance.get("prompt") for instance in instances):
+            raise InvalidInput("every instance needs a prompt")
+        return {"protocol": protocol, "id": request_id, "output_format": output_format, "instances": instances}
 
-        return payload["instances"][0]
+    def v2_instances(self, request: InferRequest, parameters: Dict) -> List[Dict]:
+        """
+        Instances of a V2 request: one per row of the input tensors, named after the
+        pipeline arguments ("prompt" as a BYTES tensor of shape [N]...). Tensors of a
+        single element and the request parameters apply to every instance.
+        """
+        columns = {}
+        for infer_input in request.inputs:
+            values = infer_input.as_numpy().reshape(-1).tolist()
+            if infer_input.datatype == "BYTES":
+                values = [value.decode("utf-8") if isinstance(value, bytes) else str(value) for value in values]
+            columns[infer_input.name] = values
+        if "prompt" not in columns:
+            raise InvalidInput("missing 'prompt' input tensor")
+        batch_size = max(len(values) for values in columns.values())
+        for name, values in columns.items():
+            if len(values) not in (1, batch_size):
+                raise InvalidInput(f"input '{name}' has {len(values)} elements, expected 1 or {batch_size}")
+
+        shared = {key: value for key, value in parameters.items() if key not in OUTPUT_PARAMETERS}
+        return [
+            {**shared, **{name: values[index if len(values) > 1 else 0] for name, values in columns.items()}}
+            for index in range(batch_size)
+        ]
 
     def convert_lists_to_tuples(self, data):
         if isinstance(data, dict):
@@ -114,33 +180,129 @@ class DiffusersModel(Model):
         else:
             return data
 
-    def predict(
-        self, payload: Union[Dict, InferRequest], headers: Dict[str, str] = None
-    ) -> Union[Dict, InferResponse]:
+    def run_batch(self, instances: List[Dict]) -> List:
+        """
+        Generate the images of compatible instances with one pipeline call. Returns an
+        (image, timings) pair per instance.
+        """
+        if not self.ready:
+            raise InferenceError("model is not loaded")
+        started = time.perf_counter()
+        payload = {key: value for key, value in instances[0].items() if key not in PER_INSTANCE_KEYS}
         payload = self.convert_lists_to_tuples(payload)
+        payload["num_images_per_prompt"] = 1
+        for key in PER_INSTANCE_KEYS:
+            if key == "seed" and key in instances[0]:
+                payload["generator"] = [torch.Generator("cpu").manual_seed(int(instance["seed"])) for instance in instances]
+            elif key in instances[0]:
+                payload[key] = [instance[key] for instance in instances]
 
-        # Create the image, without refiner if not needed
+        # Create the images, without refiner if not needed
         if not args.use_refiner:
-            image = self.pipeline(**payload).images[0]
+            images = self.pipeline(**payload).images
+        else:
+            denoising_limit = payload.pop("denoising_limit")
+            latents = self.pipeline(**payload, output_type="latent", denoising_end=denoising_limit).images
+            images = self.refiner(**payload, image=latents, denoising_start=denoising_limit).images
+        timings = {"started": started, "inference": time.perf_counter() - started, "batch": len(instances)}
+        return [(image, timings) for image in images]
+
+    async def predict(
+        self, payload: Dict, headers: Dict[str, str] = None, response_headers: Dict[str, str] = None
+    ) -> Union[Dict, InferResponse]:
+        instances = payload["instances"]
+        submitted = time.perf_counter()
+        results = await asyncio.gather(*(self.batcher.submit(instance) for instance in instances))
+        images = [image for image, _ in results]
+
+        # Encoding is CPU bound too, keep it off the event loop
+        encode_start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        if payload["protocol"] == "v2":
+            response = await loop.run_in_executor(None, self.v2_response, payload, images)
         else:
-            denoising_limit = payload["denoising_limit"]
-            image = self.pipeline(**payload, output_type="latent", denoising_end=denoising_limit).images
-            image = self.refiner(**payload,image=image, denoising_start=denoising_limit).images[0]
-        
-        # Convert the image to base64
-        image_bytes = io.BytesIO()
-        image.save(image_bytes, format="PNG")
-        im_b64 = base64.b64encode(image_bytes.getvalue()).decode("utf-8")
-
-        return {
-            "predictions": [
+            response = await loop.run_in_executor(None, self.v1_response, instances, images)
+
+        if response_headers is not None:
+            timings = [timings for _, timings in results]
+            response_headers["Server-Timing"] = server_timing(
+                queue=max(timing["started"] for timing in timings) - submitted,
+                inference=max(timing["inference"] for timing in timings),
+                encode=time.perf_counter() - encode_start,
+                batch=max(timing["batch"] for timing in timings),
+            )
+        return response
+
+    def v1_response(self, instances: List[Dict], images: List) -> Dict:
+        predictions = []
+        for instance, image in zip(instances, images):
+            predictions.append(
                 {
                     "model_name": self.model_id,
-                    "prompt": payload["prompt"],
-                    "image": {"format": "PNG", "b64": im_b64},
+                    "prompt": instance["prompt"],
+                    "image": {"format": "PNG", "b64": base64.b64encode(encode_png(image)).decode("utf-8")},
                 }
-            ]
-        }
+            )
+        return {"predictions": predictions}
+
+    def v2_response(self, payload: Dict, images: List) -> InferResponse:
+        """Images as one binary output tensor: PNG bytes of shape [N], or raw RGB pixels of shape [N, H, W, 3]."""
+        if payload["output_format"] == "raw":
+            pixels = [np.asarray(image.convert("RGB"), dtype=np.uint8) for image in images]
+            if len({array.shape for array in pixels}) > 1:
+                raise InvalidInput("raw output requires instances of the same size")
+            tensor = np.stack(pixels)
+            output = InferOutput(name="image", shape=list(tensor.shape), datatype="UINT8")
+        else:
+            tensor = np.array([encode_png(image) for image in images], dtype=np.object_)
+            output = InferOutput(name="image", shape=[len(images)], datatype="BYTES")
+        output.set_data_from_numpy(tensor, binary_data=True)
+        return InferResponse(response_id=payload["id"], model_name=self.name, infer_outputs=[output])
+
+
+def batch_key(instance: Dict):
+    """Instances with the same arguments apart from the prompts and seed can run in the same pipeline call."""
+    shared = {key: value for key, value in instance.items() if key not in PER_INSTANCE_KEYS}
+    present = tuple(key for key in PER_INSTANCE_KEYS if key in instance)
+    return json.dumps(shared, sort_keys=True, default=str), present
+
+
+def load_components(pool: ThreadPoolExecutor, model_id: str, classes: Dict) -> Dict[str, Future]:
+    """Start loading the components of a diffusers model folder, each in its own thread."""
+    return {
+        name: pool.submit(
+            cls.from_pretrained, model_id, subfolder=name, torch_dtype=torch.float16, variant="fp16", use_safetensors=True
+        )
+        for name, cls in classes.items()
+    }
+
+
+def place_pipeline(pipeline, device: str):
+    """Move a pipeline to its device, or set up its CPU offloading."""
+    if not device or device == "cuda":
+        pipeline.to(torch.device("cuda"))
+    elif device == "cpu":
+        pipeline.to(torch.device("cpu"))
+    elif device == "enable_model_cpu_offload":
+        pipeline.enable_model_cpu_offload()
+    elif device == "enable_sequential_cpu_offload":
+        pipeline.enable_sequential_cpu_offload()
+    else:
+        raise ValueError(f"Invalid device: {device}")
+
+
+def server_timing(queue: float, inference: float, encode: float, batch: int) -> str:
+    """Server-Timing header value, durations in milliseconds."""
+    return (
+        f"queue;dur={queue * 1000:.1f}, inference;dur={inference * 1000:.1f}, "
+        f"encode;dur={encode * 1000:.1f}, batch;desc={batch}"
+    )
+
+
+def encode_png(image) -> bytes:
+    image_bytes = io.BytesIO()
+    image.save(image_bytes, format="PNG")
+    return image_bytes.getvalue()
 
 
 parser = argparse.ArgumentParser(parents=[model_server.parser])
@@ -168,6 +330,18 @@ parser.add_argument(
     type=str,
     help="Device to use, including offloading. Valid values are: 'cuda' (default), 'enable_model_cpu_offload', 'enable_sequential_cpu_offload', 'cpu' (works but unusable...)",
 )
+parser.add_argument(
+    "--max_batch_size",
+    type=int,
+    default=int(os.getenv("MAX_BATCH_SIZE", "4")),
+    help="Maximum number of instances generated in one pipeline call",
+)
+parser.add_argument(
+    "--batch_window_ms",
+    type=float,
+    default=float(os.getenv("BATCH_WINDOW_MS", "50")),
+    help="Time an instance waits for instances of concurrent requests to batch with",
+)
 args, _ = parser.parse_known_args()
 
 if __name__ == "__main__":
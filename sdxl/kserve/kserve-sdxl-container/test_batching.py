@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+from batching import MicroBatcher
+
+
+class Recorder:
+    def __init__(self, seconds=0.0):
+        self.batches = []
+        self.seconds = seconds
+
+    def __call__(self, instances):
+        self.batches.append(list(instances))
+        time.sleep(self.seconds)
+        return [instance["prompt"].upper() for instance in instances]
+
+
+def key(instance):
+    return instance.get("steps", 30)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_requests_share_a_batch():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, key, max_batch_size=8, window=0.05)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.submit({"prompt": f"p{i}"}) for i in range(5)))
+
+    assert run(scenario()) == [f"P{i}" for i in range(5)]
+    assert [len(batch) for batch in recorder.batches] == [5]
+
+
+def test_groups_by_key_and_max_batch_size():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, key, max_batch_size=2, window=0.05)
+
+    async def scenario():
+        instances = [{"prompt": "a"}, {"prompt": "b", "steps": 10}, {"prompt": "c"}, {"prompt": "d"}]
+        return await asyncio.gather(*(batcher.submit(instance) for instance in instances))
+
+    assert run(scenario()) == ["A", "B", "C", "D"]
+    assert sorted([instance["prompt"] for instance in batch] for batch in recorder.batches) == [["a", "c"], ["b"], ["d"]]
+
+
+def test_full_batch_does_not_wait_for_the_window():
+    batcher = MicroBatcher(Recorder(), key, max_batch_size=2, window=10)
+
+    async def scenario():
+        start = time.monotonic()
+        await asyncio.gather(batcher.submit({"prompt": "a"}), batcher.submit({"prompt": "b"}))
+        return time.monotonic() - start
+
+    assert run(scenario()) < 1
+
+
+def test_arrivals_accumulate_while_a_batch_runs():
+    recorder = Recorder(seconds=0.2)
+    batcher = MicroBatcher(recorder, key, max_batch_size=8, window=0.0)
+
+    async def scenario():
+        first = asyncio.create_task(batcher.submit({"prompt": "first"}))
+        await asyncio.sleep(0.05)
+        others = [asyncio.create_task(batcher.submit({"prompt": f"p{i}"})) for i in range(3)]
+        await asyncio.gather(first, *others)
+
+    run(scenario())
+    assert [len(batch) for batch in recorder.batches] == [1, 3]
+
+
+def test_errors_reach_every_caller_of_the_batch():
+    def failing(instances):
+        raise RuntimeError("out of memory")
+
+    batcher = MicroBatcher(failing, key, max_batch_size=4, window=0.01)
+
+    async def scenario():
+        return await asyncio.gather(
+            batcher.submit({"prompt": "a"}), batcher.submit({"prompt": "b"}), return_exceptions=True
+        )
+
+    results = run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
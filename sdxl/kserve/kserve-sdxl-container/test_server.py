@@ -0,0 +1,38 @@
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("kserve")
+from PIL import Image  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def server():
+    # server.py parses its own command line at import time
+    argv = sys.argv
+    sys.argv = ["server.py"]
+    try:
+        import server
+    finally:
+        sys.argv = argv
+    return server
+
+
+class FakePipeline:
+    def __call__(self, prompt, **kwargs):
+        return SimpleNamespace(images=[Image.new("RGB", (8, 8)) for _ in prompt])
+
+
+def test_server_timing_header_on_a_model_call(server):
+    model = server.DiffusersModel("sdxl")
+    model.pipeline = FakePipeline()
+    model.ready = True
+
+    response, response_headers = asyncio.run(model({"instances": [{"prompt": "cat"}, {"prompt": "dog"}]}, {}))
+
+    assert [prediction["prompt"] for prediction in response["predictions"]] == ["cat", "dog"]
+    timing = response_headers["Server-Timing"]
+    for metric in ("queue;dur=", "inference;dur=", "encode;dur=", "batch;desc=2"):
+        assert metric in timing
@@ -0,0 +1,95 @@
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict, Optional
+
+_log = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a job can't be admitted, with the seconds after which the client may retry."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounds the queue by length, estimated backlog and jobs per client. Rejected
+    requests get a Retry-After computed from the measured job completion rate.
+    A limit of 0 disables the corresponding check.
+    """
+
+    def __init__(
+        self,
+        max_queue_length: int = 0,
+        max_backlog_seconds: float = 0,
+        max_jobs_per_client: int = 0,
+        window: float = 300,
+        default_retry_after: int = 30,
+    ):
+        self.max_queue_length = max_queue_length
+        self.max_backlog_seconds = max_backlog_seconds
+        self.max_jobs_per_client = max_jobs_per_client
+        self.window = window
+        self.default_retry_after = default_retry_after
+        self.completions = deque()  # Timestamps of the jobs completed in the window
+        self.client_jobs: Dict[str, int] = {}
+
+    @classmethod
+    def from_args(cls, args) -> "AdmissionController":
+        return cls(
+            max_queue_length=args.max_queue_length,
+            max_backlog_seconds=args.max_backlog_seconds,
+            max_jobs_per_client=args.max_jobs_per_client,
+        )
+
+    def throughput(self) -> float:
+        """Jobs completed per second over the measurement window."""
+        now = time.time()
+        while self.completions and self.completions[0] < now - self.window:
+            self.completions.popleft()
+        if len(self.completions) < 2:
+            return 0.0
+        elapsed = max(now - self.completions[0], 1.0)
+        return len(self.completions) / elapsed
+
+    def retry_after(self, excess_jobs: int) -> int:
+        """Seconds until the given number of jobs should have left the queue."""
+        rate = self.throughput()
+        if rate <= 0:
+            return self.default_retry_after
+        return max(1, math.ceil(excess_jobs / rate))
+
+    def admit(self, client_id: Optional[str], queue_length: int, backlog_seconds: float):
+        """Reserve a slot for a new job of the client or raise AdmissionRejected."""
+        if self.max_queue_length and queue_length >= self.max_queue_length:
+            raise AdmissionRejected(
+                f"Queue is full ({queue_length} jobs)", self.retry_after(queue_length - self.max_queue_length + 1)
+            )
+
+        if self.max_backlog_seconds and backlog_seconds >= self.max_backlog_seconds:
+            excess_seconds = backlog_seconds - self.max_backlog_seconds
+            average_job = backlog_seconds / queue_length if queue_length else 0
+            excess_jobs = math.ceil(excess_seconds / average_job) + 1 if average_job else 1
+            raise AdmissionRejected(f"Queue backlog is {backlog_seconds:.0f}s", self.retry_after(excess_jobs))
+
+        if client_id is not None:
+            active = self.client_jobs.get(client_id, 0)
+            if self.max_jobs_per_client and active >= self.max_jobs_per_client:
+                raise AdmissionRejected(f"Too many jobs for this client ({active})", self.retry_after(1))
+            self.client_jobs[client_id] = active + 1
+
+    def release(self, client_id: Optional[str]):
+        """Free the slot of a client job that reached a final state."""
+        if client_id is None or client_id not in self.client_jobs:
+            return
+        self.client_jobs[client_id] -= 1
+        if self.client_jobs[client_id] <= 0:
+            del self.client_jobs[client_id]
+
+    def record_completion(self):
+        self.completions.append(time.time())
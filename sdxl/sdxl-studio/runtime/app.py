@@ -1,25 +1,43 @@
 import asyncio
 import base64
+import hashlib
+import hmac
 import io
+import json
 import logging
+import re
 import time
 import uuid
-from contextlib import asynccontextmanager
+from collections import defaultdict
+from contextlib import asynccontextmanager, nullcontext
 import os
+import socket
+from typing import Optional
 from PIL import Image
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
+from admission import AdmissionController, AdmissionRejected
+from broadcast import Broadcast
+from buckets import RequestNormalizer
 from classes import GenerationRequest, GenerationResponse, HealthCheckResponse, Job
+from cost_model import CostModel, sjf_priority
+import metrics
 from diffusers_model import DiffusersPipeline
 from flux_model import FluxModelPipeline
 from wan_model import WanModelPipeline
+from mock_model import MockModelPipeline
+from preemption import Preempted
+from pubsub import create_broker
+from queue_backends import create_queue_backend
+from safety import SafetyChecker, screening_steps
 from helpers import logging_config, parse_args
-from latents_preview import process_latents, process_flux_latents, process_wan_latents
+import tracing
+from latents_preview import process_latents, process_flux_latents, process_wan_latents, process_mock_latents
 from watermark import add_watermark
 
 # Load local env vars if present
@@ -30,11 +48,26 @@ logging_config()
 _log = logging.getLogger(__name__)
 
 
+args = parse_args()
+
 # Global job dictionary, queue and websocket connections
 jobs = {}  # job_id -> Job
-job_queue = asyncio.Queue()
-queue_list = []  # Maintain an ordered list of job IDs for queue tracking
-websocket_connections = {}  # job_id -> set of WebSockets
+restored_jobs = {}  # job_id -> Job queued by another replica or before a restart, while it stays queued
+queue_backend = create_queue_backend(args)  # Queued job ids ordered by Job.priority, may be shared by replicas
+queue_event = asyncio.Event()  # Set when a job is queued, to wake up idle workers
+draining = False  # Set on shutdown with --drain-on-shutdown, workers finish their job and stop
+progress_listeners = {}  # job_id -> WebSockets, event streams and long polls following the job
+inflight_requests = {}  # dedup key -> queued or running Job shared by identical requests
+broker = create_broker(args.pubsub_url)  # Relays job messages between the API replicas and the workers
+worker_only = False  # Set by worker_main.py, results are published but not kept for clients
+
+# Pub/sub channels: messages of a job, queue changes and cancellations
+JOB_CHANNEL = "job:"
+QUEUE_CHANNEL = "queue"
+CONTROL_CHANNEL = "control"
+
+# Job states after which no more messages are sent
+TERMINAL_STATES = ("completed", "failed", "error", "cancelled")
 
 
 ##################################
@@ -46,12 +79,39 @@ websocket_connections = {}  # job_id -> set of WebSockets
 async def lifespan(app: FastAPI):
     """Initialize the model and start background queue processing"""
 
-    # Start the background queue processor
-    queue_task = asyncio.create_task(process_queue())
+    if args.role == "api" and not (broker.remote and queue_backend.durable):
+        raise RuntimeError("--role api requires --pubsub-url and a shared queue backend (--queue-backend sqlite)")
+    broker.subscribe(JOB_CHANNEL, on_job_message)
+    broker.subscribe(QUEUE_CHANNEL, on_queue_message)
+    broker.subscribe(CONTROL_CHANNEL, on_control_message)
+    await broker.start()
+
+    # Start the background queue processor, the API tier leaves the jobs to the worker tier
+    queue_task = asyncio.create_task(process_queue()) if args.role == "all" else None
+    lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
 
     yield
 
-    # Cancel the background queue processor on shutdown
+    lag_task.cancel()
+    if queue_task is not None:
+        await stop_workers(queue_task)
+    await broker.close()
+    queue_backend.close()
+
+
+async def stop_workers(queue_task: asyncio.Task):
+    """Stop the workers, letting them finish their job with --drain-on-shutdown."""
+    if args.drain_on_shutdown:
+        # Let the workers finish their current job, the queued ones stay in the backend
+        global draining
+        draining = True
+        queue_event.set()
+        _log.info(f"Draining, waiting up to {args.drain_timeout}s for the running jobs...")
+        try:
+            await asyncio.wait_for(asyncio.shield(queue_task), args.drain_timeout)
+        except asyncio.TimeoutError:
+            _log.warning("Drain timeout, interrupting the running jobs")
+    # Cancel the background queue processor on shutdown, running jobs go back to the queue
     queue_task.cancel()
     try:
         await queue_task
@@ -59,8 +119,22 @@ async def lifespan(app: FastAPI):
         _log.info("Queue processor cancelled.")
 
 
-args = parse_args()
 generation_workers = args.generation_workers
+normalizer = RequestNormalizer.from_args(args)
+Broadcast.max_bytes = args.notification_buffer_bytes
+cost_model = CostModel.from_args(args)
+admission = AdmissionController.from_args(args)
+profiler = tracing.ProfilerCapture(args.profile_dir)
+safety_checker: Optional[SafetyChecker] = None  # Shared by the workers with --safety-check, loaded with the first pipeline
+# Fractions of the base steps at which the previews are screened
+screening_fractions = [float(fraction) for fraction in args.safety_screening_steps.split(",") if fraction.strip()]
+recent_traces = {}  # job_id -> Trace, for the last completed jobs
+MAX_RECENT_TRACES = 100
+recent_results = {}  # job_id -> final message, for the last jobs published by any replica
+MAX_RECENT_RESULTS = 100
+SSE_KEEPALIVE_SECONDS = 15
+MAX_LONG_POLL_SECONDS = 60
+PREEMPTION_CHECK_SECONDS = 2  # Minimum time between two lookups of the queue by a running job
 app = FastAPI(title="SDXL Serving runtime", lifespan=lifespan)
 
 # Cors middleware
@@ -87,56 +161,349 @@ def health() -> HealthCheckResponse:
     return HealthCheckResponse()
 
 
+@app.get("/metrics")
+def get_metrics() -> Response:
+    """Prometheus metrics endpoint."""
+    body, content_type = metrics.latest()
+    return Response(content=body, media_type=content_type)
+
+
 @app.post("/generate")
-async def generate(request: GenerationRequest) -> GenerationResponse:
+async def generate(request: GenerationRequest, http_request: Request) -> GenerationResponse:
     """
     Instead of immediately processing the generation request,
     create a job and place it on the queue. Return the job id.
     """
-    global jobs, job_queue, queue_list
+    global jobs
+
+    if draining and not queue_backend.durable:
+        raise HTTPException(status_code=503, detail="Server is shutting down", headers={"Retry-After": "10"})
+
+    # Snap the request to a supported resolution bucket before enqueuing
+    try:
+        request, bucket = normalizer.normalize(request)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    # Identical seeded requests share the job already queued or running for them
+    key = dedup_key(request) if args.dedup_requests else None
+    shared = inflight_requests.get(key) if key else None
+    if shared is not None and not shared.cancelled and shared.state in ("queued", "processing"):
+        job = Job(str(uuid.uuid4()), request, bucket)
+        job.leader = shared
+        job.state = shared.state
+        shared.subscribers.append(job)
+        jobs[job.id] = job
+        metrics.COALESCED.labels(model_type=args.model_type).inc()
+        _log.info(f"Job {job.id} shares job {shared.id} ({len(shared.subscribers)} requests)")
+        return GenerationResponse(
+            job_id=job.id,
+            bucket=bucket,
+            trace_id=shared.trace.trace_id,
+            estimated_seconds=shared.expected_seconds,
+            shared=True,
+        )
+
+    # Reject the job if the queue is over its limits, so admitted jobs keep a bounded latency
+    client_id = get_client_id(http_request)
+    queued_jobs = await get_queued_jobs()
+    try:
+        admission.admit(client_id, len(queued_jobs), cost_model.backlog_seconds(queued_jobs, generation_workers))
+    except AdmissionRejected as e:
+        metrics.REJECTED.labels(model_type=args.model_type).inc()
+        _log.info(f"Rejected job from {client_id}: {e.reason}, retry after {e.retry_after}s")
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
 
     # Create a unique job id
     job_id = str(uuid.uuid4())
-    job = Job(job_id, request)
+    job = Job(job_id, request, bucket)
+    job.client_id = client_id
+    job.expected_seconds = cost_model.expected_seconds(request)
+    if args.scheduling == "sjf":
+        job.priority = sjf_priority(job.expected_seconds, job.enqueued_at, args.sjf_aging)
+    else:
+        job.priority = job.enqueued_at
     jobs[job_id] = job
+    if key:
+        job.dedup_key = key
+        inflight_requests[key] = job
 
-    # Enqueue the job for processing
-    await job_queue.put(job)
-    queue_list.append(job_id)
+    await enqueue(job)
 
-    _log.info(f"Enqueued job {job_id}")
+    _log.info(f"Enqueued job {job_id} (bucket {bucket})")
+    await update_queue_metrics()
 
     # Notify all connected clients about queue changes
-    await notify_all_queue_positions()
+    await queue_changed()
 
-    response = GenerationResponse(job_id=job_id)
+    response = GenerationResponse(
+        job_id=job_id, bucket=bucket, trace_id=job.trace.trace_id, estimated_seconds=job.expected_seconds
+    )
 
     return response
 
+@app.get("/traces/{job_id}")
+def get_trace(job_id: str):
+    """Return the stage spans of a job in Chrome trace format."""
+    trace = get_run(jobs[job_id]).trace if job_id in jobs else recent_traces.get(job_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_chrome_trace()
+
+
+# Each capture writes a trace of the whole job, keep the disk use bounded
+MAX_PROFILED_JOBS = 10
+
+
+class ProfileRequest(BaseModel):
+    jobs: int = 1
+
+
+@app.post("/admin/profile")
+def arm_profiler(request: ProfileRequest, x_admin_token: Optional[str] = Header(None)):
+    """Arm a torch profiler capture for the next N jobs, 0 disarms it."""
+    check_admin_token(x_admin_token)
+    if not 0 <= request.jobs <= MAX_PROFILED_JOBS:
+        raise HTTPException(status_code=422, detail=f"jobs must be between 0 and {MAX_PROFILED_JOBS}")
+    profiler.arm(request.jobs)
+    return {"status": "armed", "jobs": request.jobs, "directory": profiler.directory}
+
+
+def check_admin_token(token: Optional[str]):
+    # The API listens on every interface, the admin endpoints are disabled without a token
+    if not args.admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if token is None or not hmac.compare_digest(token.encode(), args.admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
 #TODO add a function to cleanup completed jobs that are not being retrieved for more than 1 hour
 
 
 async def notify_all_queue_positions():
-    """Notify all connected WebSocket clients about their queue position."""
-    global websocket_connections, queue_list, jobs
+    """Publish their queue position to the jobs followed by a client."""
+    global progress_listeners, jobs
 
-    for job_id, connections in websocket_connections.items():
+    if not progress_listeners:
+        return
+    queued_jobs = await get_queued_jobs()
+    queued_ids = [job.id for job in queued_jobs]
+    estimates = estimate_queue(queued_jobs)
+    for job_id in list(progress_listeners):
         # Skip jobs that are already being processed or are completed
-        if jobs[job_id].state == "processing" or jobs[job_id].state == "completed":
+        if job_id not in jobs or jobs[job_id].state != "queued":
             continue
+        jobs[job_id].broadcast.publish(queued_message(job_id, estimates, queued_ids))
+
+
+def dedup_key(request: GenerationRequest) -> Optional[str]:
+    """Key of identical normalized requests. Only requests with an explicit seed give identical results."""
+    if request.seed is None:
+        return None
+    return hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+
+
+def get_run(job: Job) -> Job:
+    """The job actually processed for a request, shared with identical requests."""
+    return job.leader or job
 
-        position = get_queue_position(job_id)
-        message = {"status": "queued", "position": position}
-        for ws in connections:
-            try:
-                await ws.send_json(message)
-            except Exception as e:
-                _log.error(f"Error sending message to WebSocket: {e}")
 
+async def publish(run: Job, message: dict):
+    """Publish a message of a job, for the requests sharing it on every API replica."""
+    await broker.publish(JOB_CHANNEL + run.id, message)
 
-def get_queue_position(job_id: str) -> int:
+
+async def queue_changed():
+    """Notify the clients of every API replica about their new queue position."""
+    await broker.publish(QUEUE_CHANNEL, {"event": "changed"})
+
+
+async def on_job_message(channel: str, message: dict):
+    await deliver(channel[len(JOB_CHANNEL) :], message)
+
+
+async def on_queue_message(_channel: str, _message: dict):
+    await notify_all_queue_positions()
+
+
+async def on_control_message(_channel: str, message: dict):
+    # A job cancelled through another replica, stopped at its next step callback
+    job = jobs.get(message.get("cancel"))
+    if job is not None:
+        job.cancelled = True
+
+
+async def deliver(job_id: str, message: dict):
+    """
+    Apply a message published for a job, possibly by a worker in another process,
+    and pass it to the requests of this replica waiting for the job.
+    """
+    status = message.get("status")
+    if status in TERMINAL_STATES and (broker.remote or status == "cancelled"):
+        # Any replica can answer for a job that ended, even if it didn't know it. A
+        # cancelled job is forgotten right away, it must not look like an unknown one.
+        remember_result(job_id, message)
+    run = jobs.get(job_id)
+    if status in TERMINAL_STATES and (status != "cancelled" or (run is not None and run.state != "queued")):
+        # Jobs processed by the workers of every replica, they share the queue
+        admission.record_completion()
+    if run is None:
+        return
+    if status == "processing":
+        set_state(run, "processing")
+    elif status == "preempted":
+        set_state(run, "queued")
+    elif status in TERMINAL_STATES:
+        if status == "completed":
+            run.result = message.get("image")
+        set_state(run, status)
+    for subscriber in list(run.subscribers):
+        subscriber.broadcast.publish(message)
+    if status in TERMINAL_STATES:
+        admission.release(run.client_id)
+        run.client_id = None
+        end_run(run)
+
+
+def remember_result(job_id: str, message: dict):
+    """Keep the final message of a job for the clients asking after it was forgotten."""
+    recent_results[job_id] = message
+    while len(recent_results) > MAX_RECENT_RESULTS:
+        recent_results.pop(next(iter(recent_results)))
+
+
+def set_state(run: Job, state: str):
+    """Set the state of a job and of the requests sharing it."""
+    run.state = state
+    for subscriber in run.subscribers:
+        subscriber.state = state
+        subscriber.result = run.result
+
+
+def end_run(run: Job):
+    """Forget a job that reached a final state, and the requests sharing it nobody is listening to."""
+    if run.dedup_key and inflight_requests.get(run.dedup_key) is run:
+        del inflight_requests[run.dedup_key]
+    for job in [run] + run.subscribers:
+        if job.id not in progress_listeners and (job.state == "cancelled" or job.detached):
+            jobs.pop(job.id, None)
+
+
+async def enqueue(job: Job):
+    """Put a job in the queue backend and wake up the idle workers."""
+    payload = {
+        "request": job.request.model_dump(),
+        "bucket": job.bucket,
+        "enqueued_at": job.enqueued_at,
+        "priority": job.priority,
+    }
+    await asyncio.to_thread(queue_backend.put, job.id, payload, job.priority)
+    queue_event.set()
+
+
+def restore_job(job_id: str, payload: dict) -> Job:
+    """Job object for a job queued by another replica, or before a restart."""
+    job = Job(job_id, GenerationRequest(**payload["request"]), payload.get("bucket"))
+    job.enqueued_at = job.queued_at = payload["enqueued_at"]
+    job.priority = payload["priority"]
+    job.expected_seconds = cost_model.expected_seconds(job.request)
+    return job
+
+
+async def find_job(job_id: str) -> Optional[Job]:
+    """Return a job, restoring it from the queue backend if this replica doesn't know it yet."""
+    if job_id in jobs:
+        return jobs[job_id]
+    if job_id in recent_results:
+        # Ended, possibly not yet acknowledged in the queue backend
+        return None
+    queued = await asyncio.to_thread(queue_backend.get, job_id)
+    if queued is None:
+        return None
+    state, payload = queued
+    job = restore_job(job_id, payload)
+    job.state = "queued" if state == "queued" else "processing"
+    jobs[job_id] = job
+    restored_jobs.pop(job_id, None)
+    return job
+
+
+def preemption_candidates(job: Job) -> list:
+    """Queued jobs short enough for the running job to yield to them, see --preemption-ratio."""
+    remaining = cost_model.remaining_seconds(job)
+    if remaining is None:
+        return []
+    candidates = []
+    # Called from the worker thread, the backend is thread-safe
+    for queued_id, payload in queue_backend.queued():
+        queued = jobs.get(queued_id) or restore_job(queued_id, payload)
+        if queued.cancelled:
+            continue
+        expected = cost_model.expected_seconds(queued.request)
+        if expected is not None and expected * args.preemption_ratio <= remaining:
+            candidates.append(queued)
+    return candidates
+
+
+def get_client_id(http_request: Request) -> Optional[str]:
+    """Identify the client by its address, as forwarded by the router if present."""
+    forwarded = http_request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return http_request.client.host if http_request.client else None
+
+
+async def get_queued_jobs() -> list:
+    """
+    Queued jobs in processing order, including the ones queued by other replicas. The
+    backend is read in a thread, a durable backend queries its database.
+    """
+    global restored_jobs
+
+    queued = await asyncio.to_thread(queue_backend.queued)
+    # Jobs of other replicas are restored once, while they stay queued
+    restored_jobs = {
+        job_id: restored_jobs.get(job_id) or restore_job(job_id, payload)
+        for job_id, payload in queued
+        if job_id not in jobs
+    }
+    return [jobs.get(job_id) or restored_jobs[job_id] for job_id, _ in queued]
+
+
+def estimate_queue(queued_jobs: list) -> dict:
+    """Estimated start and completion times of the queued jobs, see CostModel.schedule."""
+    running = [job for job in jobs.values() if job.state == "processing" and job.leader is None]
+    return cost_model.schedule(running, queued_jobs, generation_workers)
+
+
+def queued_message(job_id: str, estimates: dict, queued_ids: list) -> dict:
+    """Queue status of a job, with its estimated start and completion times when known."""
+    message = {"status": "queued", "position": get_queue_position(job_id, queued_ids)}
+    run_id = get_run(jobs[job_id]).id if job_id in jobs else job_id
+    if run_id in estimates:
+        message["estimated_start"], message["estimated_completion"] = estimates[run_id]
+    return message
+
+
+async def update_queue_metrics():
+    """Update the queue length and backlog metrics of each resolution bucket."""
+    by_bucket = defaultdict(list)
+    for job in await get_queued_jobs():
+        by_bucket[job.bucket].append(job)
+    metrics.update_queue(
+        args.model_type,
+        {
+            bucket: (len(queued_jobs), cost_model.backlog_seconds(queued_jobs, generation_workers))
+            for bucket, queued_jobs in by_bucket.items()
+        },
+    )
+
+
+def get_queue_position(job_id: str, queued_ids: list) -> int:
     """Return the queue position (1-based) of a job, or -1 if not in queue."""
-    return queue_list.index(job_id) + 1 if job_id in queue_list else -1
+    if job_id in jobs:
+        job_id = get_run(jobs[job_id]).id
+    return queued_ids.index(job_id) + 1 if job_id in queued_ids else -1
 
 
 @app.websocket("/progress/{job_id}")
@@ -148,77 +515,278 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str):
     """
     await websocket.accept()
 
-    if job_id not in jobs:
-        await websocket.send_json({"status": "error", "message": "Job not found."})
+    job = await find_job(job_id)
+    if job is None:
+        await websocket.send_json(recent_results.get(job_id) or {"status": "error", "message": "Job not found."})
         await websocket.close()
         return
 
-    job = jobs[job_id]
-
     # Track active WebSocket connections for this job
-    if job_id not in websocket_connections:
-        websocket_connections[job_id] = set()
-    websocket_connections[job_id].add(websocket)
+    add_listener(job_id, websocket)
+    metrics.WEBSOCKET_CONNECTIONS.inc()
 
     try:
-        # Send initial queue position
-        position = get_queue_position(job_id)
-        if position > 0:
-            await websocket.send_json({"status": "queued", "position": position})
+        # Publish the current queue position, the subscription below starts from it
+        await publish_queue_position(job)
 
         # If the job is completed, send the result immediately.
+        if job.detached:
+            await websocket.send_json({"status": "cancelled", "message": "Job was cancelled."})
+            await websocket.close()
+            return
         if job.state == "completed":
             await websocket.send_json({"status": "completed", "image": job.result})
             await websocket.close()
             return
+        if job.state in TERMINAL_STATES:
+            await websocket.send_json({"status": job.state, "message": f"Job is {job.state}."})
+            await websocket.close()
+            return
 
-        # Otherwise, listen for notifications.
-        while True:
-            msg = await job.notification_queue.get()
-            await websocket.send_json(msg)
-            if msg.get("status") in ("completed", "error"):
-                break
+        # Otherwise, listen for notifications until the job ends or the client leaves,
+        # starting from the latest one
+        subscription = job.broadcast.subscribe()
+        disconnect_task = asyncio.create_task(wait_for_disconnect(websocket))
+        try:
+            while True:
+                get_task = asyncio.create_task(subscription.get())
+                done, _ = await asyncio.wait({get_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+                if get_task not in done:
+                    get_task.cancel()
+                    raise WebSocketDisconnect()
+                msg = get_task.result()
+                await websocket.send_json(msg)
+                if msg.get("status") in TERMINAL_STATES:
+                    break
+        finally:
+            disconnect_task.cancel()
 
     except WebSocketDisconnect:
         _log.info(f"WebSocket disconnected for job {job_id}")
 
     finally:
-        websocket_connections[job_id].remove(websocket)
-        if not websocket_connections[job_id]:
-            del websocket_connections[job_id]
-        # Remove the job from the queue, and delete the job if it's completed.
-        if job.state in ("completed", "error"):
-            del jobs[job_id]
+        metrics.WEBSOCKET_CONNECTIONS.dec()
+        remove_listener(job, websocket)
+
+
+def add_listener(job_id: str, listener):
+    """Register a client following a job, a WebSocket, an event stream or a long poll."""
+    progress_listeners.setdefault(job_id, set()).add(listener)
+
+
+def remove_listener(job: Job, listener, abandon: bool = True):
+    """
+    Unregister a client following a job. If it was the last one, the job is cancelled
+    unless a client comes back within the grace period; long polls come back by design
+    and don't abandon the job. A job that ended is forgotten.
+    """
+    listeners = progress_listeners[job.id]
+    listeners.remove(listener)
+    if not listeners:
+        del progress_listeners[job.id]
+        # Nobody is watching anymore, cancel the job unless a client comes back
+        if abandon and job.state not in TERMINAL_STATES and args.cancel_grace_period >= 0:
+            asyncio.create_task(cancel_if_abandoned(job, args.cancel_grace_period))
+    if job.state in TERMINAL_STATES:
+        jobs.pop(job.id, None)
+
+
+async def publish_queue_position(job: Job):
+    """Publish the queue position of a queued job to its subscribers."""
+    queued_jobs = await get_queued_jobs()
+    queued_ids = [queued.id for queued in queued_jobs]
+    if get_queue_position(job.id, queued_ids) > 0:
+        job.broadcast.publish(queued_message(job.id, estimate_queue(queued_jobs), queued_ids))
+
+
+def event_id(last_event_id: Optional[str], after: Optional[int]) -> Optional[int]:
+    """Seq to resume after, from the Last-Event-ID header or the after parameter."""
+    if after is not None or last_event_id is None:
+        return after
+    try:
+        return int(last_event_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Last-Event-ID must be a message seq")
+
+
+def server_sent_event(seq: Optional[int], message: dict) -> str:
+    event = f"data: {json.dumps(message)}\n\n"
+    return event if seq is None else f"id: {seq}\n{event}"
+
+
+@app.get("/progress/{job_id}/events")
+async def stream_job_events(job_id: str, after: Optional[int] = None, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events stream of the messages of a job, the same as on the WebSocket.
+    Each event id is the seq of the message: a client reconnecting with Last-Event-ID
+    (or ?after=<seq>) resumes after it, minus the progress messages superseded since.
+    """
+    after = event_id(last_event_id, after)
+    job = await find_job(job_id)
+    if job is None:
+        if job_id not in recent_results:
+            raise HTTPException(status_code=404, detail="Job not found")
+        final = server_sent_event(None, recent_results[job_id])
+        return StreamingResponse(iter([final]), media_type="text/event-stream")
+
+    if after is None:
+        await publish_queue_position(job)
+    subscription = job.broadcast.subscribe(after)
+    listener = object()
+    add_listener(job_id, listener)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    seq, message = await asyncio.wait_for(subscription.next(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield server_sent_event(seq, message)
+                if message.get("status") in TERMINAL_STATES:
+                    return
+        finally:
+            remove_listener(job, listener)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def parse_wait(wait: str) -> float:
+    """Long poll duration, as seconds with an optional s suffix ("30s")."""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)s?", wait.strip())
+    if match is None:
+        raise HTTPException(status_code=422, detail="wait must be a duration in seconds, e.g. 30s")
+    return min(float(match.group(1)), MAX_LONG_POLL_SECONDS)
+
+
+async def long_poll(job: Job, after: Optional[int], timeout: float) -> dict:
+    """Wait for the first message after the seq `after`, or return the latest one on timeout."""
+    if after is None:
+        await publish_queue_position(job)
+    subscription = job.broadcast.subscribe(after)
+    listener = object()
+    add_listener(job.id, listener)
+    try:
+        seq, message = await asyncio.wait_for(subscription.next(), timeout)
+    except asyncio.TimeoutError:
+        seq, message = job.broadcast.latest_seq, job.broadcast.latest or {"status": job.state}
+    finally:
+        remove_listener(job, listener, abandon=False)
+    return {**message, "seq": seq}
+
+
+async def wait_for_disconnect(websocket: WebSocket):
+    """Return when the client closes the WebSocket, ignoring anything it sends."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def cancel_if_abandoned(job: Job, grace_period: float):
+    """Cancel a job whose last subscriber left, if nobody subscribed again during the grace period."""
+    await asyncio.sleep(grace_period)
+    if job.id not in progress_listeners and job.state not in TERMINAL_STATES and not job.detached:
+        _log.info(f"Cancelling job {job.id}, no subscriber for {grace_period}s")
+        await cancel_job(job)
+
+
+async def cancel_job(job: Job):
+    """
+    Cancel a job. A queued job is removed from the queue immediately, a running job
+    is interrupted at its next step callback. A job shared by identical requests goes
+    on until every request sharing it is cancelled.
+    """
+    run = get_run(job)
+    if job in run.subscribers and len(run.subscribers) > 1:
+        await detach(job)
+        return
+
+    run.cancelled = True
+    # Removes a queued job, and stops it if a worker of another process is running it
+    await asyncio.to_thread(queue_backend.cancel, run.id)
+    await broker.publish(CONTROL_CHANNEL, {"cancel": run.id})
+    if run.state == "queued":
+        set_state(run, "cancelled")
+        metrics.observe_job(args.model_type, run.bucket, run.state, 0)
+        admission.release(run.client_id)
+        run.client_id = None
+        await update_queue_metrics()
+        await publish(run, {"status": "cancelled", "message": "Job was cancelled."})
+        await queue_changed()
+        end_run(run)
+
+
+async def detach(job: Job):
+    """Cancel one of the requests sharing a job, the others keep receiving its messages."""
+    run = get_run(job)
+    run.subscribers.remove(job)
+    job.detached = True
+    if job is not run:
+        job.state = "cancelled"
+    # The request no longer waits for the job, free its slot now
+    admission.release(job.client_id)
+    job.client_id = None
+    message = {"status": "cancelled", "message": "Job was cancelled."}
+    job.broadcast.publish(message)
+    remember_result(job.id, message)
+    if job is not run and job.id not in progress_listeners:
+        jobs.pop(job.id, None)
+
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancel a queued or running job."""
+    job = await find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.detached:
+        return {"job_id": job_id, "status": "cancelled"}
+    if job.state in TERMINAL_STATES:
+        return {"job_id": job_id, "status": job.state}
+    await cancel_job(job)
+    cancelled = job.state == "cancelled" or job.detached
+    return {"job_id": job_id, "status": "cancelled" if cancelled else "cancelling"}
 
 
 @app.get("/progress/{job_id}")
-async def get_job_status(job_id: str):
+async def get_job_status(job_id: str, wait: Optional[str] = None, after: Optional[int] = None):
     """
     GET endpoint for clients to poll for updates on a given job.
     Returns JSON messages with progress updates and, when completed, the generated image (base64 encoded).
+    With `wait` (e.g. `?wait=30s&after=<seq>`), long polls: returns the first message
+    after the seq `after` as soon as it is published, with its `seq`.
     """
-    if job_id not in jobs:
+    job = await find_job(job_id)
+    if job is None:
+        if job_id in recent_results:
+            return recent_results[job_id]
         raise HTTPException(status_code=404, detail="Job not found")
-
-    job = jobs[job_id]
+    if wait is not None:
+        return await long_poll(job, after, parse_wait(wait))
 
     # Get queue position
-    position = get_queue_position(job_id)
-    if position > 0:
-        return {"status": "queued", "position": position}
+    queued_jobs = await get_queued_jobs()
+    queued_ids = [queued.id for queued in queued_jobs]
+    if get_queue_position(job_id, queued_ids) > 0:
+        return queued_message(job_id, estimate_queue(queued_jobs), queued_ids)
 
     # If the job is already completed, return the result immediately.
     if job.state == "completed":
         result = {"status": "completed", "image": job.result}
         del jobs[job_id]
         return result
+    if job.state == "cancelled" or job.detached:
+        if job.state in TERMINAL_STATES:
+            del jobs[job_id]
+        return {"status": "cancelled", "message": "Job was cancelled."}
 
     # Otherwise, return the latest available status
-    # Empty the notification_queue and keep only the last message
-    msg = None
-    while not job.notification_queue.empty():
-        msg = await job.notification_queue.get()
-    return msg
+    return job.broadcast.latest
 
 
 @app.get("/video/{job_id}")
@@ -248,109 +816,272 @@ async def get_video(job_id: str):
 ##################################
 
 
-async def worker(worker_id, job_queue, pipeline_instance):
+def preview_latents(pipeline_instance, latents) -> str:
+    """Use the appropriate latent processing function based on pipeline type."""
+    if isinstance(pipeline_instance, FluxModelPipeline):
+        return process_flux_latents(pipeline_instance, latents)
+    elif isinstance(pipeline_instance, WanModelPipeline):
+        return process_wan_latents(pipeline_instance, latents)
+    elif isinstance(pipeline_instance, MockModelPipeline):
+        return process_mock_latents(pipeline_instance, latents)
+    else:
+        return process_latents(pipeline_instance, latents)
+
+
+async def next_lease(worker_name: str):
+    """Wait for a job and lease it. Returns None once the server is draining."""
+    while not draining:
+        queue_event.clear()
+        lease = await asyncio.to_thread(queue_backend.lease, worker_name, args.lease_seconds)
+        if lease is not None:
+            return lease
+        # Jobs queued by other replicas are only seen by polling
+        try:
+            await asyncio.wait_for(queue_event.wait(), args.queue_poll_interval)
+        except asyncio.TimeoutError:
+            pass
+    return None
+
+
+async def keep_lease(lease, job: Job):
+    """Extend the lease of a running job. If it was lost or the job was cancelled elsewhere, stop the job."""
+    while True:
+        await asyncio.sleep(args.lease_seconds / 3)
+        if not await asyncio.to_thread(queue_backend.extend, lease, args.lease_seconds):
+            _log.warning(f"Lease of job {job.id} lost or cancelled, stopping it")
+            job.cancelled = True
+            return
+
+
+async def worker(worker_id, pipeline_instance):
     """
     Worker function that processes jobs from the queue.
     Callback functions are used by predict to notify the client of progress.
     """
+    worker_name = f"{socket.gethostname()}-{os.getpid()}-{worker_id}"
     while True:
-        job = await job_queue.get()
-        queue_list.remove(job.id)
+        lease = await next_lease(worker_name)
+        if lease is None:
+            _log.info(f"Worker {worker_id} stopped")
+            return
+        job = jobs.get(lease.job_id)
+        if job is None:
+            # Queued by another replica or before a restart
+            job = restore_job(lease.job_id, lease.payload)
+            jobs[job.id] = job
+        if job.cancelled:
+            # Already notified when it was cancelled
+            await asyncio.to_thread(queue_backend.ack, lease)
+            continue
+        await update_queue_metrics()
+        lease_task = asyncio.create_task(keep_lease(lease, job))
+        job_labels = metrics.labels(args.model_type, job.bucket)
+        start_time = time.time()
+        job.started_at = start_time
+        metrics.QUEUE_WAIT.labels(**job_labels).observe(start_time - job.queued_at)
+        job.trace.add_span("queue_wait", job.queued_at, start_time)
+        trace_token = tracing.current_trace.set(job.trace)
 
         try:
-            job.state = "processing"
+            set_state(job, "processing")
             _log.info(f"Worker {worker_id} processing job {job.id}")
 
             # Notify clients about queue updates
-            await notify_all_queue_positions()
+            await queue_changed()
 
-            await job.notification_queue.put(
-                {"status": "processing", "message": "Job is processing."}
+            remaining = cost_model.remaining_seconds(job, start_time)
+            await publish(
+                job,
+                {
+                    "status": "processing",
+                    "message": "Job is processing.",
+                    "estimated_completion": None if remaining is None else start_time + remaining,
+                }
             )
             # Get the current event loop
             loop = asyncio.get_event_loop()
+            step_timer = metrics.StepTimer(args.model_type, job.bucket, job.trace)
+            # With a refiner, the base pipeline stops at denoising_limit and only its previews are screened
+            base_steps = getattr(pipeline_instance, "base_steps", lambda request: request.num_inference_steps)
+            screened_steps = screening_steps(screening_fractions, base_steps(job.request)) if safety_checker else set()
+            job.flagged_step = None
+
+            def screen_preview(_pipe, step, base64_image) -> bool:
+                """Screen the preview of a step, stop the job if it is flagged."""
+                if step not in screened_steps:
+                    return False
+                with job.trace.span("safety_screening", step=step):
+                    preview = Image.open(io.BytesIO(base64.b64decode(base64_image)))
+                    # Batched with the checks of the other workers, which share the model
+                    score = asyncio.run_coroutine_threadsafe(safety_checker.score(preview), loop).result()
+                if score <= args.safety_screening_threshold:
+                    return False
+                job.flagged_step = step
+                _pipe._interrupt = True
+                return True
+
+            def estimated_completion() -> Optional[float]:
+                remaining = cost_model.remaining_seconds(job)
+                return None if remaining is None else time.time() + remaining
 
             # Define a callback function to send progress updates to the client.
             def callback_func_base(_pipe, step, _timestep, callback_kwargs):
+                if job.cancelled:
+                    _pipe._interrupt = True
+                    return {}
+                step_timer.step("base", step)
+                job.record_step()
+                preview_start = time.time()
                 latents = callback_kwargs["latents"]
-                # Use appropriate latent processing function based on pipeline type
-                if isinstance(pipeline_instance, FluxModelPipeline):
-                    base64_image = process_flux_latents(pipeline_instance, latents)
-                elif isinstance(pipeline_instance, WanModelPipeline):
-                    base64_image = process_wan_latents(pipeline_instance, latents)
-                else:
-                    base64_image = process_latents(pipeline_instance, latents)
-                
+                base64_image = preview_latents(pipeline_instance, latents)
+                step_timer.preview_decoded(preview_start)
+                if base64_image is not None and screen_preview(_pipe, step, base64_image):
+                    # The flagged preview is not sent
+                    return {}
+
                 # Calculate progress percentage for more accurate reporting
                 total_steps = job.request.num_inference_steps
                 progress_pct = int((step + 1) / total_steps * 100)
                 
                 future = asyncio.run_coroutine_threadsafe(
-                    job.notification_queue.put(
+                    publish(
+                        job,
                         {
                             "pipeline": "base",
                             "status": "progress",
                             "step": step,
                             "progress": progress_pct,
                             "image": base64_image,
+                            "estimated_completion": estimated_completion(),
+                            "timestamp": time.time(),
                         }
                     ),
                     loop,
                 )
                 future.result()  # Wait for the coroutine to finish
+                step_timer.preview_done(preview_start, "base", step)
                 return {}
 
             def callback_func_refiner(_pipe, step, _timestep, callback_kwargs):
+                if job.cancelled:
+                    _pipe._interrupt = True
+                    return {}
+                step_timer.step("refiner", step)
+                job.record_step()
+                preview_start = time.time()
                 latents = callback_kwargs["latents"]
-                # Use appropriate latent processing function based on pipeline type
-                if isinstance(pipeline_instance, FluxModelPipeline):
-                    base64_image = process_flux_latents(pipeline_instance, latents)
-                elif isinstance(pipeline_instance, WanModelPipeline):
-                    base64_image = process_wan_latents(pipeline_instance, latents)
-                else:
-                    base64_image = process_latents(pipeline_instance, latents)
+                base64_image = preview_latents(pipeline_instance, latents)
+                step_timer.preview_decoded(preview_start)
                 future = asyncio.run_coroutine_threadsafe(
-                    job.notification_queue.put(
+                    publish(
+                        job,
                         {
                             "pipeline": "refiner",
                             "status": "progress",
                             "step": step,
                             "image": base64_image,
+                            "estimated_completion": estimated_completion(),
+                            "timestamp": time.time(),
                         }
                     ),
                     loop,
                 )
                 future.result()  # Wait for the coroutine to finish
+                step_timer.preview_done(preview_start, "refiner", step)
                 return {}
 
+            preemption_checked_at = time.monotonic()
+
+            def should_preempt() -> bool:
+                # Called by the pipeline at each step boundary
+                nonlocal preemption_checked_at
+                if job.preemptions >= args.max_preemptions:
+                    # Yielded enough, a steady stream of short jobs must not starve it
+                    return False
+                if time.monotonic() - preemption_checked_at < PREEMPTION_CHECK_SECONDS:
+                    return False
+                preemption_checked_at = time.monotonic()
+                yield_to = preemption_candidates(job)
+                if not yield_to:
+                    return False
+                # Resume right after the jobs this one yields to
+                job.priority = max(queued.priority for queued in yield_to)
+                return True
+
+            def run_predict(profile: bool):
+                # Runs in the worker thread so the profiler captures the pipeline ops
+                with profiler.profile(job.id) if profile else nullcontext():
+                    if args.preemption and getattr(pipeline_instance, "supports_preemption", False):
+                        return pipeline_instance.predict(
+                            job.request,
+                            callback_func_base,
+                            callback_func_refiner,
+                            checkpoint=job.checkpoint,
+                            preempt=should_preempt,
+                        )
+                    return pipeline_instance.predict(job.request, callback_func_base, callback_func_refiner)
+
             # Run the prediction in a thread to avoid blocking the event loop.
-            start_time = time.time()
-            image = await asyncio.to_thread(
-                pipeline_instance.predict,
-                job.request,
-                callback_func_base,
-                callback_func_refiner,
-            )
-            processing_time = time.time() - start_time
+            with job.trace.span("predict"):
+                image = await asyncio.to_thread(run_predict, profiler.take())
+            processing_time = job.processing_seconds + time.time() - start_time
+
+            if job.cancelled:
+                job.state = "cancelled"
+                await publish(job, {"status": "cancelled", "message": "Job was cancelled."})
+                _log.info(f"Worker {worker_id} cancelled job {job.id} after {processing_time:.2f} seconds")
+                continue
+
+            if job.flagged_step is not None:
+                job.state = "failed"
+                metrics.SAFETY_STOPPED.labels(**job_labels).inc()
+                await publish(
+                    job,
+                    {
+                        "status": "failed",
+                        "message": "Job stopped, its preview was flagged by the safety checker.",
+                        "nsfw_content_detected": True,
+                        "step": job.flagged_step,
+                        "processing_time": processing_time,
+                    }
+                )
+                _log.warning(f"Worker {worker_id} stopped job {job.id} at step {job.flagged_step}, preview flagged")
+                continue
+
+            flagged = False
+            if args.safety_check and safety_checker is not None and isinstance(image, Image.Image):
+                safety_start = time.perf_counter()
+                with job.trace.span("safety_check"):
+                    flagged = await safety_checker.score(image) > 0
+                metrics.SAFETY_CHECK.labels(**job_labels).observe(time.perf_counter() - safety_start)
+                if flagged:
+                    _log.warning(f"Worker {worker_id} job {job.id}: result flagged by the safety checker, replaced")
+                    metrics.SAFETY_FLAGGED.labels(**job_labels).inc()
+                    image = Image.new("RGB", image.size)
+
+            postprocess_start = time.perf_counter()
 
             # Prepare image bytes
-            img_bytes = io.BytesIO()
-            image.save(img_bytes, format="PNG")
-            img_bytes.seek(0)
-            encoded_image = base64.b64encode(img_bytes.read()).decode("utf-8")
+            with job.trace.span("encoding"):
+                img_bytes = io.BytesIO()
+                image.save(img_bytes, format="PNG")
+                img_bytes.seek(0)
+                encoded_image = base64.b64encode(img_bytes.read()).decode("utf-8")
 
             # Add watermark to the base64 encoded image if it's enabled 
             
             enable_watermark = os.getenv("ENABLE_WATERMARK", "true")
             if enable_watermark == "true":
                 watermark_text = os.getenv("WATERMARK_TEXT", "AI-generated Image. Demo purposes only. More info at red.ht/maas")
-                watermarked_image = add_watermark(encoded_image, watermark_text)
+                with job.trace.span("watermark"):
+                    watermarked_image = add_watermark(encoded_image, watermark_text)
                 job.result = watermarked_image
             else:
                 job.result = encoded_image
+            metrics.POSTPROCESS.labels(**job_labels).observe(time.perf_counter() - postprocess_start)
 
-            # For WAN models, send additional video info
-            if isinstance(pipeline_instance, WanModelPipeline):
+            # For WAN models, send additional video info, not for a flagged video
+            if isinstance(pipeline_instance, WanModelPipeline) and not flagged:
                 # Get the video path
                 video_path = os.path.abspath("/tmp/temp_output.mp4")
                 if os.path.exists(video_path):
@@ -361,17 +1092,21 @@ async def worker(worker_id, job_queue, pipeline_instance):
                         "num_frames": getattr(job.request, 'num_frames', 81),
                         "duration": getattr(job.request, 'num_frames', 81) / getattr(job.request, 'fps', 15),
                     }
-                    await job.notification_queue.put(video_info)
+                    await publish(job, video_info)
                     _log.info(f"Video ready: {video_path}, duration: {video_info['duration']:.2f}s")
                 else:
                     _log.warning(f"Video file not found at {video_path}")
 
             # Handle the result and notify the client
-            await job.notification_queue.put(
+            await publish(
+                job,
                 {
                     "status": "completed",
                     "image": job.result,
+                    "nsfw_content_detected": flagged,
                     "processing_time": processing_time,
+                    "trace_id": job.trace.trace_id,
+                    "timings": job.trace.summary(),
                 }
             )
             job.state = "completed"
@@ -379,6 +1114,24 @@ async def worker(worker_id, job_queue, pipeline_instance):
                 f"Worker {worker_id} completed job {job.id} in {processing_time:.2f} seconds"
             )
 
+        except Preempted as e:
+            # Put the job back in the queue, it resumes from its checkpoint once the shorter jobs are done
+            job.checkpoint = e.checkpoint
+            job.preemptions += 1
+            set_state(job, "queued")
+            job.queued_at = time.time()
+            job.last_step_at = None
+            lease_task.cancel()
+            await asyncio.to_thread(queue_backend.release, lease, job.priority)
+            lease = None
+            queue_event.set()
+            _log.info(f"Worker {worker_id} preempted job {job.id} at step {e.checkpoint.step}")
+            await publish(
+                job,
+                {"status": "preempted", "step": e.checkpoint.step, "message": "Job paused for shorter jobs."}
+            )
+            await queue_changed()
+
         except Exception as e:
             _log.error(f"Worker {worker_id} failed to process job {job.id}: {e}")
             job.state = "failed"
@@ -396,7 +1149,7 @@ async def worker(worker_id, job_queue, pipeline_instance):
                             "num_frames": getattr(job.request, 'num_frames', 81),
                             "error": "Preview failed but video was generated",
                         }
-                        await job.notification_queue.put(video_info)
+                        await publish(job, video_info)
                         _log.info(f"Video ready despite error: {video_path}")
                         
                         # Create a placeholder image for preview
@@ -416,30 +1169,55 @@ async def worker(worker_id, job_queue, pipeline_instance):
                         # Set as result and mark job as completed with warning
                         job.result = encoded_image
                         job.state = "completed"
-                        await job.notification_queue.put({
+                        await publish(job, {
                             "status": "completed",
                             "image": job.result,
                             "processing_time": time.time() - start_time,
                             "warning": f"Preview failed but video was generated: {str(e)}"
                         })
                         _log.info(f"Worker {worker_id} completed job {job.id} with preview error")
-                        job_queue.task_done()
                         continue
             except Exception as inner_e:
                 _log.error(f"Error handling video fallback: {inner_e}")
             
             # If we got here, send the error message
-            await job.notification_queue.put({"status": "failed", "message": str(e)})
+            await publish(job, {"status": "failed", "message": str(e)})
 
         finally:
-            job_queue.task_done()
+            tracing.current_trace.reset(trace_token)
+            lease_task.cancel()
+            job.processing_seconds += time.time() - start_time
+            if lease is not None:
+                if job.state in TERMINAL_STATES:
+                    await asyncio.to_thread(queue_backend.ack, lease)
+                else:
+                    # Interrupted by a shutdown, another worker takes the job over
+                    await asyncio.to_thread(queue_backend.release, lease)
+            # A preempted or interrupted job is back in the queue and finishes later
+            if job.state in TERMINAL_STATES:
+                job.checkpoint = None
+                set_state(job, job.state)
+                end_run(job)
+                job.trace.export(args.trace_dir)
+                recent_traces[job.id] = job.trace
+                while len(recent_traces) > MAX_RECENT_TRACES:
+                    recent_traces.pop(next(iter(recent_traces)))
+                metrics.observe_job(args.model_type, job.bucket, job.state, job.processing_seconds)
+                if job.state == "completed":
+                    cost_model.observe_job(
+                        job.request, job.processing_seconds, job.steps_done, job.mean_step_seconds()
+                    )
+                if worker_only:
+                    jobs.pop(job.id, None)
+            metrics.update_device_memory()
+            await update_queue_metrics()
 
 
 async def process_queue():
     """
     Background task that continuously processes jobs from the queue.
     """
-    global job_queue, args
+    global args, safety_checker
 
     _log.info(f"Device: {args.device}")
     _log.info(f"Model Type: {args.model_type}")
@@ -458,6 +1236,9 @@ async def process_queue():
             elif args.model_type == "wan":
                 _log.info(f"Worker {i}: Creating WAN pipeline...")
                 pipeline_instance = WanModelPipeline(args)
+            elif args.model_type == "mock":
+                _log.info(f"Worker {i}: Creating mock pipeline...")
+                pipeline_instance = MockModelPipeline(args)
             else:
                 _log.info(f"Worker {i}: Creating SDXL pipeline...")
                 pipeline_instance = DiffusersPipeline(args)
@@ -465,7 +1246,9 @@ async def process_queue():
             _log.info(f"Worker {i}: Loading model...")
             pipeline_instance.load()
             _log.info(f"Worker {i}: Model loaded successfully!")
-            worker_task = asyncio.create_task(worker(i, job_queue, pipeline_instance))
+            if (args.safety_check or screening_fractions) and safety_checker is None:
+                safety_checker = SafetyChecker.load(pipeline_instance, args.safety_checker_id, args.safety_batch_size)
+            worker_task = asyncio.create_task(worker(i, pipeline_instance))
             workers.append(worker_task)
             _log.info(f"Worker {i} initialized and started")
         except Exception as e:
@@ -476,7 +1259,7 @@ async def process_queue():
     if not workers:
         _log.error("No workers were initialized successfully! Jobs will remain queued.")
     
-    # Wait for all workers to complete (they won't, as they run indefinitely)
+    # Wait for all workers to complete (only when draining on shutdown)
     await asyncio.gather(*workers)
 
 
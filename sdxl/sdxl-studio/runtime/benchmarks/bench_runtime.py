@@ -0,0 +1,375 @@
+"""
+CPU benchmark of the generation runtime using tiny random-weight pipelines.
+
+Drives DiffusersPipeline, FluxModelPipeline and WanModelPipeline directly and
+through app.worker, and reports per-stage timings as JSON so that results can be
+compared between commits:
+
+    python benchmarks/bench_runtime.py --output bench.json
+    python benchmarks/bench_runtime.py --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+RUNTIME_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUNTIME_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import diffusers  # noqa: E402
+import torch  # noqa: E402
+
+import latents_preview  # noqa: E402
+import watermark  # noqa: E402
+from classes import GenerationRequest, Job  # noqa: E402
+from tiny_pipelines import (PIPELINE_TYPES, TINY_REQUESTS, build_pipeline,  # noqa: E402
+                            write_taesd_weights)
+
+PREVIEW_FUNCTIONS = {
+    "sdxl": "process_latents",
+    "flux": "process_flux_latents",
+    "wan": "process_wan_latents",
+}
+
+# Stages every case must record, a missing one means it failed or was skipped
+EXPECTED_STAGES = {"text_encoding", "preview_decode", "final_decode", "encoding", "postprocess_watermark", "total"}
+
+
+class ErrorLog(logging.Handler):
+    """Keeps the error records of a logger."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@contextmanager
+def logged_errors(logger_name):
+    """
+    Error records logged by a module while the block runs. The Flux and WAN previews
+    log a failed decode and return a placeholder image instead of raising, a benchmark
+    must not time that path.
+    """
+    handler = ErrorLog()
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(handler)
+    try:
+        yield handler.records
+    finally:
+        logger.removeHandler(handler)
+
+
+class StageRecorder:
+    """Collects stage durations for one benchmark case."""
+
+    def __init__(self):
+        self.stages = defaultdict(list)
+        self.errors = []
+        self.last_step_end = None
+        self.predict_end = None
+
+    def add(self, stage, seconds):
+        self.stages[stage].append(seconds)
+
+    def timed(self, stage, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    def preview(self, func):
+        """
+        Wrap a preview decode function. It is called once per step callback, so the
+        time since the previous callback (or the end of text encoding) is the step time.
+        """
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            if self.last_step_end is not None:
+                self.add("denoise_step", start - self.last_step_end)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                # The worker may still complete a WAN job whose preview failed
+                self.errors.append(e)
+                raise
+            finally:
+                self.last_step_end = time.perf_counter()
+                self.add("preview_decode", self.last_step_end - start)
+
+        return wrapper
+
+    def text_encoding(self, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.last_step_end = time.perf_counter()
+                self.add("text_encoding", self.last_step_end - start)
+
+        return wrapper
+
+    def check(self, steps):
+        """Raise if a stage failed or was not recorded in the measured runs."""
+        if self.errors:
+            raise self.errors[0]
+        expected = EXPECTED_STAGES | ({"denoise_step"} if steps > 1 else set())
+        missing = expected - set(self.stages)
+        if missing:
+            raise RuntimeError(f"Stages not completed: {', '.join(sorted(missing))}")
+
+    def summary(self):
+        return {stage: summarize(values) for stage, values in sorted(self.stages.items())}
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "min_ms": ordered[0] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def instrument(instance, recorder):
+    """Time text encoding on the base pipeline and the refiner if present."""
+    for pipe in (instance.pipeline, getattr(instance, "refiner", None)):
+        if pipe is not None:
+            pipe.encode_prompt = recorder.text_encoding(pipe.encode_prompt)
+
+
+def make_request(pipeline_type, steps):
+    return GenerationRequest(prompt="cat, photo, 4k", num_inference_steps=steps, **TINY_REQUESTS[pipeline_type])
+
+
+def run_predict(instance, pipeline_type, request, recorder, watermark_text):
+    """Same sequence as app.worker, without the queue and notifications."""
+    model_type = pipeline_type.split("-")[0]
+    preview = recorder.preview(getattr(latents_preview, PREVIEW_FUNCTIONS[model_type]))
+
+    def callback(_pipe, step, _timestep, callback_kwargs):
+        preview(instance, callback_kwargs["latents"])
+        return {}
+
+    start = time.perf_counter()
+    image = instance.predict(request, callback, callback)
+    predict_end = time.perf_counter()
+    recorder.add("final_decode", predict_end - recorder.last_step_end)
+
+    encode_start = time.perf_counter()
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format="PNG")
+    encoded_image = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
+    recorder.add("encoding", time.perf_counter() - encode_start)
+
+    recorder.timed("postprocess_watermark", watermark.add_watermark)(encoded_image, watermark_text)
+    recorder.add("total", time.perf_counter() - start)
+
+
+async def run_worker(app, instance, request, recorder, worker_id):
+    """Run one job through app.worker and wait for it to finish."""
+    job = Job(f"bench-{worker_id}", request)
+    app.jobs[job.id] = job
+    await app.enqueue(job)
+
+    start = time.perf_counter()
+    worker_task = asyncio.create_task(app.worker(worker_id, instance))
+    try:
+        while job.state not in ("completed", "failed", "error"):
+            await asyncio.sleep(0.001)
+    finally:
+        worker_task.cancel()
+        try:
+            await worker_task
+        except asyncio.CancelledError:
+            pass
+        app.jobs.pop(job.id, None)
+    recorder.add("total", time.perf_counter() - start)
+    if job.state != "completed":
+        raise RuntimeError(f"Benchmark job {job.id} ended in state {job.state}")
+
+
+def import_app(model_type):
+    """Import app.py with the command line it parses at import time."""
+    sys.argv = ["app.py", "--model-type", model_type, "--device", "cpu"]
+    import app
+
+    # Deliver the job messages as the lifespan of the API would
+    app.broker.subscribe(app.JOB_CHANNEL, app.on_job_message)
+    return app
+
+
+def bench_case(pipeline_type, path, args, workdir):
+    recorder = StageRecorder()
+    instance = build_pipeline(pipeline_type, seed=args.seed, workdir=workdir)
+    instrument(instance, recorder)
+    request = make_request(pipeline_type, args.steps)
+    model_type = pipeline_type.split("-")[0]
+
+    if path == "worker":
+        app = import_app(model_type)
+        # Patch the functions the worker resolves from its own namespace
+        for name in PREVIEW_FUNCTIONS.values():
+            setattr(app, name, recorder.preview(getattr(latents_preview, name)))
+        add_watermark = recorder.timed("postprocess_watermark", watermark.add_watermark)
+        predict = instance.predict
+
+        def timed_predict(*a, **kw):
+            try:
+                return predict(*a, **kw)
+            finally:
+                recorder.predict_end = time.perf_counter()
+                recorder.add("final_decode", recorder.predict_end - recorder.last_step_end)
+
+        def timed_watermark(*a, **kw):
+            # The worker encodes the PNG between predict and the watermark
+            recorder.add("encoding", time.perf_counter() - recorder.predict_end)
+            return add_watermark(*a, **kw)
+
+        instance.predict = timed_predict
+        app.add_watermark = timed_watermark
+
+    async def run_worker_jobs():
+        # Events bind to the event loop using them, start from a fresh one
+        app.queue_event = asyncio.Event()
+        for run in range(args.warmup + args.runs):
+            start_run(run)
+            await run_worker(app, instance, request, recorder, run)
+
+    def start_run(run):
+        if run == args.warmup:
+            recorder.stages.clear()
+        torch.manual_seed(args.seed)
+        recorder.last_step_end = None
+
+    with logged_errors(latents_preview.__name__) as preview_errors:
+        if path == "worker":
+            asyncio.run(run_worker_jobs())
+        else:
+            for run in range(args.warmup + args.runs):
+                start_run(run)
+                run_predict(instance, pipeline_type, request, recorder, args.watermark_text)
+    if preview_errors:
+        raise RuntimeError(f"Stage preview_decode failed: {preview_errors[0].getMessage()}")
+    recorder.check(args.steps)
+
+    return {
+        "pipeline": pipeline_type,
+        "path": path,
+        "model_type": model_type,
+        "runs": args.runs,
+        "steps": args.steps,
+        "request": TINY_REQUESTS[pipeline_type],
+        "stages": recorder.summary(),
+    }
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=RUNTIME_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "threads": torch.get_num_threads(),
+        "seed": args.seed,
+    }
+
+
+def compare(results, baseline, max_regression):
+    """Return the list of stages whose mean got slower than the allowed ratio."""
+    previous = {(r["pipeline"], r["path"]): r["stages"] for r in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        old_stages = previous.get((result["pipeline"], result["path"]), {})
+        for stage, stats in result["stages"].items():
+            if stage not in old_stages or old_stages[stage]["mean_ms"] <= 0:
+                continue
+            ratio = stats["mean_ms"] / old_stages[stage]["mean_ms"] - 1
+            if ratio > max_regression:
+                regressions.append(
+                    {"pipeline": result["pipeline"], "path": result["path"], "stage": stage, "regression": ratio}
+                )
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CPU benchmark of the generation runtime with tiny pipelines.")
+    parser.add_argument("--pipelines", type=str, default=",".join(PIPELINE_TYPES), help="Comma separated pipelines to run")
+    parser.add_argument("--paths", type=str, default="predict,worker", help="Comma separated paths: predict, worker")
+    parser.add_argument("--runs", type=int, default=5, help="Measured runs per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Warmup runs per case")
+    parser.add_argument("--steps", type=int, default=4, help="Inference steps per run")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for weights and latents")
+    parser.add_argument("--threads", type=int, default=1, help="Torch intra-op threads, fixed for stable timings")
+    parser.add_argument("--watermark-text", type=str, default="AI-generated Image. Benchmark.")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON results to this file")
+    parser.add_argument("--baseline", type=str, default=None, help="Previous JSON results to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed slowdown of a stage mean vs baseline")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    torch.set_num_threads(args.threads)
+    os.environ["ENABLE_WATERMARK"] = "true"
+    os.environ["WATERMARK_TEXT"] = args.watermark_text
+
+    # Previews load their TAESD weights from the working directory
+    workdir = tempfile.mkdtemp(prefix="bench-runtime-")
+    write_taesd_weights(workdir, args.seed)
+    os.chdir(workdir)
+
+    results = {"meta": metadata(args), "results": []}
+    for pipeline_type in args.pipelines.split(","):
+        for path in args.paths.split(","):
+            print(f"Benchmarking {pipeline_type} ({path})...", file=sys.stderr)
+            results["results"].append(bench_case(pipeline_type, path, args, workdir))
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            results["regressions"] = compare(results, json.load(f), args.max_regression)
+        exit_code = 1 if results["regressions"] else 0
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
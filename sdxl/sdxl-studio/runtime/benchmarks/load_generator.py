@@ -0,0 +1,179 @@
+"""
+Load generator for the queue and WebSocket tier of the runtime.
+
+Start the runtime with the mock model type, so no model is loaded:
+
+    MODEL_TYPE=mock MOCK_STEP_LATENCY=0.02 GENERATION_WORKERS=4 python app.py
+
+then open thousands of /generate and /progress sessions against it:
+
+    python benchmarks/load_generator.py --url http://localhost:8080 --jobs 2000 --concurrency 500
+
+Reports enqueue latency (POST /generate round trip), notification latency (from
+the timestamp set by the worker to the client receiving the message, so clocks
+must be in sync when running on another node), /health probe latency as a proxy
+of the server event-loop lag, and the event-loop lag of the load generator itself.
+Requires httpx and websockets.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+import httpx
+import websockets
+
+
+class Results:
+    def __init__(self):
+        self.enqueue = []
+        self.notification = []
+        self.health = []
+        self.client_loop_lag = []
+        self.completed = 0
+        self.failed = 0
+        self.errors = 0
+        self.messages = 0
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def record_message(results, msg):
+    results.messages += 1
+    if "timestamp" in msg:
+        results.notification.append(time.time() - msg["timestamp"])
+
+
+async def websocket_session(url, job_id, results):
+    ws_url = url.replace("http", "ws", 1) + f"/progress/{job_id}"
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        async for raw in ws:
+            msg = json.loads(raw)
+            record_message(results, msg)
+            if msg.get("status") in ("completed", "failed", "error"):
+                return msg["status"]
+    return "closed"
+
+
+async def polling_session(client, job_id, results, interval):
+    while True:
+        response = await client.get(f"/progress/{job_id}")
+        if response.status_code == 404:
+            return "error"
+        msg = response.json()
+        if msg:
+            record_message(results, msg)
+            if msg.get("status") in ("completed", "failed", "error"):
+                return msg["status"]
+        await asyncio.sleep(interval)
+
+
+async def session(index, client, args, results, semaphore):
+    async with semaphore:
+        try:
+            start = time.perf_counter()
+            response = await client.post(
+                "/generate",
+                json={"prompt": f"load test {index}", "num_inference_steps": args.steps},
+            )
+            results.enqueue.append(time.perf_counter() - start)
+            response.raise_for_status()
+            job_id = response.json()["job_id"]
+
+            if index % 100 < args.poll_percent:
+                status = await polling_session(client, job_id, results, args.poll_interval)
+            else:
+                status = await websocket_session(args.url, job_id, results)
+            if status == "completed":
+                results.completed += 1
+            else:
+                results.failed += 1
+        except Exception as e:
+            results.errors += 1
+            if results.errors <= 10:
+                print(f"Session {index} failed: {e!r}", file=sys.stderr)
+
+
+async def monitor(client, results, interval, stop):
+    """Probe /health and measure the load generator's own event-loop lag."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        results.client_loop_lag.append(max(0.0, time.perf_counter() - start - interval))
+        start = time.perf_counter()
+        try:
+            await client.get("/health")
+            results.health.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            pass
+
+
+async def run(args):
+    results = Results()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency + 10, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        stop = asyncio.Event()
+        monitor_task = asyncio.create_task(monitor(client, results, args.probe_interval, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(session(i, client, args, results, semaphore) for i in range(args.jobs)))
+        duration = time.perf_counter() - start
+        stop.set()
+        await monitor_task
+
+    return {
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "duration_s": duration,
+        "completed": results.completed,
+        "failed": results.failed,
+        "errors": results.errors,
+        "messages": results.messages,
+        "jobs_per_second": results.completed / duration if duration else 0,
+        "enqueue_latency": summarize(results.enqueue),
+        "notification_latency": summarize(results.notification),
+        "health_probe_latency": summarize(results.health),
+        "client_loop_lag": summarize(results.client_loop_lag),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the runtime queue and WebSocket tier.")
+    parser.add_argument("--url", type=str, default="http://localhost:8080", help="Runtime base URL")
+    parser.add_argument("--jobs", type=int, default=1000, help="Number of /generate sessions")
+    parser.add_argument("--concurrency", type=int, default=200, help="Sessions open at the same time")
+    parser.add_argument("--steps", type=int, default=10, help="Inference steps per job")
+    parser.add_argument("--poll-percent", type=int, default=0, help="Percentage of sessions polling GET /progress instead of a WebSocket")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Polling interval in seconds")
+    parser.add_argument("--probe-interval", type=float, default=0.1, help="Interval of the /health and loop lag probes in seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="HTTP timeout in seconds")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON results to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    output = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Tiny random-weight SDXL, Flux and WAN pipelines for CPU benchmarks.
+
+The components follow the dummy configurations used by the diffusers test suite,
+and the tokenizers are built from a byte-level vocabulary written to a temporary
+folder, so no checkpoint or network access is needed.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import torch
+from diffusers import (AutoencoderKL, AutoencoderKLWan, EulerDiscreteScheduler,
+                       FlowMatchEulerDiscreteScheduler, FluxPipeline,
+                       FluxTransformer2DModel, StableDiffusionXLImg2ImgPipeline,
+                       StableDiffusionXLPipeline, UNet2DConditionModel,
+                       WanPipeline, WanTransformer3DModel)
+from transformers import (CLIPTextConfig, CLIPTextModel,
+                          CLIPTextModelWithProjection, CLIPTokenizer, T5Config,
+                          T5EncoderModel)
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+import taesd
+from diffusers_model import DiffusersPipeline
+from flux_model import FluxModelPipeline
+from wan_model import WanModelPipeline
+
+PIPELINE_TYPES = ["sdxl", "sdxl-refiner", "flux", "wan"]
+
+# Request sizes matching the latent grids of the tiny components. They are also the
+# smallest the real previews and watermark handle: the watermark font is 1/30 of the
+# shortest side, and the Flux preview expects packed latents of 4096 x 64.
+TINY_REQUESTS = {
+    "sdxl": {"height": 128, "width": 128},
+    "sdxl-refiner": {"height": 128, "width": 128},
+    "flux": {"height": 128, "width": 128},
+    "wan": {"height": 128, "width": 128, "num_frames": 9, "fps": 8},
+}
+
+
+def tiny_tokenizer(workdir: str) -> CLIPTokenizer:
+    """Byte-level CLIP tokenizer without merges, every byte is a token."""
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for char in bytes_to_unicode().values():
+        vocab[char] = len(vocab)
+        vocab[char + "</w>"] = len(vocab)
+    vocab_file = os.path.join(workdir, "vocab.json")
+    merges_file = os.path.join(workdir, "merges.txt")
+    with open(vocab_file, "w") as f:
+        json.dump(vocab, f)
+    with open(merges_file, "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_file, merges_file, model_max_length=77)
+
+
+def tiny_clip_config() -> CLIPTextConfig:
+    return CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+        hidden_size=32,
+        intermediate_size=37,
+        layer_norm_eps=1e-05,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        vocab_size=1000,
+        hidden_act="gelu",
+        projection_dim=32,
+    )
+
+
+def tiny_t5() -> T5EncoderModel:
+    return T5EncoderModel(
+        T5Config(vocab_size=1000, d_model=32, d_kv=8, d_ff=37, num_layers=2, num_heads=4, pad_token_id=1, eos_token_id=1)
+    )
+
+
+def tiny_sdxl(workdir: str, refiner: bool = False):
+    tokenizer = tiny_tokenizer(workdir)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=80,  # 6 * 8 + 32
+        cross_attention_dim=64,
+    )
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        steps_offset=1,
+        beta_schedule="scaled_linear",
+        timestep_spacing="leading",
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D", "DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D", "UpDecoderBlock2D"],
+        latent_channels=4,
+        sample_size=128,
+    )
+    components = {
+        "unet": unet,
+        "scheduler": scheduler,
+        "vae": vae,
+        "text_encoder": CLIPTextModel(tiny_clip_config()),
+        "tokenizer": tokenizer,
+        "text_encoder_2": CLIPTextModelWithProjection(tiny_clip_config()),
+        "tokenizer_2": tokenizer,
+    }
+    pipeline = StableDiffusionXLPipeline(**components)
+    if not refiner:
+        return pipeline, None
+    return pipeline, StableDiffusionXLImg2ImgPipeline(**components, requires_aesthetics_score=False)
+
+
+def tiny_flux(workdir: str) -> FluxPipeline:
+    tokenizer = tiny_tokenizer(workdir)
+    transformer = FluxTransformer2DModel(
+        patch_size=1,
+        in_channels=64,  # 16 latent channels packed 2x2
+        num_layers=1,
+        num_single_layers=1,
+        attention_head_dim=16,
+        num_attention_heads=2,
+        joint_attention_dim=32,
+        pooled_projection_dim=32,
+        axes_dims_rope=[4, 4, 8],
+    )
+    vae = AutoencoderKL(
+        sample_size=32,
+        in_channels=3,
+        out_channels=3,
+        block_out_channels=(4,),
+        layers_per_block=1,
+        latent_channels=16,
+        norm_num_groups=1,
+        use_quant_conv=False,
+        use_post_quant_conv=False,
+        shift_factor=0.0609,
+        scaling_factor=1.5035,
+    )
+    return FluxPipeline(
+        scheduler=FlowMatchEulerDiscreteScheduler(),
+        vae=vae,
+        text_encoder=CLIPTextModel(tiny_clip_config()),
+        tokenizer=tokenizer,
+        text_encoder_2=tiny_t5(),
+        tokenizer_2=tokenizer,
+        transformer=transformer,
+    )
+
+
+def tiny_wan(workdir: str) -> WanPipeline:
+    transformer = WanTransformer3DModel(
+        patch_size=(1, 2, 2),
+        num_attention_heads=2,
+        attention_head_dim=12,
+        in_channels=16,
+        out_channels=16,
+        text_dim=32,
+        freq_dim=256,
+        ffn_dim=32,
+        num_layers=2,
+        cross_attn_norm=True,
+        qk_norm="rms_norm_across_heads",
+        rope_max_seq_len=32,
+    )
+    vae = AutoencoderKLWan(
+        base_dim=3,
+        z_dim=16,
+        dim_mult=[1, 1, 1, 1],
+        num_res_blocks=1,
+        temperal_downsample=[False, True, True],
+    )
+    return WanPipeline(
+        tokenizer=tiny_tokenizer(workdir),
+        text_encoder=tiny_t5(),
+        transformer=transformer,
+        vae=vae,
+        scheduler=FlowMatchEulerDiscreteScheduler(shift=7.0),
+    )
+
+
+def pipeline_args(pipeline_type: str) -> argparse.Namespace:
+    """Arguments as produced by helpers.parse_args for a CPU run."""
+    return argparse.Namespace(
+        model_type=pipeline_type.split("-")[0],
+        model_id="tiny-random",
+        single_file_model=None,
+        use_refiner=pipeline_type == "sdxl-refiner",
+        refiner_id=None,
+        refiner_single_file_model=None,
+        device="cpu",
+    )
+
+
+def build_pipeline(pipeline_type: str, seed: int = 0, workdir: str = None):
+    """
+    Return a runtime pipeline wrapper (DiffusersPipeline, FluxModelPipeline or
+    WanModelPipeline) around tiny random-weight components, ready for predict.
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="tiny-pipelines-")
+    torch.manual_seed(seed)
+    args = pipeline_args(pipeline_type)
+
+    if pipeline_type.startswith("sdxl"):
+        instance = DiffusersPipeline(args)
+        instance.pipeline, instance.refiner = tiny_sdxl(workdir, refiner=args.use_refiner)
+    elif pipeline_type == "flux":
+        instance = FluxModelPipeline(args)
+        instance.pipeline = tiny_flux(workdir)
+    elif pipeline_type == "wan":
+        instance = WanModelPipeline(args)
+        instance.pipeline = tiny_wan(workdir)
+    else:
+        raise ValueError(f"Unknown pipeline type: {pipeline_type}")
+
+    instance.pipeline.set_progress_bar_config(disable=True)
+    if getattr(instance, "refiner", None) is not None:
+        instance.refiner.set_progress_bar_config(disable=True)
+    instance.ready = True
+    return instance
+
+
+def write_taesd_weights(workdir: str, seed: int = 0) -> str:
+    """
+    The SDXL previews load 'taesdxl_decoder.pth' from the working directory,
+    write random weights there when benchmarking without the real decoder.
+    """
+    path = os.path.join(workdir, "taesdxl_decoder.pth")
+    if not os.path.exists(path):
+        torch.manual_seed(seed)
+        torch.save(taesd.Decoder().state_dict(), path)
+    return path
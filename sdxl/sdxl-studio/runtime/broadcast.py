@@ -0,0 +1,144 @@
+import asyncio
+import weakref
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+# Statuses after which a job sends no more messages
+TERMINAL_STATUSES = ("completed", "failed", "error", "cancelled")
+
+
+def coalesce_key(message: dict) -> Optional[Tuple]:
+    """
+    Messages superseded by a later message with the same key: progress and queue
+    updates only matter at their latest value. None for the messages always delivered.
+    """
+    status = message.get("status")
+    if status in ("progress", "queued"):
+        return (status, message.get("pipeline"))
+    return None
+
+
+def message_size(message: dict) -> int:
+    """Approximate memory retained by a message, dominated by its base64 previews."""
+    return sum(64 + (len(value) if isinstance(value, (str, bytes)) else 0) for value in message.values())
+
+
+_broadcasts = weakref.WeakSet()
+
+
+def retained_bytes() -> int:
+    """Bytes of messages retained by the broadcasts of every job."""
+    return sum(broadcast.retained_bytes for broadcast in list(_broadcasts))
+
+
+class Broadcast:
+    """
+    Messages of a job for its subscribers. Messages go to one ring, that each subscriber
+    reads at its own cursor: publishing costs the same whatever the number of subscribers.
+    A progress message frees the previous one with the same coalesce key, and the oldest
+    messages are dropped beyond `size` messages or `max_bytes`, so a job nobody watches
+    keeps a bounded memory. A subscriber skips the messages freed before it read them.
+    The terminal message is the last one and is never dropped. New subscribers start
+    from the latest message.
+    """
+
+    max_bytes = 8 * 1024 * 1024  # Set from --notification-buffer-bytes
+
+    def __init__(self, size: int = 16):
+        self.size = size
+        self._messages = deque()  # (seq, message or None once freed, size)
+        self._next_seq = 0
+        self._latest_seq: Dict[Tuple, int] = {}  # coalesce key -> seq of its latest message
+        self._changed = asyncio.Event()
+        self.retained_bytes = 0
+        self.closed = False  # The terminal message was published
+        _broadcasts.add(self)
+
+    @property
+    def latest(self) -> Optional[dict]:
+        """Latest message, the current state of the job."""
+        return self._messages[-1][1] if self._messages else None
+
+    @property
+    def latest_seq(self) -> Optional[int]:
+        return self._next_seq - 1 if self._messages else None
+
+    def publish(self, message: dict):
+        if self.closed:
+            return
+        seq = self._next_seq
+        self._next_seq += 1
+        key = coalesce_key(message)
+        if key is not None:
+            if key in self._latest_seq:
+                self._free(self._latest_seq[key])
+            self._latest_seq[key] = seq
+        size = message_size(message)
+        self._messages.append((seq, message, size))
+        self.retained_bytes += size
+        while len(self._messages) > 1 and (len(self._messages) > self.size or self.retained_bytes > self.max_bytes):
+            self.retained_bytes -= self._messages.popleft()[2]
+        self.closed = message.get("status") in TERMINAL_STATUSES
+        # Wake up the waiting subscribers, later waits use a new event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def subscribe(self, after: Optional[int] = None) -> "Subscription":
+        """
+        Subscribe from the latest message, or from the message following the seq `after`
+        a client received before reconnecting.
+        """
+        if after is None:
+            return Subscription(self, max(self._next_seq - 1, 0))
+        return Subscription(self, min(max(after + 1, 0), self._next_seq))
+
+    def _free(self, seq: int):
+        """Free a superseded message, its slot stays in the ring."""
+        index = seq - self._first_seq()
+        if index >= 0:
+            self.retained_bytes -= self._messages[index][2]
+            self._messages[index] = (seq, None, 0)
+
+    def _first_seq(self) -> int:
+        return self._messages[0][0] if self._messages else self._next_seq
+
+
+class Subscription:
+    """Cursor of one subscriber in a Broadcast."""
+
+    def __init__(self, broadcast: Broadcast, cursor: int):
+        self.broadcast = broadcast
+        self.cursor = cursor  # seq of the next message to read
+        self.skipped = 0  # Messages superseded or lost, never sent to this subscriber
+
+    def next_nowait(self) -> Optional[Tuple[int, dict]]:
+        """Next message and its seq, or None if the subscriber is up to date."""
+        broadcast = self.broadcast
+        while self.cursor < broadcast._next_seq:
+            first = broadcast._first_seq()
+            if self.cursor < first:
+                # Fell behind the ring
+                self.skipped += first - self.cursor
+                self.cursor = first
+            seq, message, _ = broadcast._messages[self.cursor - first]
+            self.cursor += 1
+            if message is None:
+                # Superseded by a later message
+                self.skipped += 1
+                continue
+            return seq, message
+        return None
+
+    async def next(self) -> Tuple[int, dict]:
+        while True:
+            event = self.next_nowait()
+            if event is not None:
+                return event
+            await self.broadcast._changed.wait()
+
+    def get_nowait(self) -> Optional[dict]:
+        event = self.next_nowait()
+        return None if event is None else event[1]
+
+    async def get(self) -> dict:
+        return (await self.next())[1]
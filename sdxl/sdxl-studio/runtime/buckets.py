@@ -0,0 +1,193 @@
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+from classes import GenerationRequest
+
+_log = logging.getLogger(__name__)
+
+
+# Supported (width, height) buckets per model type. All sizes are multiples of 16,
+# which satisfies both the SDXL VAE (8) and the Flux/WAN patchified latents (16).
+DEFAULT_BUCKETS: Dict[str, List[Tuple[int, int]]] = {
+    "sdxl": [
+        (1024, 1024),
+        (1152, 896),
+        (896, 1152),
+        (1216, 832),
+        (832, 1216),
+        (1344, 768),
+        (768, 1344),
+        (1536, 640),
+        (640, 1536),
+    ],
+    "flux": [
+        (512, 512),
+        (1024, 1024),
+        (1152, 896),
+        (896, 1152),
+        (1216, 832),
+        (832, 1216),
+        (1344, 768),
+        (768, 1344),
+    ],
+    "wan": [
+        (832, 480),
+        (480, 832),
+        (1280, 720),
+        (720, 1280),
+    ],
+}
+
+# Default bucket used when the request does not specify a size
+DEFAULT_SIZE: Dict[str, Tuple[int, int]] = {
+    "sdxl": (1024, 1024),
+    "flux": (1024, 1024),
+    "wan": (832, 480),
+}
+
+# (min, max) number of inference steps per model type
+STEP_LIMITS: Dict[str, Tuple[int, int]] = {
+    "sdxl": (1, 100),
+    "flux": (1, 50),
+    "wan": (1, 100),
+}
+
+# WAN generates 4k+1 frames
+WAN_MAX_FRAMES = 81
+
+
+def parse_buckets(value: str) -> List[Tuple[int, int]]:
+    """Parse a comma separated list of buckets, e.g. '1024x1024,1152x896'."""
+    buckets = []
+    for item in value.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        try:
+            width, height = (int(v) for v in item.split("x"))
+        except ValueError:
+            raise ValueError(f"Invalid resolution bucket: '{item}', expected WIDTHxHEIGHT")
+        if width <= 0 or height <= 0 or width % 16 or height % 16:
+            raise ValueError(f"Invalid resolution bucket: '{item}', sizes must be positive multiples of 16")
+        buckets.append((width, height))
+    if not buckets:
+        raise ValueError("No resolution buckets defined")
+    return buckets
+
+
+def bucket_name(width: int, height: int) -> str:
+    """Return the label used to key caches, metrics and scheduling on a bucket."""
+    return f"{width}x{height}"
+
+
+class RequestNormalizer:
+    """
+    Snaps generation requests to a fixed set of resolution buckets and clamps
+    the step count, so that downstream batching, caches and memory planning
+    only ever see a small number of shapes.
+    """
+
+    def __init__(
+        self,
+        model_type: str,
+        buckets: Optional[List[Tuple[int, int]]] = None,
+        max_inference_steps: Optional[int] = None,
+        enabled: bool = True,
+    ):
+        self.model_type = model_type
+        self.enabled = enabled
+        self.buckets = buckets or DEFAULT_BUCKETS.get(model_type, DEFAULT_BUCKETS["sdxl"])
+        self.default_size = DEFAULT_SIZE.get(model_type, DEFAULT_SIZE["sdxl"])
+        if self.default_size not in self.buckets:
+            self.default_size = self.buckets[0]
+        self.min_steps, self.max_steps = STEP_LIMITS.get(model_type, STEP_LIMITS["sdxl"])
+        if max_inference_steps:
+            self.max_steps = max(self.min_steps, max_inference_steps)
+
+    @classmethod
+    def from_args(cls, args) -> "RequestNormalizer":
+        buckets = parse_buckets(args.resolution_buckets) if args.resolution_buckets else None
+        normalizer = cls(
+            args.model_type,
+            buckets=buckets,
+            max_inference_steps=args.max_inference_steps,
+            enabled=args.normalize_requests,
+        )
+        _log.info(
+            f"Request normalization {'enabled' if normalizer.enabled else 'disabled'}, "
+            f"buckets: {[bucket_name(*b) for b in normalizer.buckets]}, "
+            f"steps: {normalizer.min_steps}-{normalizer.max_steps}"
+        )
+        return normalizer
+
+    def snap(self, width: Optional[int], height: Optional[int]) -> Tuple[int, int]:
+        """
+        Return the bucket closest in aspect ratio, then in area, to the requested size.
+        When only one dimension is given, the bucket closest on that dimension is used,
+        preferring the squarest one.
+        """
+        if (width is not None and width < 0) or (height is not None and height < 0):
+            raise ValueError(f"Invalid image size: {width}x{height}")
+        if not width and not height:
+            return self.default_size
+
+        if not height:
+            return min(self.buckets, key=lambda b: (abs(math.log(b[0] / width)), abs(math.log(b[0] / b[1]))))
+        if not width:
+            return min(self.buckets, key=lambda b: (abs(math.log(b[1] / height)), abs(math.log(b[0] / b[1]))))
+
+        log_ratio = math.log(width / height)
+        log_area = math.log(width * height)
+        return min(
+            self.buckets,
+            key=lambda b: (
+                round(abs(math.log(b[0] / b[1]) - log_ratio), 6),
+                abs(math.log(b[0] * b[1]) - log_area),
+            ),
+        )
+
+    def normalize(self, request: GenerationRequest) -> Tuple[GenerationRequest, Optional[str]]:
+        """
+        Return the normalized request and the name of its resolution bucket.
+        Raises ValueError for requests that can't be normalized.
+        """
+        if not self.enabled:
+            # Only report a bucket when the client fixed the size itself, otherwise
+            # the pipeline picks its own default which we don't know here.
+            if request.width and request.height:
+                return request, bucket_name(request.width, request.height)
+            return request, None
+
+        width, height = self.snap(request.width, request.height)
+        update = {
+            "width": width,
+            "height": height,
+            "num_inference_steps": min(max(request.num_inference_steps, self.min_steps), self.max_steps),
+        }
+
+        # Custom schedules override num_inference_steps in diffusers
+        for field in ("timesteps", "sigmas"):
+            value = getattr(request, field)
+            if value is not None and len(value) > self.max_steps:
+                raise ValueError(f"Too many {field}: {len(value)}, the maximum is {self.max_steps}")
+
+        # Micro-conditioning sizes are passed as sent, the target always matches the generated image
+        if request.target_size is not None:
+            update["target_size"] = (height, width)
+        for field in ("original_size", "negative_original_size", "negative_target_size"):
+            value = getattr(request, field)
+            if value is not None and min(value) <= 0:
+                raise ValueError(f"Invalid {field}: {value}")
+
+        if self.model_type == "wan" and request.num_frames is not None:
+            if request.num_frames < 1:
+                raise ValueError(f"Invalid number of frames: {request.num_frames}")
+            num_frames = min(request.num_frames, WAN_MAX_FRAMES)
+            update["num_frames"] = (num_frames - 1) // 4 * 4 + 1
+
+        normalized = request.model_copy(update=update)
+        if (request.width, request.height) != (width, height):
+            _log.info(f"Snapped request size {request.width}x{request.height} to bucket {bucket_name(width, height)}")
+
+        return normalized, bucket_name(width, height)
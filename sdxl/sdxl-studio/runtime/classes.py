@@ -1,7 +1,10 @@
-import asyncio
+import time
 from typing import List, Optional, Tuple
 from pydantic import BaseModel
 
+from broadcast import Broadcast
+from tracing import Trace
+
 
 class HealthCheckResponse(BaseModel):
     status: str = "ok"
@@ -29,6 +32,7 @@ class GenerationRequest(BaseModel):
     negative_target_size: Optional[Tuple[int, int]] = None
     num_frames: Optional[int] = 81
     fps: Optional[int] = 15
+    seed: Optional[int] = None
 
     model_config = {
         "json_schema_extra": {
@@ -47,14 +51,52 @@ class GenerationRequest(BaseModel):
 
 class GenerationResponse(BaseModel):
     job_id: str
+    bucket: Optional[str] = None
+    trace_id: Optional[str] = None
+    estimated_seconds: Optional[float] = None
+    shared: bool = False  # True if an identical request was already queued or running, and is shared
 
 
 class Job:
     """Represents a generation job."""
 
-    def __init__(self, job_id: str, request: GenerationRequest):
+    def __init__(self, job_id: str, request: GenerationRequest, bucket: Optional[str] = None):
         self.id = job_id
         self.request = request
-        self.state = "queued"  # can be 'queued', 'processing', 'completed', or 'error'
+        self.bucket = bucket  # Resolution bucket the request was normalized to
+        self.state = "queued"  # can be 'queued', 'processing', 'completed', 'failed' or 'cancelled'
+        self.cancelled = False  # Set to stop the job at its next step callback
+        self.client_id: Optional[str] = None  # Client that submitted the job, for admission control
         self.result = None  # Will hold the image bytes when completed.
-        self.notification_queue: asyncio.Queue = asyncio.Queue()
+        self.enqueued_at = time.time()
+        self.queued_at = self.enqueued_at  # Last time the job entered the queue, after a preemption too
+        self.priority = 0.0  # Scheduling priority, lowest first
+        self.expected_seconds: Optional[float] = None  # Expected processing time when enqueued
+        self.started_at: Optional[float] = None  # Start of the current processing run
+        self.processing_seconds = 0.0  # Processing time of the previous runs of a preempted job
+        self.steps_done = 0  # Step callbacks received, base and refiner
+        self.step_seconds = 0.0  # Time between consecutive step callbacks of the same run
+        self.step_intervals = 0
+        self.last_step_at: Optional[float] = None
+        self.checkpoint = None  # Denoising state of a preempted job, to resume from
+        self.flagged_step: Optional[int] = None  # Step whose preview the safety screening flagged, the job stopped there
+        self.preemptions = 0
+        self.trace = Trace(job_id)
+        self.broadcast = Broadcast()  # Messages for the clients of the request
+        # Identical requests share one job: the leader is processed and sends its messages to every subscriber
+        self.leader: Optional["Job"] = None
+        self.subscribers: List["Job"] = [self]
+        self.detached = False  # The request was cancelled while others still share its job
+        self.dedup_key: Optional[str] = None
+
+    def record_step(self):
+        """Record a step callback, for the step rate of the job."""
+        now = time.time()
+        if self.last_step_at is not None:
+            self.step_seconds += now - self.last_step_at
+            self.step_intervals += 1
+        self.last_step_at = now
+        self.steps_done += 1
+
+    def mean_step_seconds(self) -> Optional[float]:
+        return self.step_seconds / self.step_intervals if self.step_intervals else None
@@ -0,0 +1,142 @@
+import heapq
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from buckets import DEFAULT_SIZE
+
+_log = logging.getLogger(__name__)
+
+CostKey = Tuple[Optional[str], int, bool]  # (bucket, frames, refiner)
+
+
+class CostModel:
+    """
+    Learns the cost of jobs from the completed ones: an EWMA of the time per step and
+    of the time spent outside of the steps (text encoding, decoding, encoding) for each
+    resolution bucket, frame count and refiner use. Keys that were never observed are
+    estimated from the observed ones, scaled by the number of pixels to denoise.
+    Estimates are None until a first job completed.
+    """
+
+    def __init__(self, model_type: str, use_refiner: bool = False, alpha: float = 0.2):
+        self.model_type = model_type
+        self.use_refiner = use_refiner
+        self.alpha = alpha
+        self.step_seconds: Dict[CostKey, float] = {}
+        self.overhead_seconds: Dict[CostKey, float] = {}
+        self._units: Dict[CostKey, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args) -> "CostModel":
+        return cls(args.model_type, use_refiner=bool(args.use_refiner) and args.model_type == "sdxl")
+
+    def key(self, request) -> CostKey:
+        frames = (request.num_frames or 1) if self.model_type == "wan" else 1
+        return (self._bucket(request), frames, self.use_refiner)
+
+    def _bucket(self, request) -> str:
+        width, height = self._size(request)
+        return f"{width}x{height}"
+
+    def _size(self, request) -> Tuple[int, int]:
+        default = DEFAULT_SIZE.get(self.model_type, DEFAULT_SIZE["sdxl"])
+        return request.width or default[0], request.height or default[1]
+
+    def _work_units(self, request) -> int:
+        """Pixels times frames, the amount of work of a step relative to other keys."""
+        width, height = self._size(request)
+        return width * height * self.key(request)[1]
+
+    def _ewma(self, table: Dict[CostKey, float], key: CostKey, value: float):
+        previous = table.get(key)
+        table[key] = value if previous is None else self.alpha * value + (1 - self.alpha) * previous
+
+    def observe_job(self, request, seconds: float, steps: int, step_seconds: Optional[float]):
+        """Learn from a completed job, given its number of steps and its mean time per step."""
+        if not steps or step_seconds is None:
+            return
+        key = self.key(request)
+        with self._lock:
+            self._ewma(self.step_seconds, key, step_seconds)
+            self._ewma(self.overhead_seconds, key, max(0.0, seconds - step_seconds * steps))
+            self._units[key] = self._work_units(request)
+
+    def _estimate(self, table: Dict[CostKey, float], request) -> Optional[float]:
+        key = self.key(request)
+        with self._lock:
+            if key in table:
+                return table[key]
+            if not table:
+                return None
+            per_unit = sum(value / self._units[k] for k, value in table.items()) / len(table)
+        return per_unit * self._work_units(request)
+
+    def expected_step_seconds(self, request) -> Optional[float]:
+        return self._estimate(self.step_seconds, request)
+
+    def expected_seconds(self, request) -> Optional[float]:
+        """Expected processing time of a job."""
+        step_seconds = self._estimate(self.step_seconds, request)
+        if step_seconds is None:
+            return None
+        return step_seconds * request.num_inference_steps + (self._estimate(self.overhead_seconds, request) or 0.0)
+
+    def remaining_seconds(self, job, now: Optional[float] = None) -> Optional[float]:
+        """Expected remaining processing time of a running job, using its own step rate once known."""
+        now = now or time.time()
+        step_seconds = job.mean_step_seconds()
+        measured = step_seconds is not None
+        if not measured:
+            step_seconds = self.expected_step_seconds(job.request)
+            if step_seconds is None:
+                return None
+        remaining_steps = max(0, job.request.num_inference_steps - job.steps_done)
+        remaining = remaining_steps * step_seconds + (self._estimate(self.overhead_seconds, job.request) or 0.0)
+        if not measured and job.started_at is not None:
+            # Still before the steps, e.g. encoding the prompt
+            remaining -= now - job.started_at
+        return max(0.0, remaining)
+
+    def schedule(self, running: Iterable, queued: List, workers: int, now: Optional[float] = None) -> Dict[str, Tuple[float, float]]:
+        """
+        Estimated start and completion times of the queued jobs, in queue order, as
+        job_id -> (start, completion). Empty while the model has no estimate.
+        """
+        now = now or time.time()
+        free_at = []
+        for job in running:
+            remaining = self.remaining_seconds(job, now)
+            if remaining is None:
+                return {}
+            free_at.append(now + remaining)
+        free_at.extend([now] * max(workers - len(free_at), 0))
+        heapq.heapify(free_at)
+
+        estimates = {}
+        for job in queued:
+            expected = self.expected_seconds(job.request)
+            if expected is None:
+                return {}
+            start = heapq.heappop(free_at) if free_at else now
+            heapq.heappush(free_at, start + expected)
+            estimates[job.id] = (start, start + expected)
+        return estimates
+
+    def backlog_seconds(self, queued: Iterable, workers: int) -> float:
+        """Expected time to process the queued jobs with the available workers."""
+        total = 0.0
+        for job in queued:
+            total += self.expected_seconds(job.request) or 0.0
+        return total / max(workers, 1)
+
+
+def sjf_priority(expected_seconds: Optional[float], enqueued_at: float, aging: float) -> float:
+    """
+    Priority of a job for shortest-expected-job-first scheduling. The effective cost of a
+    job is its expected time minus `aging` times its waiting time, so that long jobs are
+    not starved. Ordering by it is the same at any time as ordering by this static value.
+    """
+    return (expected_seconds or 0.0) + aging * enqueued_at
@@ -1,3 +1,4 @@
+import copy
 import logging
 from typing import Dict
 
@@ -5,6 +6,7 @@ import torch
 from diffusers import (StableDiffusionXLImg2ImgPipeline,
                        StableDiffusionXLPipeline)
 
+import tracing
 from classes import GenerationRequest
 
 _log = logging.getLogger(__name__)
@@ -142,6 +144,9 @@ class DiffusersPipeline:
                     refiner.enable_xformers_memory_efficient_attention()
                 self.refiner = refiner
 
+            tracing.instrument_pipeline(self.pipeline)
+            tracing.instrument_pipeline(self.refiner)
+
             # The ready flag is used by model ready endpoint for readiness probes,
             # set to True when model is loaded successfully without exceptions.
             self.ready = True
@@ -162,28 +167,58 @@ class DiffusersPipeline:
             return data
         
 
+    def base_steps(self, payload: GenerationRequest) -> int:
+        """Steps run by the base pipeline, it stops at denoising_limit when the refiner finishes the image."""
+        denoising_limit = payload.denoising_limit
+        if not self.use_refiner or denoising_limit is None or not 0 < denoising_limit < 1:
+            return payload.num_inference_steps
+        timesteps = payload.timesteps
+        if timesteps is None:
+            # Same schedule as the base pipeline, without touching its scheduler
+            scheduler = copy.deepcopy(self.pipeline.scheduler)
+            if payload.sigmas is not None:
+                scheduler.set_timesteps(sigmas=payload.sigmas)
+            else:
+                scheduler.set_timesteps(payload.num_inference_steps)
+            timesteps = scheduler.timesteps.tolist()
+        # Cutoff of StableDiffusionXLPipeline for denoising_end
+        num_train_timesteps = self.pipeline.scheduler.config.num_train_timesteps
+        cutoff = int(round(num_train_timesteps - denoising_limit * num_train_timesteps))
+        return len([timestep for timestep in timesteps if timestep >= cutoff])
+
     def predict(self, payload: GenerationRequest, callback_func_base: callable, callback_func_refiner: callable) -> None:
         payload_dict = self.convert_lists_to_tuples(payload.__dict__)
         _log.info(f"Received request: {payload_dict}")
 
+        # The pipelines take a generator, not a seed
+        seed = payload_dict.pop("seed", None)
+        if seed is not None:
+            payload_dict["generator"] = torch.Generator("cpu").manual_seed(seed)
+
         # Create the image, without refiner if not needed
         if not self.use_refiner:
-            image = self.pipeline(
-                **payload_dict, callback_on_step_end=callback_func_base
-            ).images[0]
+            with tracing.span("base_pipeline", pipeline="base"):
+                image = self.pipeline(
+                    **payload_dict, callback_on_step_end=callback_func_base
+                ).images[0]
         else:
             denoising_limit = payload_dict.get("denoising_limit", 0.8)
-            image = self.pipeline(
-                **payload_dict,
-                output_type="latent",
-                denoising_end=denoising_limit,
-                callback_on_step_end=callback_func_base,
-            ).images
-            image = self.refiner(
-                **payload_dict,
-                image=image,
-                denoising_start=denoising_limit,
-                callback_on_step_end=callback_func_refiner,
-            ).images[0]
+            with tracing.span("base_pipeline", pipeline="base"):
+                image = self.pipeline(
+                    **payload_dict,
+                    output_type="latent",
+                    denoising_end=denoising_limit,
+                    callback_on_step_end=callback_func_base,
+                ).images
+            if self.pipeline.interrupt:
+                # Cancelled during the base steps, skip the refiner
+                return None
+            with tracing.span("refiner_pipeline", pipeline="refiner"):
+                image = self.refiner(
+                    **payload_dict,
+                    image=image,
+                    denoising_start=denoising_limit,
+                    callback_on_step_end=callback_func_refiner,
+                ).images[0]
 
         return image
@@ -8,6 +8,7 @@ from transformers import T5EncoderModel, CLIPTextModel
 from huggingface_hub import hf_hub_download, login
 from safetensors.torch import load_file
 
+import tracing
 from classes import GenerationRequest
 
 _log = logging.getLogger(__name__)
@@ -179,6 +180,7 @@ class FluxModelPipeline:
             #     _log.info("Enabling sequential CPU offload")
             #     pipeline.enable_sequential_cpu_offload()
             
+            tracing.instrument_pipeline(pipeline)
             self.pipeline = pipeline
             self.ready = True
             _log.info("Flux model loaded successfully")
@@ -224,17 +226,18 @@ class FluxModelPipeline:
         # Create the image
         try:
             _log.info("Starting Flux pipeline inference")
-            result = self.pipeline(
-                prompt=prompt,
-                #negative_prompt=negative_prompt,
-                height=height,
-                width=width,
-                guidance_scale=guidance_scale,
-                num_inference_steps=num_inference_steps,
-                # num_inference_steps=4,
-                generator=generator,
-                callback_on_step_end=debug_callback_wrapper if callback_func_base else None
-            )
+            with tracing.span("base_pipeline", pipeline="base"):
+                result = self.pipeline(
+                    prompt=prompt,
+                    #negative_prompt=negative_prompt,
+                    height=height,
+                    width=width,
+                    guidance_scale=guidance_scale,
+                    num_inference_steps=num_inference_steps,
+                    # num_inference_steps=4,
+                    generator=generator,
+                    callback_on_step_end=debug_callback_wrapper if callback_func_base else None
+                )
             _log.info("Flux pipeline inference completed successfully")
             return result.images[0]
         except Exception as e:
@@ -27,8 +27,8 @@ def parse_args():
         "--model-type",
         type=str,
         default=os.getenv("MODEL_TYPE", "sdxl"),
-        choices=["sdxl", "flux", "wan"],
-        help="Model type to use (sdxl, flux, or wan)",
+        choices=["sdxl", "flux", "wan", "mock"],
+        help="Model type to use (sdxl, flux, wan, or mock to load-test without a model)",
     )
     parser.add_argument(
         "--model-id",
@@ -66,6 +66,204 @@ def parse_args():
         default=os.getenv("DEVICE", "cuda"),
         help="Device to use, including offloading. Valid values are: 'cuda' (default), 'enable_model_cpu_offload', 'enable_sequential_cpu_offload', 'cpu' (works but unusable...)",
     )
+    parser.add_argument(
+        "--normalize-requests",
+        action=argparse.BooleanOptionalAction,
+        default=bool(os.getenv("NORMALIZE_REQUESTS", "True").lower() in ("true", "1", "t")),
+        help="Snap requests to the supported resolution buckets and clamp the step count before enqueuing",
+    )
+    parser.add_argument(
+        "--resolution-buckets",
+        type=str,
+        default=os.getenv("RESOLUTION_BUCKETS", None),
+        help="Comma separated list of supported WIDTHxHEIGHT buckets (default: built-in buckets for the model type)",
+    )
+    parser.add_argument(
+        "--max-inference-steps",
+        type=int,
+        default=int(os.getenv("MAX_INFERENCE_STEPS", "0")) or None,
+        help="Maximum number of inference steps accepted per request (default: built-in limit for the model type)",
+    )
+    parser.add_argument(
+        "--mock-step-latency",
+        type=float,
+        default=float(os.getenv("MOCK_STEP_LATENCY", "0.05")),
+        help="Simulated time per inference step in seconds, for the mock model type",
+    )
+    parser.add_argument(
+        "--mock-preview-size",
+        type=int,
+        default=int(os.getenv("MOCK_PREVIEW_SIZE", "256")),
+        help="Size in pixels of the synthetic previews, for the mock model type",
+    )
+    parser.add_argument(
+        "--queue-backend",
+        type=str,
+        default=os.getenv("QUEUE_BACKEND", "memory"),
+        choices=["memory", "sqlite"],
+        help="Job queue backend: in process memory, or a SQLite database surviving restarts and shared by local processes",
+    )
+    parser.add_argument(
+        "--queue-path",
+        type=str,
+        default=os.getenv("QUEUE_PATH", "/tmp/studio-queue.db"),
+        help="Path of the SQLite job queue",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=float(os.getenv("LEASE_SECONDS", "60")),
+        help="Lease duration of a running job, extended while it runs. Jobs of a crashed worker are requeued after it",
+    )
+    parser.add_argument(
+        "--queue-poll-interval",
+        type=float,
+        default=float(os.getenv("QUEUE_POLL_INTERVAL", "0.5")),
+        help="Interval in seconds at which idle workers look for jobs queued by other replicas",
+    )
+    parser.add_argument(
+        "--drain-on-shutdown",
+        action=argparse.BooleanOptionalAction,
+        default=bool(os.getenv("DRAIN_ON_SHUTDOWN", "False").lower() in ("true", "1", "t")),
+        help="On shutdown, let the running jobs finish instead of putting them back in the queue",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=float(os.getenv("DRAIN_TIMEOUT", "300")),
+        help="Maximum time in seconds to wait for the running jobs when draining",
+    )
+    parser.add_argument(
+        "--notification-buffer-bytes",
+        type=int,
+        default=int(os.getenv("NOTIFICATION_BUFFER_BYTES", str(8 * 1024 * 1024))),
+        help="Memory budget of the messages kept per job for its clients, the oldest are dropped beyond it",
+    )
+    parser.add_argument(
+        "--role",
+        type=str,
+        default=os.getenv("ROLE", "all"),
+        choices=["all", "api"],
+        help="all: accept and process jobs. api: only accept jobs and serve their progress, "
+        "processed by worker_main.py processes (requires --pubsub-url and a shared queue backend)",
+    )
+    parser.add_argument(
+        "--pubsub-url",
+        type=str,
+        default=os.getenv("PUBSUB_URL", None),
+        help="Pub/sub hub relaying job progress between API replicas and workers, as tcp://host:port "
+        "(default: in process only)",
+    )
+    parser.add_argument(
+        "--scheduling",
+        type=str,
+        default=os.getenv("SCHEDULING", "fifo"),
+        choices=["fifo", "sjf"],
+        help="Order in which queued jobs are processed: first in first out, or shortest expected job first",
+    )
+    parser.add_argument(
+        "--sjf-aging",
+        type=float,
+        default=float(os.getenv("SJF_AGING", "1.0")),
+        help="With sjf scheduling, seconds of expected job time a job gains per second spent queued, so long jobs are not starved",
+    )
+    parser.add_argument(
+        "--dedup-requests",
+        action=argparse.BooleanOptionalAction,
+        default=bool(os.getenv("DEDUP_REQUESTS", "True").lower() in ("true", "1", "t")),
+        help="Let identical requests with an explicit seed share the job already queued or running for them",
+    )
+    parser.add_argument(
+        "--preemption",
+        action=argparse.BooleanOptionalAction,
+        default=bool(os.getenv("PREEMPTION", "False").lower() in ("true", "1", "t")),
+        help="Let long jobs (WAN videos) checkpoint at a step boundary and resume after shorter queued jobs",
+    )
+    parser.add_argument(
+        "--preemption-ratio",
+        type=float,
+        default=float(os.getenv("PREEMPTION_RATIO", "4.0")),
+        help="A running job yields to a queued job expected to take at most 1/ratio of its remaining time",
+    )
+    parser.add_argument(
+        "--max-preemptions",
+        type=int,
+        default=int(os.getenv("MAX_PREEMPTIONS", "3")),
+        help="Number of times a job can be preempted, it then runs to completion",
+    )
+    parser.add_argument(
+        "--max-queue-length",
+        type=int,
+        default=int(os.getenv("MAX_QUEUE_LENGTH", "0")),
+        help="Maximum number of queued jobs, new jobs are rejected with 429 beyond it (0: unlimited)",
+    )
+    parser.add_argument(
+        "--max-backlog-seconds",
+        type=float,
+        default=float(os.getenv("MAX_BACKLOG_SECONDS", "0")),
+        help="Maximum estimated backlog of the queue in seconds, new jobs are rejected with 429 beyond it (0: unlimited)",
+    )
+    parser.add_argument(
+        "--max-jobs-per-client",
+        type=int,
+        default=int(os.getenv("MAX_JOBS_PER_CLIENT", "0")),
+        help="Maximum number of queued or running jobs per client address (0: unlimited)",
+    )
+    parser.add_argument(
+        "--cancel-grace-period",
+        type=float,
+        default=float(os.getenv("CANCEL_GRACE_PERIOD", "30")),
+        help="Seconds after the last WebSocket subscriber left before its job is cancelled (negative to disable)",
+    )
+    parser.add_argument(
+        "--safety-check",
+        action=argparse.BooleanOptionalAction,
+        default=bool(os.getenv("SAFETY_CHECK", "False").lower() in ("true", "1", "t")),
+        help="Check the generated images with the Stable Diffusion safety checker in process, flagged images are replaced",
+    )
+    parser.add_argument(
+        "--safety-checker-id",
+        type=str,
+        default=os.getenv("SAFETY_CHECKER_ID", "CompVis/stable-diffusion-safety-checker"),
+        help="Safety checker loaded when the pipeline has none",
+    )
+    parser.add_argument(
+        "--safety-batch-size",
+        type=int,
+        default=int(os.getenv("SAFETY_BATCH_SIZE", "8")),
+        help="Maximum number of images of the workers checked together",
+    )
+    parser.add_argument(
+        "--safety-screening-steps",
+        type=str,
+        default=os.getenv("SAFETY_SCREENING_STEPS", ""),
+        help="Comma separated fractions of the base steps, e.g. 0.3,0.6, at which the preview is screened by the safety "
+        "checker, the job is stopped when it is flagged (default: no screening)",
+    )
+    parser.add_argument(
+        "--safety-screening-threshold",
+        type=float,
+        default=float(os.getenv("SAFETY_SCREENING_THRESHOLD", "0.0")),
+        help="Safety score of a preview above which the job is stopped, the final check flags scores above 0",
+    )
+    parser.add_argument(
+        "--trace-dir",
+        type=str,
+        default=os.getenv("TRACE_DIR", None),
+        help="Directory where the stage traces of each job are written in Chrome trace format (default: not written)",
+    )
+    parser.add_argument(
+        "--profile-dir",
+        type=str,
+        default=os.getenv("PROFILE_DIR", "/tmp/profiles"),
+        help="Directory where the torch profiler captures are written",
+    )
+    parser.add_argument(
+        "--admin-token",
+        type=str,
+        default=os.getenv("ADMIN_TOKEN", None),
+        help="Token required in the X-Admin-Token header of the admin endpoints, which are disabled without it",
+    )
     return parser.parse_args()
 
 
@@ -1,5 +1,6 @@
 import base64
 import io
+import logging
 
 import torch
 from PIL import Image
@@ -7,6 +8,8 @@ import numpy as np
 
 import taesd
 
+_log = logging.getLogger(__name__)
+
 
 def process_latents(diffusers_pipeline, latents):
     """
@@ -116,9 +119,7 @@ def process_flux_latents(flux_pipeline, latents):
             return encoded_image
             
     except Exception as e:
-        print(f"Error processing Flux latents: {e}")
-        import traceback
-        traceback.print_exc()
+        _log.exception(f"Error processing Flux latents: {e}")
         
         # Fallback to a placeholder image if processing fails
         placeholder = Image.new('RGB', (256, 256), color='gray')
@@ -249,9 +250,7 @@ def process_wan_latents(wan_pipeline, latents):
                         draw.text((x, y), f"F{frame_num}", fill=(255, 255, 255))
                     
             except Exception as e:
-                print(f"Failed to decode WAN latents with VAE: {e}")
-                import traceback
-                traceback.print_exc()
+                _log.exception(f"Failed to decode WAN latents with VAE: {e}")
                 
                 # Fallback to displaying a latent heatmap grid
                 grid_pil = Image.new('RGB', (512, 512), color=(100, 100, 100))
@@ -278,9 +277,7 @@ def process_wan_latents(wan_pipeline, latents):
         return encoded_image
     
     except Exception as e:
-        print(f"Error processing WAN latents: {e}")
-        import traceback
-        traceback.print_exc()
+        _log.exception(f"Error processing WAN latents: {e}")
         
         # Fallback to a basic placeholder image if processing fails
         placeholder = Image.new('RGB', (256, 256), color='blue')
@@ -292,4 +289,19 @@ def process_wan_latents(wan_pipeline, latents):
         placeholder.save(img_bytes, format="PNG")
         img_bytes.seek(0)
         image_data = img_bytes.read()
-        return base64.b64encode(image_data).decode("utf-8")
\ No newline at end of file
+        return base64.b64encode(image_data).decode("utf-8")
+
+
+def process_mock_latents(mock_pipeline, latents):
+    """
+    Process the given latents to generate a base 64 encoded image.
+    For the mock pipeline, encoded like the real previews to keep their cost.
+    """
+    size = mock_pipeline.preview_size
+    image = mock_pipeline.latents_to_image(latents, (size, size))
+
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format="PNG")
+    img_bytes.seek(0)
+    image_data = img_bytes.read()
+    return base64.b64encode(image_data).decode("utf-8")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+
+import torch
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+import broadcast
+
+_log = logging.getLogger(__name__)
+
+# Buckets for durations from a few milliseconds (preview decode) to minutes (video jobs)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+LABELS = ["model_type", "bucket"]
+
+QUEUE_LENGTH = Gauge("studio_queue_length", "Number of jobs waiting in the queue", LABELS)
+BACKLOG_SECONDS = Gauge(
+    "studio_queue_backlog_seconds",
+    "Estimated time to process every queued job with the available workers, for autoscaling",
+    LABELS,
+)
+QUEUE_WAIT = Histogram("studio_queue_wait_seconds", "Time spent queued before processing", LABELS, buckets=DURATION_BUCKETS)
+DENOISE_STEP = Histogram("studio_denoise_step_seconds", "Time per denoising step", LABELS + ["pipeline"], buckets=DURATION_BUCKETS)
+PREVIEW_DECODE = Histogram("studio_preview_decode_seconds", "Time to decode and encode a step preview", LABELS, buckets=DURATION_BUCKETS)
+POSTPROCESS = Histogram("studio_postprocess_seconds", "Time to encode and watermark the result", LABELS, buckets=DURATION_BUCKETS)
+SAFETY_CHECK = Histogram("studio_safety_check_seconds", "Time to check a result with the safety checker", LABELS, buckets=DURATION_BUCKETS)
+SAFETY_FLAGGED = Counter("studio_safety_flagged_total", "Results flagged and replaced by the safety checker", LABELS)
+SAFETY_STOPPED = Counter("studio_safety_stopped_total", "Jobs stopped early because the safety screening flagged a preview", LABELS)
+JOB_DURATION = Histogram("studio_job_duration_seconds", "Total processing time of a job", LABELS, buckets=DURATION_BUCKETS)
+JOBS = Counter("studio_jobs_total", "Jobs by outcome", LABELS + ["outcome"])
+COALESCED = Counter("studio_jobs_coalesced_total", "Requests sharing the job of an identical request", ["model_type"])
+REJECTED = Counter("studio_jobs_rejected_total", "Jobs rejected by admission control", ["model_type"])
+WEBSOCKET_CONNECTIONS = Gauge("studio_websocket_connections", "Open progress WebSocket connections")
+NOTIFICATION_BYTES = Gauge("studio_notification_retained_bytes", "Bytes of job messages retained for the clients, all jobs")
+NOTIFICATION_BYTES.set_function(broadcast.retained_bytes)
+EVENT_LOOP_LAG = Gauge("studio_event_loop_lag_seconds", "Last measured event loop lag")
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "studio_event_loop_lag_histogram_seconds", "Event loop lag", buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+DEVICE_MEMORY_PEAK = Gauge("studio_device_memory_peak_bytes", "Peak memory allocated by torch per device", ["device"])
+
+
+def labels(model_type: str, bucket: str) -> dict:
+    return {"model_type": model_type, "bucket": bucket or "unknown"}
+
+
+def latest():
+    """Return the body and content type for the /metrics endpoint."""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def update_device_memory():
+    """Record the memory high-water mark of every CUDA device."""
+    if not torch.cuda.is_available():
+        return
+    for index in range(torch.cuda.device_count()):
+        DEVICE_MEMORY_PEAK.labels(device=f"cuda:{index}").set(torch.cuda.max_memory_allocated(index))
+
+
+class StepTimer:
+    """
+    Measures denoising steps from the step callbacks: the time since the previous
+    callback returned, which excludes the preview work done inside the callback.
+    """
+
+    def __init__(self, model_type: str, bucket: str, trace=None):
+        self.labels = labels(model_type, bucket)
+        self.trace = trace
+        self.last = time.time()
+
+    def step(self, pipeline: str, step: int):
+        now = time.time()
+        DENOISE_STEP.labels(pipeline=pipeline, **self.labels).observe(now - self.last)
+        if self.trace is not None:
+            self.trace.add_span("denoise_step", self.last, now, pipeline=pipeline, step=step)
+        self.last = now
+
+    def preview_decoded(self, start: float):
+        """Called once the preview is decoded and encoded, before it is screened and published."""
+        PREVIEW_DECODE.labels(**self.labels).observe(time.time() - start)
+
+    def preview_done(self, start: float, pipeline: str, step: int):
+        """Called when the callback returns, the preview span includes publishing it."""
+        self.last = time.time()
+        if self.trace is not None:
+            self.trace.add_span("preview", start, self.last, pipeline=pipeline, step=step)
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Background task measuring how late the event loop wakes up."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+        if lag > 1:
+            _log.warning(f"Event loop lag of {lag:.2f}s")
+
+
+def observe_job(model_type: str, bucket: str, outcome: str, seconds: float):
+    job_labels = labels(model_type, bucket)
+    JOBS.labels(outcome=outcome, **job_labels).inc()
+    if outcome == "completed":
+        JOB_DURATION.labels(**job_labels).observe(seconds)
+
+
+# Buckets with queue gauges, reset to zero once their last job leaves the queue
+_queue_buckets = set()
+
+
+def update_queue(model_type: str, queue: dict):
+    """
+    Update the queue length and the backlog estimate of each resolution bucket,
+    `queue` maps a bucket to its queue length and backlog seconds.
+    """
+    for bucket in _queue_buckets - set(queue):
+        QUEUE_LENGTH.labels(**labels(model_type, bucket)).set(0)
+        BACKLOG_SECONDS.labels(**labels(model_type, bucket)).set(0)
+    for bucket, (queue_length, backlog_seconds) in queue.items():
+        QUEUE_LENGTH.labels(**labels(model_type, bucket)).set(queue_length)
+        BACKLOG_SECONDS.labels(**labels(model_type, bucket)).set(backlog_seconds)
+    _queue_buckets.update(queue)
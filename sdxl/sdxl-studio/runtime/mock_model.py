@@ -0,0 +1,98 @@
+import logging
+import time
+
+import torch
+from PIL import Image
+
+from classes import GenerationRequest
+from preemption import Checkpoint, Preempted
+
+_log = logging.getLogger(__name__)
+
+
+class MockModelPipeline:
+    """
+    Pipeline that loads no model. It sleeps for a configurable time per step and
+    emits synthetic latents and images through the same callback contract as the
+    diffusers pipelines, to load-test the queue and WebSocket tier on CPU nodes. With
+    use_refiner, the steps after denoising_limit go through the refiner callback.
+    """
+
+    supports_preemption = True
+
+    def __init__(self, args):
+        self.step_latency: float = args.mock_step_latency
+        self.preview_size: int = args.mock_preview_size
+        self.use_refiner: bool = args.use_refiner or False
+        self.pipeline = self
+        self.refiner = None
+        self.ready = False
+        self._interrupt = False
+
+    def load(self):
+        _log.info(f"Mock pipeline ready, step latency: {self.step_latency}s")
+        self.ready = True
+
+    @property
+    def interrupt(self):
+        return self._interrupt
+
+    def base_steps(self, payload: GenerationRequest) -> int:
+        """Steps run before the refiner takes over, all of them without refiner."""
+        num_inference_steps = payload.num_inference_steps
+        denoising_limit = payload.denoising_limit
+        if not self.use_refiner or denoising_limit is None or not 0 < denoising_limit < 1:
+            return num_inference_steps
+        return min(num_inference_steps, max(1, int(denoising_limit * num_inference_steps)))
+
+    def predict(
+        self,
+        payload: GenerationRequest,
+        callback_func_base: callable,
+        callback_func_refiner: callable = None,
+        checkpoint: Checkpoint = None,
+        preempt: callable = None,
+    ) -> Image.Image:
+        height = payload.height or 1024
+        width = payload.width or 1024
+        num_inference_steps = payload.num_inference_steps
+        base_steps = self.base_steps(payload)
+        generator = torch.Generator("cpu").manual_seed(getattr(payload, "seed", None) or 0)
+
+        _log.info(f"Generating mock image: height={height}, width={width}, steps={num_inference_steps}")
+
+        self._interrupt = False
+        if checkpoint is not None:
+            start_step, latents = checkpoint.step, checkpoint.restore_latents()
+        else:
+            start_step, latents = 0, torch.randn((1, 4, height // 8, width // 8), generator=generator)
+        for step in range(start_step, base_steps):
+            if self._interrupt:
+                break
+            latents = self.denoise(latents, step, num_inference_steps, callback_func_base, step)
+            if preempt is not None and step < base_steps - 1 and not self._interrupt and preempt():
+                raise Preempted(Checkpoint(step + 1, latents))
+        # The refiner counts its steps from 0, like a separate diffusers pipeline
+        for step in range(base_steps, num_inference_steps):
+            if self._interrupt:
+                break
+            latents = self.denoise(latents, step, num_inference_steps, callback_func_refiner, step - base_steps)
+
+        return self.latents_to_image(latents, (width, height))
+
+    def denoise(self, latents, step, num_inference_steps, callback, callback_step) -> torch.Tensor:
+        time.sleep(self.step_latency)
+        latents = latents * 0.9 + 0.01 * torch.sin(latents * (step + 1))
+        timestep = torch.tensor(1000 * (1 - step / num_inference_steps))
+        if callback:
+            callback_outputs = callback(self, callback_step, timestep, {"latents": latents})
+            latents = callback_outputs.pop("latents", latents)
+        return latents
+
+    def latents_to_image(self, latents: torch.Tensor, size) -> Image.Image:
+        """Map the first three latent channels to RGB and resize."""
+        rgb = latents[0, :3]
+        rgb = (rgb - rgb.min()) / (rgb.max() - rgb.min() + 1e-6)
+        array = (rgb.permute(1, 2, 0) * 255).round().to(torch.uint8).numpy()
+        return Image.fromarray(array).resize(size)
+
@@ -0,0 +1,106 @@
+import contextlib
+import copy
+import logging
+from typing import Any, Dict
+
+import torch
+
+_log = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """State of a denoising loop at a step boundary, enough to resume it with the same result."""
+
+    def __init__(self, step: int, latents: torch.Tensor, scheduler_state: Dict[str, Any] = None):
+        self.step = step  # Index of the next step to run
+        self.latents = offload(latents)
+        self.scheduler_state = scheduler_state
+
+    def restore_latents(self) -> torch.Tensor:
+        return reload(self.latents)
+
+
+class Preempted(Exception):
+    """Raised from a step callback to stop a job so that it can be resumed from its checkpoint."""
+
+    def __init__(self, checkpoint: Checkpoint):
+        super().__init__(f"Preempted at step {checkpoint.step}")
+        self.checkpoint = checkpoint
+
+
+class _Offloaded:
+    """A tensor moved to the CPU while its job is preempted, and the device to restore it to."""
+
+    def __init__(self, tensor: torch.Tensor):
+        self.device = tensor.device
+        self.tensor = tensor.detach().to("cpu", copy=True)
+
+
+def offload(value):
+    """Copy a value, moving its tensors to the CPU to free device memory for the other jobs."""
+    if isinstance(value, torch.Tensor):
+        return _Offloaded(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(offload(item) for item in value)
+    if isinstance(value, dict):
+        return {key: offload(item) for key, item in value.items()}
+    return copy.deepcopy(value)
+
+
+def reload(value):
+    """Inverse of offload, tensors are moved back to their original device."""
+    if isinstance(value, _Offloaded):
+        return value.tensor.to(value.device)
+    if isinstance(value, (list, tuple)):
+        return type(value)(reload(item) for item in value)
+    if isinstance(value, dict):
+        return {key: reload(item) for key, item in value.items()}
+    return copy.deepcopy(value)
+
+
+def snapshot_scheduler(scheduler) -> Dict[str, Any]:
+    """
+    Copy the mutable state of a diffusers scheduler (step index, sigmas and, for multistep
+    solvers, the previous model outputs). The config is immutable and left out, and so are
+    the methods patched on the instance by resume_scheduler: their closures hold the
+    previous checkpoint.
+    """
+    return {
+        key: offload(value)
+        for key, value in vars(scheduler).items()
+        if key != "_internal_dict" and not callable(value)
+    }
+
+
+@contextlib.contextmanager
+def resume_scheduler(scheduler, checkpoint: Checkpoint):
+    """
+    Make the next pipeline call resume from the checkpoint: once the pipeline sets the
+    timesteps, the scheduler state is restored and the pipeline only sees the remaining
+    timesteps. The scheduler itself keeps the full list, that multistep solvers use to
+    pick their order on the last steps.
+    """
+    set_timesteps = scheduler.set_timesteps
+    step = scheduler.step
+    full_timesteps = None
+
+    def resumed_set_timesteps(*args, **kwargs):
+        nonlocal full_timesteps
+        set_timesteps(*args, **kwargs)
+        vars(scheduler).update(reload(checkpoint.scheduler_state))
+        full_timesteps = scheduler.timesteps
+        scheduler.timesteps = full_timesteps[checkpoint.step :]
+
+    def resumed_step(*args, **kwargs):
+        if full_timesteps is not None:
+            scheduler.timesteps = full_timesteps
+        return step(*args, **kwargs)
+
+    scheduler.set_timesteps = resumed_set_timesteps
+    scheduler.step = resumed_step
+    try:
+        yield
+    finally:
+        # Remove the instance attributes, back to the class methods
+        del scheduler.set_timesteps
+        del scheduler.step
@@ -0,0 +1,193 @@
+"""
+Pub/sub channels between the API tier and the worker tier.
+
+Channels are plain strings, messages JSON-serializable dicts. Subscribers register
+a coroutine for a channel prefix. LocalBroker delivers in process, for a single
+replica running its own workers. SocketBroker connects to a small TCP hub, run with:
+
+    python pubsub.py --host 0.0.0.0 --port 7070
+
+so that API replicas and worker processes on other pods exchange messages. The hub
+is a stand-in for a production broker (Redis, NATS...) implementing the same interface.
+"""
+import argparse
+import asyncio
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+_log = logging.getLogger(__name__)
+
+Callback = Callable[[str, dict], Awaitable[None]]
+
+# Large enough for a base64 encoded result image on a single line
+MAX_LINE_BYTES = 256 * 1024 * 1024
+
+
+class Broker(ABC):
+    def __init__(self):
+        self.subscriptions: List[Tuple[str, Callback]] = []
+
+    def subscribe(self, prefix: str, callback: Callback):
+        """Call `callback(channel, message)` for every message published on a channel starting with prefix."""
+        self.subscriptions.append((prefix, callback))
+
+    async def _dispatch(self, channel: str, message: dict):
+        for prefix, callback in self.subscriptions:
+            if channel.startswith(prefix):
+                try:
+                    await callback(channel, message)
+                except Exception as e:
+                    _log.error(f"Error handling message on {channel}: {e}")
+
+    @property
+    def remote(self) -> bool:
+        """True if messages also go to other processes."""
+        return False
+
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, channel: str, message: dict):
+        """Deliver a message to the subscribers of its channel."""
+
+    async def close(self):
+        pass
+
+
+class LocalBroker(Broker):
+    """Delivers messages to the subscribers of this process."""
+
+    async def publish(self, channel, message):
+        await self._dispatch(channel, message)
+
+
+class SocketBroker(Broker):
+    """
+    Client of the TCP hub. Messages are delivered to the subscribers of this process
+    directly, and to the other processes through the hub. Reconnects with a backoff if
+    the hub goes away; messages published meanwhile only reach this process.
+    """
+
+    def __init__(self, host: str, port: int):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+    @property
+    def remote(self):
+        return True
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), 10)
+        except asyncio.TimeoutError:
+            _log.warning(f"Pub/sub hub {self.host}:{self.port} not reachable yet, retrying in the background")
+
+    async def _run(self):
+        backoff = 0.5
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port, limit=MAX_LINE_BYTES)
+                prefixes = [prefix for prefix, _ in self.subscriptions]
+                writer.write(json.dumps({"subscribe": prefixes}).encode() + b"\n")
+                await writer.drain()
+                self._writer = writer
+                self._connected.set()
+                backoff = 0.5
+                _log.info(f"Connected to the pub/sub hub {self.host}:{self.port}")
+                while line := await reader.readline():
+                    envelope = json.loads(line)
+                    await self._dispatch(envelope["channel"], envelope["message"])
+                _log.warning("Pub/sub hub closed the connection")
+            except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                _log.warning(f"Pub/sub connection error: {e}")
+            self._writer = None
+            self._connected.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 10)
+
+    async def publish(self, channel, message):
+        await self._dispatch(channel, message)
+        writer = self._writer
+        if writer is None:
+            _log.warning(f"Not connected to the pub/sub hub, a message on {channel} only reached this process")
+            return
+        try:
+            writer.write(json.dumps({"channel": channel, "message": message}).encode() + b"\n")
+            await writer.drain()
+        except (OSError, RuntimeError) as e:
+            _log.warning(f"Could not publish on {channel}: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+def create_broker(url: Optional[str]) -> Broker:
+    """LocalBroker without URL, SocketBroker for tcp://host:port."""
+    if not url:
+        return LocalBroker()
+    parsed = urlparse(url)
+    if parsed.scheme != "tcp" or not parsed.hostname or not parsed.port:
+        raise ValueError(f"Unsupported pub/sub URL {url}, expected tcp://host:port")
+    return SocketBroker(parsed.hostname, parsed.port)
+
+
+class Hub:
+    """TCP hub forwarding each published message to the other connections subscribed to its channel."""
+
+    def __init__(self):
+        self.connections = {}  # StreamWriter -> list of channel prefixes
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections[writer] = []
+        try:
+            while line := await reader.readline():
+                envelope = json.loads(line)
+                if "subscribe" in envelope:
+                    self.connections[writer] = list(envelope["subscribe"])
+                    continue
+                channel = envelope["channel"]
+                for other, prefixes in list(self.connections.items()):
+                    if other is not writer and any(channel.startswith(prefix) for prefix in prefixes):
+                        try:
+                            other.write(line)
+                            await other.drain()
+                        except (OSError, RuntimeError):
+                            self.connections.pop(other, None)
+        except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+            _log.warning(f"Hub connection error: {e}")
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> asyncio.base_events.Server:
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_LINE_BYTES)
+
+
+async def run_hub(host: str, port: int):
+    server = await Hub().serve(host, port)
+    _log.info(f"Pub/sub hub listening on {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    from helpers import logging_config
+
+    logging_config()
+    parser = argparse.ArgumentParser(description="Pub/sub hub between the API and worker tiers.")
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7070)
+    hub_args = parser.parse_args()
+    asyncio.run(run_hub(hub_args.host, hub_args.port))
@@ -0,0 +1,341 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+_log = logging.getLogger(__name__)
+
+
+class Lease:
+    """A job handed to one worker until it acks it, releases it or the lease expires."""
+
+    def __init__(self, job_id: str, payload: dict, token: str, attempts: int):
+        self.job_id = job_id
+        self.payload = payload
+        self.token = token
+        self.attempts = attempts
+
+
+class QueueBackend(ABC):
+    """
+    Job queue shared by the workers. Jobs are leased rather than popped: a worker
+    extends its lease while processing and acks the job once done. A job whose lease
+    expires (crashed or stuck worker) goes back to the queue, unless it already used
+    `max_attempts` leases. Jobs are ordered by priority, lowest first, then by arrival.
+    Payloads are JSON-serializable dicts.
+    """
+
+    durable = False  # Queued jobs survive a restart
+
+    @abstractmethod
+    def put(self, job_id: str, payload: dict, priority: float):
+        """Queue a job, ordered by priority then arrival."""
+
+    @abstractmethod
+    def lease(self, owner: str, lease_seconds: float) -> Optional[Lease]:
+        """Lease the next queued job, or return None if there is none."""
+
+    @abstractmethod
+    def extend(self, lease: Lease, lease_seconds: float) -> bool:
+        """Extend a lease. Returns False if it was lost (expired and leased again, or cancelled)."""
+
+    @abstractmethod
+    def ack(self, lease: Lease) -> bool:
+        """Remove a processed job. Returns False if the lease was lost."""
+
+    @abstractmethod
+    def release(self, lease: Lease, priority: Optional[float] = None) -> bool:
+        """Put a leased job back in the queue, optionally with a new priority."""
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancel a job. A queued job is removed, a leased job is marked so that the next
+        extend of its lease fails. Returns the state of the job before, None if unknown.
+        """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Tuple[str, dict]]:
+        """State ('queued' or 'leased') and payload of a job still in the queue."""
+
+    @abstractmethod
+    def queued(self) -> List[Tuple[str, dict]]:
+        """Queued job ids and payloads, in the order they will be leased."""
+
+    def queued_ids(self) -> List[str]:
+        return [job_id for job_id, _ in self.queued()]
+
+    def close(self):
+        pass
+
+
+class MemoryQueueBackend(QueueBackend):
+    """In-process queue, for a single replica. Queued jobs are lost on restart."""
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+        self._heap = []  # (priority, seq, job_id), may hold stale entries
+        self._entries: Dict[str, dict] = {}  # job_id -> entry
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def put(self, job_id, payload, priority):
+        with self._lock:
+            entry = {"payload": payload, "priority": priority, "seq": next(self._counter), "state": "queued", "attempts": 0}
+            self._entries[job_id] = entry
+            heapq.heappush(self._heap, (priority, entry["seq"], job_id))
+
+    def _requeue_expired(self, now):
+        for job_id, entry in list(self._entries.items()):
+            if entry["state"] == "leased" and entry["expires"] < now:
+                self._expire(job_id, entry)
+
+    def _expire(self, job_id, entry):
+        entry["token"] = None
+        if entry["attempts"] >= self.max_attempts:
+            _log.error(f"Job {job_id} dropped after {entry['attempts']} expired leases")
+            del self._entries[job_id]
+            return
+        entry["state"] = "queued"
+        entry["seq"] = next(self._counter)
+        heapq.heappush(self._heap, (entry["priority"], entry["seq"], job_id))
+
+    def lease(self, owner, lease_seconds):
+        now = time.time()
+        with self._lock:
+            self._requeue_expired(now)
+            while self._heap:
+                priority, seq, job_id = heapq.heappop(self._heap)
+                entry = self._entries.get(job_id)
+                if entry is None or entry["state"] != "queued" or entry["seq"] != seq:
+                    continue  # Stale heap entry
+                entry.update(state="leased", token=uuid.uuid4().hex, owner=owner, expires=now + lease_seconds)
+                entry["attempts"] += 1
+                return Lease(job_id, entry["payload"], entry["token"], entry["attempts"])
+        return None
+
+    def _leased(self, lease):
+        entry = self._entries.get(lease.job_id)
+        if entry is None or entry.get("token") != lease.token:
+            return None
+        return entry
+
+    def extend(self, lease, lease_seconds):
+        with self._lock:
+            entry = self._leased(lease)
+            if entry is None or entry["state"] != "leased":
+                return False
+            entry["expires"] = time.time() + lease_seconds
+            return True
+
+    def ack(self, lease):
+        with self._lock:
+            if self._leased(lease) is None:
+                return False
+            del self._entries[lease.job_id]
+            return True
+
+    def release(self, lease, priority=None):
+        with self._lock:
+            entry = self._leased(lease)
+            if entry is None or entry["state"] != "leased":
+                return False
+            if priority is not None:
+                entry["priority"] = priority
+            # A released lease is not a failed attempt
+            entry["attempts"] -= 1
+            entry.update(state="queued", token=None, seq=next(self._counter))
+            heapq.heappush(self._heap, (entry["priority"], entry["seq"], lease.job_id))
+            return True
+
+    def cancel(self, job_id):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None:
+                return None
+            state = entry["state"]
+            if state == "queued":
+                del self._entries[job_id]
+            else:
+                entry["state"] = "cancelled"
+            return state
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None or entry["state"] == "cancelled":
+                return None
+            return entry["state"], entry["payload"]
+
+    def queued(self):
+        with self._lock:
+            queued = [(entry["priority"], entry["seq"], job_id) for job_id, entry in self._entries.items() if entry["state"] == "queued"]
+            return [(job_id, self._entries[job_id]["payload"]) for _, _, job_id in sorted(queued)]
+
+
+class SQLiteQueueBackend(QueueBackend):
+    """
+    Durable queue in a SQLite database. Several processes on the same node (or pods
+    sharing a volume with proper file locking) can lease from it: leases are taken in
+    an immediate transaction, so a job is only handed to one worker at a time.
+    """
+
+    durable = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT UNIQUE NOT NULL,
+            payload TEXT NOT NULL,
+            priority REAL NOT NULL,
+            queued_at REAL NOT NULL,
+            state TEXT NOT NULL,
+            lease_token TEXT,
+            lease_owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS jobs_order ON jobs (state, priority, queued_at, seq);
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # One connection shared by the event loop and the worker threads
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    def _transaction(self, func, *args):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(cursor, *args)
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+            return result
+
+    def put(self, job_id, payload, priority):
+        self._transaction(
+            lambda cursor: cursor.execute(
+                "INSERT INTO jobs (id, payload, priority, queued_at, state) VALUES (?, ?, ?, ?, 'queued')",
+                (job_id, json.dumps(payload), priority, time.time()),
+            )
+        )
+
+    def _lease(self, cursor, owner, lease_seconds):
+        now = time.time()
+        # Expired leases go back to the queue, or fail after too many attempts
+        cursor.execute(
+            "DELETE FROM jobs WHERE state = 'leased' AND lease_expires < ? AND attempts >= ? RETURNING id",
+            (now, self.max_attempts),
+        )
+        for (job_id,) in cursor.fetchall():
+            _log.error(f"Job {job_id} dropped after {self.max_attempts} expired leases")
+        cursor.execute(
+            "UPDATE jobs SET state = 'queued', lease_token = NULL, lease_owner = NULL, queued_at = ? "
+            "WHERE state = 'leased' AND lease_expires < ?",
+            (now, now),
+        )
+        cursor.execute(
+            "DELETE FROM jobs WHERE state = 'cancelled' AND lease_expires < ?",
+            (now,),
+        )
+        row = cursor.execute(
+            "SELECT seq, id, payload, attempts FROM jobs WHERE state = 'queued' ORDER BY priority, queued_at, seq LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        seq, job_id, payload, attempts = row
+        token = uuid.uuid4().hex
+        cursor.execute(
+            "UPDATE jobs SET state = 'leased', lease_token = ?, lease_owner = ?, lease_expires = ?, attempts = ? "
+            "WHERE seq = ?",
+            (token, owner, now + lease_seconds, attempts + 1, seq),
+        )
+        return Lease(job_id, json.loads(payload), token, attempts + 1)
+
+    def lease(self, owner, lease_seconds):
+        return self._transaction(self._lease, owner, lease_seconds)
+
+    def _update_lease(self, sql, params, lease):
+        def update(cursor):
+            cursor.execute(sql, params + (lease.job_id, lease.token))
+            return cursor.rowcount == 1
+
+        return self._transaction(update)
+
+    def extend(self, lease, lease_seconds):
+        return self._update_lease(
+            "UPDATE jobs SET lease_expires = ? WHERE state = 'leased' AND id = ? AND lease_token = ?",
+            (time.time() + lease_seconds,),
+            lease,
+        )
+
+    def ack(self, lease):
+        return self._update_lease("DELETE FROM jobs WHERE id = ? AND lease_token = ?", (), lease)
+
+    def release(self, lease, priority=None):
+        return self._update_lease(
+            "UPDATE jobs SET state = 'queued', lease_token = NULL, lease_owner = NULL, "
+            "priority = COALESCE(?, priority), queued_at = ?, attempts = attempts - 1 "
+            "WHERE state = 'leased' AND id = ? AND lease_token = ?",
+            (priority, time.time()),
+            lease,
+        )
+
+    def cancel(self, job_id):
+        def cancel(cursor):
+            row = cursor.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == "queued":
+                cursor.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            else:
+                cursor.execute("UPDATE jobs SET state = 'cancelled' WHERE id = ?", (job_id,))
+            return row[0]
+
+        return self._transaction(cancel)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT state, payload FROM jobs WHERE id = ? AND state IN ('queued', 'leased')", (job_id,)
+            ).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def queued(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, payload FROM jobs WHERE state = 'queued' ORDER BY priority, queued_at, seq"
+            ).fetchall()
+        return [(job_id, json.loads(payload)) for job_id, payload in rows]
+
+    def queued_ids(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT id FROM jobs WHERE state = 'queued' ORDER BY priority, queued_at, seq").fetchall()
+        return [job_id for (job_id,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def create_queue_backend(args) -> QueueBackend:
+    if args.queue_backend == "sqlite":
+        _log.info(f"Using the SQLite job queue at {args.queue_path}")
+        return SQLiteQueueBackend(args.queue_path)
+    return MemoryQueueBackend()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+_log = logging.getLogger(__name__)
+
+# Normalization of the CLIP image processor
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+def screening_steps(fractions: List[float], num_steps: int) -> Set[int]:
+    """Steps of a run of num_steps whose previews are screened, at these fractions of the run."""
+    return {min(num_steps - 1, max(0, int(fraction * num_steps))) for fraction in fractions}
+
+
+class SafetyChecker:
+    """
+    Stable Diffusion safety checker running in process, next to the pipelines. Images are
+    resized and normalized on the checker's device, and scored like
+    StableDiffusionSafetyChecker.forward_onnx without copying them back. Checks of the
+    workers are batched: images arriving while a batch runs form the next batch.
+    """
+
+    def __init__(self, checker, device: torch.device, dtype: torch.dtype, max_batch_size: int = 8):
+        self.checker = checker
+        self.device = device
+        self.dtype = dtype
+        self.image_size = checker.vision_model.config.image_size
+        self.max_batch_size = max(max_batch_size, 1)
+        self._pending: List[Tuple[Image.Image, asyncio.Future]] = []
+        self._runner: Optional[asyncio.Task] = None
+
+        mean = torch.tensor(CLIP_MEAN, device=device).view(3, 1, 1)
+        std = torch.tensor(CLIP_STD, device=device).view(3, 1, 1)
+        self._normalization = (mean, std)
+        # The concepts never change, normalize them once
+        self._special_embeds = F.normalize(checker.special_care_embeds.detach().float(), dim=-1)
+        self._special_thresholds = checker.special_care_embeds_weights.detach().float()
+        self._concept_embeds = F.normalize(checker.concept_embeds.detach().float(), dim=-1)
+        self._concept_thresholds = checker.concept_embeds_weights.detach().float()
+
+    @classmethod
+    def load(cls, pipeline_instance, model_id: str, max_batch_size: int = 8) -> "SafetyChecker":
+        """
+        Checker of a loaded pipeline: its own safety checker if it has one, else model_id
+        loaded on the pipeline's device.
+        """
+        pipeline = getattr(pipeline_instance, "pipeline", None)
+        device = getattr(pipeline, "device", None)
+        if not isinstance(device, torch.device):
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        dtype = torch.float16 if device.type == "cuda" else torch.float32
+        checker = getattr(pipeline, "safety_checker", None)
+        if checker is None:
+            from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker
+
+            _log.info(f"Loading the safety checker {model_id} on {device}")
+            checker = StableDiffusionSafetyChecker.from_pretrained(model_id, torch_dtype=dtype)
+        else:
+            _log.info("Using the safety checker of the pipeline")
+        return cls(checker.to(device, dtype).eval(), device, dtype, max_batch_size)
+
+    def clip_input(self, images: List[Image.Image]) -> torch.Tensor:
+        """CLIP inputs of decoded images, resized and center cropped on the device like the CLIP image processor."""
+        mean, std = self._normalization
+        batch = []
+        for image in images:
+            # A writable copy, torch warns about tensors sharing read-only memory
+            pixels = torch.from_numpy(np.array(image.convert("RGB"))).to(self.device)
+            pixels = pixels.permute(2, 0, 1).unsqueeze(0).float().div_(255)
+            height, width = pixels.shape[-2:]
+            scale = self.image_size / min(height, width)
+            size = (max(self.image_size, round(height * scale)), max(self.image_size, round(width * scale)))
+            pixels = F.interpolate(pixels, size=size, mode="bicubic", antialias=True, align_corners=False)
+            top, left = (size[0] - self.image_size) // 2, (size[1] - self.image_size) // 2
+            pixels = pixels[0, :, top : top + self.image_size, left : left + self.image_size]
+            batch.append((pixels.clamp_(0, 1) - mean) / std)
+        return torch.stack(batch).to(self.dtype)
+
+    @torch.no_grad()
+    def scores(self, images: List[Image.Image]) -> List[float]:
+        """Highest concept score of each image, the image is flagged when it is positive."""
+        pooled_output = self.checker.vision_model(self.clip_input(images))[1]
+        image_embeds = F.normalize(self.checker.visual_projection(pooled_output).float(), dim=-1)
+        special_scores = image_embeds @ self._special_embeds.T - self._special_thresholds
+        special_care = torch.any(special_scores > 0, dim=1, keepdim=True)
+        concept_scores = image_embeds @ self._concept_embeds.T - self._concept_thresholds + special_care * 0.01
+        return concept_scores.max(dim=1).values.tolist()
+
+    async def score(self, image: Image.Image) -> float:
+        """Score of an image, checked in a batch with the images of the other workers."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((image, future))
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+        return await future
+
+    async def _run(self):
+        while self._pending:
+            batch = self._pending[: self.max_batch_size]
+            del self._pending[: self.max_batch_size]
+            try:
+                scores = await asyncio.to_thread(self.scores, [image for image, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), score in zip(batch, scores):
+                if not future.done():
+                    future.set_result(score)
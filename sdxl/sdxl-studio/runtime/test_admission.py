@@ -0,0 +1,48 @@
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def test_unlimited_by_default():
+    controller = AdmissionController()
+    for _ in range(100):
+        controller.admit("client", queue_length=1000, backlog_seconds=1e6)
+
+
+def test_queue_length_limit():
+    controller = AdmissionController(max_queue_length=2)
+    controller.admit("a", queue_length=1, backlog_seconds=0)
+    with pytest.raises(AdmissionRejected) as e:
+        controller.admit("a", queue_length=2, backlog_seconds=0)
+    # No completion measured yet, the default is used
+    assert e.value.retry_after == controller.default_retry_after
+
+
+def test_backlog_limit():
+    controller = AdmissionController(max_backlog_seconds=60)
+    controller.admit("a", queue_length=2, backlog_seconds=59)
+    with pytest.raises(AdmissionRejected):
+        controller.admit("a", queue_length=3, backlog_seconds=90)
+
+
+def test_per_client_limit_and_release():
+    controller = AdmissionController(max_jobs_per_client=1)
+    controller.admit("a", 0, 0)
+    controller.admit("b", 0, 0)
+    with pytest.raises(AdmissionRejected):
+        controller.admit("a", 0, 0)
+    controller.release("a")
+    controller.admit("a", 0, 0)
+    # Releasing an unknown client is a no-op
+    controller.release("unknown")
+    controller.release(None)
+
+
+def test_retry_after_from_throughput(monkeypatch):
+    controller = AdmissionController()
+    now = 1000.0
+    monkeypatch.setattr("admission.time.time", lambda: now)
+    # 10 jobs completed over the last 20 seconds: 0.5 job/s
+    controller.completions.extend(now - 20 + 2 * i for i in range(10))
+    assert controller.retry_after(1) == 2
+    assert controller.retry_after(5) == 10
@@ -0,0 +1,114 @@
+import asyncio
+
+from broadcast import Broadcast, retained_bytes
+
+
+def progress(step, pipeline="base"):
+    return {"status": "progress", "pipeline": pipeline, "step": step}
+
+
+def drain(subscription):
+    messages = []
+    while (message := subscription.get_nowait()) is not None:
+        messages.append(message)
+    return messages
+
+
+def test_every_subscriber_gets_every_message():
+    broadcast = Broadcast()
+    first, second = broadcast.subscribe(), broadcast.subscribe()
+    broadcast.publish({"status": "processing"})
+    assert first.get_nowait() == second.get_nowait() == {"status": "processing"}
+    broadcast.publish(progress(0))
+    assert drain(first) == [progress(0)]
+    assert drain(second) == [progress(0)]
+
+
+def test_progress_coalesces_to_latest():
+    broadcast = Broadcast()
+    subscription = broadcast.subscribe()
+    broadcast.publish({"status": "processing"})
+    for step in range(5):
+        broadcast.publish(progress(step))
+    broadcast.publish(progress(0, "refiner"))
+    assert drain(subscription) == [{"status": "processing"}, progress(4), progress(0, "refiner")]
+    assert subscription.skipped == 4
+
+
+def test_terminal_message_survives_overrun():
+    broadcast = Broadcast(size=4)
+    slow = broadcast.subscribe()
+    broadcast.publish({"status": "processing"})
+    for step in range(10):
+        broadcast.publish({"status": "video_ready", "step": step})
+    broadcast.publish({"status": "completed", "image": "result"})
+    broadcast.publish(progress(11))  # Ignored after the terminal message
+    messages = drain(slow)
+    assert len(messages) == 4
+    assert messages[-1] == {"status": "completed", "image": "result"}
+    assert broadcast.latest == {"status": "completed", "image": "result"}
+
+
+def test_late_joiner_starts_from_latest():
+    broadcast = Broadcast()
+    for step in range(3):
+        broadcast.publish(progress(step))
+    assert drain(broadcast.subscribe()) == [progress(2)]
+
+
+def test_get_waits_for_publish():
+    async def scenario():
+        broadcast = Broadcast()
+        subscriptions = [broadcast.subscribe() for _ in range(3)]
+        waiting = [asyncio.create_task(subscription.get()) for subscription in subscriptions]
+        await asyncio.sleep(0)
+        broadcast.publish({"status": "completed"})
+        return await asyncio.wait_for(asyncio.gather(*waiting), 1)
+
+    assert asyncio.run(scenario()) == [{"status": "completed"}] * 3
+
+
+def test_unwatched_job_memory_is_bounded():
+    broadcast = Broadcast()
+    preview = "x" * 100_000
+    for step in range(50):
+        broadcast.publish({"status": "progress", "pipeline": "base", "step": step, "image": preview})
+    # Only the latest preview is kept
+    assert 100_000 < broadcast.retained_bytes < 101_000
+    assert retained_bytes() >= broadcast.retained_bytes
+
+
+def test_byte_budget_keeps_terminal_message():
+    broadcast = Broadcast()
+    broadcast.max_bytes = 250_000
+    subscription = broadcast.subscribe()
+    for frame in range(5):
+        broadcast.publish({"status": "video_ready", "frame": frame, "image": "x" * 100_000})
+    broadcast.publish({"status": "completed", "image": "y" * 100_000})
+    assert broadcast.retained_bytes <= 250_000
+    messages = drain(subscription)
+    assert [message["status"] for message in messages] == ["video_ready", "completed"]
+    assert subscription.skipped == 4
+
+
+def test_single_message_over_budget_is_kept():
+    broadcast = Broadcast()
+    broadcast.max_bytes = 10
+    broadcast.publish({"status": "completed", "image": "x" * 1000})
+    assert broadcast.latest["status"] == "completed"
+
+
+def test_resume_after_seq():
+    broadcast = Broadcast()
+    broadcast.publish({"status": "processing"})
+    broadcast.publish({"status": "video_ready"})
+    subscription = broadcast.subscribe()
+    seq, message = subscription.next_nowait()
+    assert (seq, message) == (broadcast.latest_seq, {"status": "video_ready"})
+    broadcast.publish(progress(0))
+    broadcast.publish({"status": "completed"})
+    # A client that received the first message resumes after it
+    resumed = broadcast.subscribe(after=0)
+    assert [event[1]["status"] for event in iter(resumed.next_nowait, None)] == ["video_ready", "progress", "completed"]
+    # A seq from the future waits for the next message
+    assert broadcast.subscribe(after=99).next_nowait() is None
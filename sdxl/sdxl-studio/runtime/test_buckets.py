@@ -0,0 +1,75 @@
+import pytest
+
+from buckets import RequestNormalizer, parse_buckets
+from classes import GenerationRequest
+
+
+def make_request(**kwargs) -> GenerationRequest:
+    return GenerationRequest(prompt="cat, photo, 4k", **kwargs)
+
+
+def test_snap_prefers_aspect_ratio_then_area():
+    normalizer = RequestNormalizer("flux")
+    # Same aspect ratio as both 512x512 and 1024x1024, area decides
+    assert normalizer.snap(600, 600) == (512, 512)
+    assert normalizer.snap(900, 900) == (1024, 1024)
+    # Aspect ratio wins over area
+    assert normalizer.snap(1920, 1080) == (1344, 768)
+
+
+def test_snap_single_dimension():
+    normalizer = RequestNormalizer("flux")
+    assert normalizer.snap(512, None) == (512, 512)
+    assert normalizer.snap(None, 1344) == (768, 1344)
+
+
+@pytest.mark.parametrize("width,height", [(None, None), (0, 0)])
+def test_missing_size_uses_default_bucket(width, height):
+    request, bucket = RequestNormalizer("sdxl").normalize(make_request(width=width, height=height))
+    assert (request.width, request.height) == (1024, 1024)
+    assert bucket == "1024x1024"
+
+
+def test_negative_size_is_rejected():
+    with pytest.raises(ValueError):
+        RequestNormalizer("sdxl").normalize(make_request(width=-512, height=512))
+
+
+def test_parse_buckets():
+    assert parse_buckets("1024x1024, 1152X896") == [(1024, 1024), (1152, 896)]
+
+
+@pytest.mark.parametrize("value", ["", "1024", "1024x", "axb", "1000x1000", "0x1024", "-16x16"])
+def test_parse_buckets_rejects_invalid(value):
+    with pytest.raises(ValueError):
+        parse_buckets(value)
+
+
+def test_steps_are_clamped():
+    request, _ = RequestNormalizer("sdxl").normalize(make_request(num_inference_steps=500))
+    assert request.num_inference_steps == 100
+    request, _ = RequestNormalizer("sdxl").normalize(make_request(num_inference_steps=0))
+    assert request.num_inference_steps == 1
+
+
+def test_max_inference_steps_override():
+    normalizer = RequestNormalizer("sdxl", max_inference_steps=30)
+    request, _ = normalizer.normalize(make_request(num_inference_steps=50))
+    assert request.num_inference_steps == 30
+    with pytest.raises(ValueError):
+        normalizer.normalize(make_request(timesteps=list(range(31))))
+
+
+def test_wan_frames_snap_to_4k_plus_1():
+    normalizer = RequestNormalizer("wan")
+    assert normalizer.normalize(make_request(num_frames=50))[0].num_frames == 49
+    assert normalizer.normalize(make_request(num_frames=200))[0].num_frames == 81
+    with pytest.raises(ValueError):
+        normalizer.normalize(make_request(num_frames=0))
+
+
+def test_disabled_normalizer_keeps_request():
+    normalizer = RequestNormalizer("sdxl", enabled=False)
+    request = make_request(width=1000, height=700, num_inference_steps=500)
+    assert normalizer.normalize(request) == (request, "1000x700")
+    assert normalizer.normalize(make_request(width=1000))[1] is None
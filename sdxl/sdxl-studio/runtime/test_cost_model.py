@@ -0,0 +1,81 @@
+from classes import GenerationRequest, Job
+from cost_model import CostModel, sjf_priority
+from queue_backends import MemoryQueueBackend
+
+
+def make_request(**kwargs) -> GenerationRequest:
+    return GenerationRequest(prompt="cat, photo, 4k", **kwargs)
+
+
+def test_no_estimate_before_first_job():
+    model = CostModel("sdxl")
+    assert model.expected_seconds(make_request(width=1024, height=1024)) is None
+    assert model.schedule([], [Job("a", make_request())], workers=1) == {}
+
+
+def test_learns_step_and_overhead():
+    model = CostModel("sdxl")
+    request = make_request(width=1024, height=1024, num_inference_steps=11)
+    # 11 steps one second apart, 4 seconds outside of the steps
+    model.observe_job(request, seconds=15, steps=11, step_seconds=1.0)
+    assert model.expected_step_seconds(request) == 1.0
+    assert model.expected_seconds(request) == 15.0
+    assert model.expected_seconds(make_request(width=1024, height=1024, num_inference_steps=21)) == 25.0
+
+
+def test_unseen_bucket_scaled_by_pixels():
+    model = CostModel("sdxl")
+    model.observe_job(make_request(width=1024, height=1024), 10, 2, 1.0)
+    assert model.expected_step_seconds(make_request(width=512, height=512)) == 0.25
+
+
+def test_wan_frames_are_part_of_the_key():
+    model = CostModel("wan")
+    model.observe_job(make_request(width=832, height=480, num_frames=81), 10, 2, 4.0)
+    assert model.key(make_request(width=832, height=480, num_frames=41)) != model.key(
+        make_request(width=832, height=480, num_frames=81)
+    )
+    assert model.expected_step_seconds(make_request(width=832, height=480, num_frames=41)) == 4.0 * 41 / 81
+
+
+def test_schedule_with_workers():
+    model = CostModel("sdxl")
+    request = make_request(width=1024, height=1024, num_inference_steps=10)
+    model.observe_job(request, 10, 10, 0.9)
+    queued = [Job(str(i), request) for i in range(3)]
+    estimates = model.schedule([], queued, workers=2, now=1000.0)
+    assert estimates["0"] == (1000.0, 1010.0)
+    assert estimates["1"] == (1000.0, 1010.0)
+    assert estimates["2"] == (1010.0, 1020.0)
+
+
+def test_remaining_uses_job_step_rate():
+    model = CostModel("sdxl")
+    request = make_request(width=1024, height=1024, num_inference_steps=10)
+    model.observe_job(request, 10, 10, 0.9)
+    job = Job("a", request)
+    job.started_at, job.steps_done, job.step_seconds, job.step_intervals = 0.0, 5, 8.0, 4
+    # 2 seconds per step for this job, 5 steps left, 1 second of overhead
+    assert model.remaining_seconds(job, now=8.0) == 11.0
+
+
+def test_remaining_before_first_step():
+    model = CostModel("sdxl")
+    request = make_request(width=1024, height=1024, num_inference_steps=10)
+    model.observe_job(request, 10, 10, 0.9)
+    job = Job("a", request)
+    job.started_at = 100.0
+    assert model.remaining_seconds(job, now=100.5) == 9.5
+
+
+def test_shortest_job_first_order():
+    queue = MemoryQueueBackend()
+    for job_id, expected in (("long", 60.0), ("short", 5.0), ("medium", 20.0)):
+        queue.put(job_id, {}, sjf_priority(expected, 0.0, aging=1.0))
+    assert queue.queued_ids() == ["short", "medium", "long"]
+
+
+def test_sjf_aging_prevents_starvation():
+    # A 60s job queued 100s ago goes before a 5s job just queued
+    assert sjf_priority(60.0, 0.0, aging=1.0) < sjf_priority(5.0, 100.0, aging=1.0)
+    assert sjf_priority(60.0, 0.0, aging=0.0) > sjf_priority(5.0, 100.0, aging=0.0)
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from classes import GenerationRequest  # noqa: E402
+from mock_model import MockModelPipeline  # noqa: E402
+from preemption import Checkpoint, Preempted, resume_scheduler, snapshot_scheduler  # noqa: E402
+
+
+class MultistepScheduler:
+    """Scheduler keeping the previous model output, like the multistep solvers of diffusers."""
+
+    def set_timesteps(self, num_inference_steps):
+        self.timesteps = torch.arange(num_inference_steps, 0, -1)
+        self.step_index = 0
+        self.previous = None
+
+    def step(self, model_output, timestep, sample):
+        # The last steps depend on the full list of timesteps, like lower_order_final
+        order = 1 if self.previous is None or len(self.timesteps) - self.step_index < 2 else 2
+        update = model_output if order == 1 else 1.5 * model_output - 0.5 * self.previous
+        self.previous = model_output
+        self.step_index += 1
+        return sample - 0.1 * update
+
+
+def denoise(scheduler, steps, latents=None, preempt_at=None):
+    """Minimal pipeline loop: timesteps are read right after set_timesteps."""
+    scheduler.set_timesteps(steps)
+    timesteps = scheduler.timesteps
+    if latents is None:
+        latents = torch.randn((1, 4, 8, 8), generator=torch.Generator().manual_seed(0))
+    for i, t in enumerate(timesteps):
+        latents = scheduler.step(torch.sin(latents * t), t, latents)
+        if preempt_at is not None and i == preempt_at:
+            raise Preempted(Checkpoint(i + 1, latents, snapshot_scheduler(scheduler)))
+    return latents
+
+
+def denoise_diffusers(scheduler, steps, latents, start=0, preempt_at=()):
+    """Pipeline loop over a diffusers scheduler, the checkpoints hold the absolute step like WanModelPipeline."""
+    scheduler.set_timesteps(steps)
+    for i, t in enumerate(scheduler.timesteps):
+        step = start + i
+        latents = scheduler.step(torch.sin(latents + t / 1000), t, latents).prev_sample
+        if step in preempt_at:
+            raise Preempted(Checkpoint(step + 1, latents, snapshot_scheduler(scheduler)))
+    return latents
+
+
+def test_scheduler_resume_is_identical():
+    scheduler = MultistepScheduler()
+    expected = denoise(scheduler, 10)
+
+    with pytest.raises(Preempted) as e:
+        denoise(scheduler, 10, preempt_at=3)
+    # Another job uses the scheduler in between
+    denoise(scheduler, 4)
+
+    checkpoint = e.value.checkpoint
+    with resume_scheduler(scheduler, checkpoint):
+        resumed = denoise(scheduler, 10, latents=checkpoint.restore_latents())
+    assert torch.equal(resumed, expected)
+    # The scheduler methods are restored
+    assert "set_timesteps" not in vars(scheduler)
+
+
+def test_mock_pipeline_resume_is_identical():
+    pipeline = MockModelPipeline(SimpleNamespace(mock_step_latency=0, mock_preview_size=64, use_refiner=False))
+    request = GenerationRequest(prompt="cat", width=64, height=64, num_inference_steps=8)
+    expected = pipeline.predict(request, None)
+
+    with pytest.raises(Preempted) as e:
+        pipeline.predict(request, None, preempt=lambda: True)
+    assert e.value.checkpoint.step == 1
+    steps = []
+    resumed = pipeline.predict(
+        request, lambda _pipe, step, _t, _kwargs: steps.append(step) or {}, checkpoint=e.value.checkpoint
+    )
+    assert steps == list(range(1, 8))
+    assert list(resumed.getdata()) == list(expected.getdata())
+
+
+@pytest.mark.parametrize("scheduler_class", ["UniPCMultistepScheduler", "FlowMatchEulerDiscreteScheduler"])
+def test_diffusers_scheduler_resumes_after_several_preemptions(scheduler_class):
+    diffusers = pytest.importorskip("diffusers")
+    scheduler = getattr(diffusers, scheduler_class)()
+    latents = torch.randn((1, 4, 8, 8), generator=torch.Generator().manual_seed(0))
+    expected = denoise_diffusers(scheduler, 10, latents)
+
+    preempt_at = (2, 5, 7)
+    checkpoint = None
+    for _ in preempt_at:
+        with pytest.raises(Preempted) as e:
+            if checkpoint is None:
+                denoise_diffusers(scheduler, 10, latents, preempt_at=preempt_at)
+            else:
+                with resume_scheduler(scheduler, checkpoint):
+                    denoise_diffusers(scheduler, 10, checkpoint.restore_latents(), checkpoint.step, preempt_at)
+        checkpoint = e.value.checkpoint
+        # The patched methods, and the previous checkpoint in their closures, are not kept
+        assert not any(callable(value) for value in checkpoint.scheduler_state.values())
+        # Another job uses the scheduler in between
+        denoise_diffusers(scheduler, 4, latents)
+
+    assert checkpoint.step == 8
+    with resume_scheduler(scheduler, checkpoint):
+        resumed = denoise_diffusers(scheduler, 10, checkpoint.restore_latents(), checkpoint.step)
+    assert torch.equal(resumed, expected)
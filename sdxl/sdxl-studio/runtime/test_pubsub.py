@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from pubsub import Broker, Hub, LocalBroker, SocketBroker, create_broker
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+        self.received = asyncio.Event()
+
+    async def __call__(self, channel, message):
+        self.messages.append((channel, message))
+        self.received.set()
+
+    async def wait(self, count):
+        while len(self.messages) < count:
+            self.received.clear()
+            await asyncio.wait_for(self.received.wait(), 5)
+
+
+def test_local_broker_prefix():
+    async def scenario():
+        broker = LocalBroker()
+        jobs, queue = Inbox(), Inbox()
+        broker.subscribe("job:", jobs)
+        broker.subscribe("queue", queue)
+        await broker.publish("job:a", {"status": "progress"})
+        await broker.publish("queue", {"event": "changed"})
+        assert jobs.messages == [("job:a", {"status": "progress"})]
+        assert queue.messages == [("queue", {"event": "changed"})]
+
+    asyncio.run(scenario())
+
+
+def test_failing_subscriber_does_not_stop_delivery():
+    async def failing(channel, message):
+        raise RuntimeError("boom")
+
+    async def scenario():
+        broker = LocalBroker()
+        inbox = Inbox()
+        broker.subscribe("job:", failing)
+        broker.subscribe("job:", inbox)
+        await broker.publish("job:a", {"n": 1})
+        assert inbox.messages == [("job:a", {"n": 1})]
+
+    asyncio.run(scenario())
+
+
+def test_socket_hub_fan_out():
+    async def scenario():
+        server = await Hub().serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        worker, api_a, api_b = SocketBroker("127.0.0.1", port), SocketBroker("127.0.0.1", port), SocketBroker("127.0.0.1", port)
+        inbox_a, inbox_b, control = Inbox(), Inbox(), Inbox()
+        api_a.subscribe("job:", inbox_a)
+        api_b.subscribe("job:", inbox_b)
+        worker.subscribe("control", control)
+        for broker in (worker, api_a, api_b):
+            await broker.start()
+        # Let the hub register the subscriptions
+        await asyncio.sleep(0.1)
+
+        image = "x" * 200_000
+        await worker.publish("job:a", {"status": "completed", "image": image})
+        await inbox_a.wait(1)
+        await inbox_b.wait(1)
+        assert inbox_a.messages == [("job:a", {"status": "completed", "image": image})]
+        assert inbox_b.messages == inbox_a.messages
+
+        # Delivered to the local subscribers too, and only to the subscribed channels
+        await api_a.publish("control", {"cancel": "a"})
+        await control.wait(1)
+        assert control.messages == [("control", {"cancel": "a"})]
+        assert len(inbox_a.messages) == len(inbox_b.messages) == 1
+
+        for broker in (worker, api_a, api_b):
+            await broker.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_create_broker():
+    assert isinstance(create_broker(None), LocalBroker)
+    broker = create_broker("tcp://hub:7070")
+    assert isinstance(broker, SocketBroker) and (broker.host, broker.port) == ("hub", 7070)
+    with pytest.raises(ValueError):
+        create_broker("redis://hub:6379")
+
+
+def test_broker_without_publish_fails_on_instantiation():
+    class Silent(Broker):
+        pass
+
+    with pytest.raises(TypeError):
+        Silent()
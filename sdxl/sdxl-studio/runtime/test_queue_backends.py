@@ -0,0 +1,199 @@
+import asyncio
+import multiprocessing
+import sys
+import time
+
+import pytest
+
+from queue_backends import MemoryQueueBackend, QueueBackend, SQLiteQueueBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryQueueBackend()
+    else:
+        backend = SQLiteQueueBackend(str(tmp_path / "queue.db"))
+        yield backend
+        backend.close()
+
+
+def test_priority_then_arrival_order(backend):
+    backend.put("a", {"n": 1}, priority=2.0)
+    backend.put("b", {"n": 2}, priority=1.0)
+    backend.put("c", {"n": 3}, priority=2.0)
+    assert backend.queued_ids() == ["b", "a", "c"]
+    assert [backend.lease("w", 60).job_id for _ in range(3)] == ["b", "a", "c"]
+    assert backend.lease("w", 60) is None
+
+
+def test_lease_ack(backend):
+    backend.put("a", {"prompt": "cat"}, priority=0)
+    lease = backend.lease("w", 60)
+    assert lease.payload == {"prompt": "cat"}
+    assert backend.get("a") == ("leased", {"prompt": "cat"})
+    assert backend.queued_ids() == []
+    assert backend.extend(lease, 60)
+    assert backend.ack(lease)
+    assert backend.get("a") is None
+    assert not backend.ack(lease)
+
+
+def test_expired_lease_is_requeued(backend):
+    backend.put("a", {}, priority=0)
+    lost = backend.lease("w1", 0.01)
+    time.sleep(0.02)
+    lease = backend.lease("w2", 60)
+    assert lease.job_id == "a" and lease.attempts == 2
+    # The first worker lost its lease and must stop
+    assert not backend.extend(lost, 60)
+    assert not backend.ack(lost)
+    assert backend.ack(lease)
+
+
+def test_job_dropped_after_max_attempts(backend):
+    backend.put("a", {}, priority=0)
+    for _ in range(backend.max_attempts):
+        assert backend.lease("w", 0.01) is not None
+        time.sleep(0.02)
+    assert backend.lease("w", 60) is None
+    assert backend.get("a") is None
+
+
+def test_release_requeues_after_equal_priorities(backend):
+    backend.put("a", {}, priority=0)
+    lease = backend.lease("w", 60)
+    backend.put("b", {}, priority=1)
+    assert backend.release(lease, priority=1)
+    assert backend.queued_ids() == ["b", "a"]
+
+
+def test_cancel(backend):
+    backend.put("a", {}, priority=0)
+    backend.put("b", {}, priority=0)
+    assert backend.cancel("a") == "queued"
+    assert backend.queued_ids() == ["b"]
+    lease = backend.lease("w", 60)
+    assert backend.cancel("b") == "leased"
+    # The holder notices at its next extend, and still acks the job
+    assert not backend.extend(lease, 60)
+    assert backend.ack(lease)
+    assert backend.cancel("unknown") is None
+
+
+def consume(path, owner, results):
+    backend = SQLiteQueueBackend(path)
+    while True:
+        lease = backend.lease(owner, 60)
+        if lease is None:
+            break
+        time.sleep(0.001)  # Processing
+        assert backend.ack(lease)
+        results.put(lease.job_id)
+    backend.close()
+
+
+def test_processes_share_the_queue_without_duplicates(tmp_path):
+    path = str(tmp_path / "queue.db")
+    backend = SQLiteQueueBackend(path)
+    job_ids = [f"job-{i}" for i in range(200)]
+    for i, job_id in enumerate(job_ids):
+        backend.put(job_id, {"i": i}, priority=i)
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=consume, args=(path, f"worker-{i}", results)) for i in range(4)]
+    for process in processes:
+        process.start()
+    processed = [results.get(timeout=60) for _ in job_ids]
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert sorted(processed) == sorted(job_ids)
+    assert backend.queued_ids() == []
+    backend.close()
+
+
+def test_sqlite_queue_survives_restart(tmp_path):
+    path = str(tmp_path / "queue.db")
+    backend = SQLiteQueueBackend(path)
+    backend.put("a", {"prompt": "cat"}, priority=0)
+    backend.put("b", {"prompt": "dog"}, priority=0)
+    backend.lease("crashed", 0.01)
+    backend.close()
+
+    time.sleep(0.02)
+    backend = SQLiteQueueBackend(path)
+    assert [backend.lease("w", 60).job_id for _ in range(2)] == ["b", "a"]
+    backend.close()
+
+
+def test_incomplete_backend_fails_on_instantiation():
+    class LeaseOnly(QueueBackend):
+        def lease(self, owner, lease_seconds):
+            return None
+
+    with pytest.raises(TypeError):
+        LeaseOnly()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    pytest.importorskip("torch")
+    # app.py parses its command line at import time
+    argv = sys.argv
+    sys.argv = ["app.py", "--model-type", "mock", "--device", "cpu"]
+    try:
+        import app
+    finally:
+        sys.argv = argv
+    backend = SQLiteQueueBackend(str(tmp_path / "queue.db"))
+    monkeypatch.setattr(app, "queue_backend", backend)
+    monkeypatch.setattr(app, "restored_jobs", {})
+    yield app
+    backend.close()
+
+
+def queued_payload():
+    return {"request": {"prompt": "cat"}, "bucket": "1024x1024", "enqueued_at": time.time(), "priority": 0.0}
+
+
+def test_app_reads_the_queue_off_the_event_loop(app, monkeypatch):
+    queued = app.queue_backend.queued
+
+    def slow_queued():
+        time.sleep(0.3)
+        return queued()
+
+    monkeypatch.setattr(app.queue_backend, "queued", slow_queued)
+
+    async def scenario():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        await app.update_queue_metrics()
+        ticker.cancel()
+        return ticks
+
+    # The loop kept running while the backend was read
+    assert asyncio.run(scenario()) >= 10
+
+
+def test_jobs_of_other_replicas_are_restored_once(app):
+    app.queue_backend.put("other", queued_payload(), 0.0)
+
+    first = asyncio.run(app.get_queued_jobs())
+    second = asyncio.run(app.get_queued_jobs())
+    assert [job.id for job in first] == ["other"]
+    assert second[0] is first[0]
+
+    app.queue_backend.cancel("other")
+    assert asyncio.run(app.get_queued_jobs()) == []
+    assert app.restored_jobs == {}
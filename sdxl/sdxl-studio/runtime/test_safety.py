@@ -0,0 +1,177 @@
+import asyncio
+import base64
+import io
+import sys
+import uuid
+import warnings
+from contextlib import suppress
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("diffusers")
+
+from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker  # noqa: E402
+from PIL import Image  # noqa: E402
+from transformers import CLIPConfig  # noqa: E402
+
+from classes import GenerationRequest, Job  # noqa: E402
+from mock_model import MockModelPipeline  # noqa: E402
+from safety import SafetyChecker  # noqa: E402
+
+# Cosine scores are within [-1, 1], these thresholds flag every image or none
+FLAG_ALL = -2.0
+FLAG_NONE = 2.0
+
+
+def tiny_checker(threshold: float, max_batch_size: int = 8) -> SafetyChecker:
+    torch.manual_seed(0)
+    config = CLIPConfig(
+        text_config={"hidden_size": 32, "intermediate_size": 37, "num_attention_heads": 4, "num_hidden_layers": 2},
+        vision_config={
+            "hidden_size": 32,
+            "intermediate_size": 37,
+            "num_attention_heads": 4,
+            "num_hidden_layers": 2,
+            "image_size": 32,
+            "patch_size": 8,
+        },
+        projection_dim=32,
+    )
+    checker = StableDiffusionSafetyChecker(config)
+    with torch.no_grad():
+        checker.concept_embeds_weights.fill_(threshold)
+        checker.special_care_embeds_weights.fill_(threshold)
+    return SafetyChecker(checker.eval(), torch.device("cpu"), torch.float32, max_batch_size)
+
+
+def images(count):
+    return [Image.new("RGB", (48, 40), (index * 40, 100, 200)) for index in range(count)]
+
+
+@pytest.fixture(scope="module")
+def app():
+    # app.py parses its command line at import time
+    argv = sys.argv
+    sys.argv = ["app.py", "--model-type", "mock", "--device", "cpu"]
+    try:
+        import app
+    finally:
+        sys.argv = argv
+    app.messages = []
+
+    async def record(channel, message):
+        app.messages.append(message)
+
+    app.broker.subscribe(app.JOB_CHANNEL, app.on_job_message)
+    app.broker.subscribe(app.JOB_CHANNEL, record)
+    return app
+
+
+def run_job(app, pipeline, request) -> Job:
+    """Process one job with a worker of the app, until it ends."""
+
+    async def scenario():
+        app.queue_event = asyncio.Event()
+        job = Job(str(uuid.uuid4()), request)
+        app.jobs[job.id] = job
+        await app.enqueue(job)
+        worker = asyncio.create_task(app.worker(0, pipeline))
+        try:
+            while job.state not in app.TERMINAL_STATES:
+                await asyncio.sleep(0.01)
+        finally:
+            worker.cancel()
+            with suppress(asyncio.CancelledError):
+                await worker
+        return job
+
+    app.messages.clear()
+    return asyncio.run(scenario())
+
+
+def mock_pipeline(use_refiner=False):
+    pipeline = MockModelPipeline(SimpleNamespace(mock_step_latency=0, mock_preview_size=64, use_refiner=use_refiner))
+    pipeline.load()
+    return pipeline
+
+
+def test_scores_flag_images_above_the_thresholds():
+    with warnings.catch_warnings():
+        # Such as the warning of tensors sharing read-only memory
+        warnings.simplefilter("error")
+        assert all(score > 0 for score in tiny_checker(FLAG_ALL).scores(images(3)))
+        assert all(score < 0 for score in tiny_checker(FLAG_NONE).scores(images(3)))
+
+
+def test_concurrent_scores_are_batched():
+    checker = tiny_checker(FLAG_NONE, max_batch_size=2)
+    expected = checker.scores(images(5))
+    batches = []
+    scores = checker.scores
+    checker.scores = lambda batch: batches.append(len(batch)) or scores(batch)
+
+    async def scenario():
+        return await asyncio.gather(*(checker.score(image) for image in images(5)))
+
+    assert asyncio.run(scenario()) == pytest.approx(expected, abs=1e-5)
+    assert batches == [2, 2, 1]
+
+
+def test_worker_replaces_a_flagged_image(app, monkeypatch):
+    monkeypatch.setattr(app.args, "safety_check", True)
+    monkeypatch.setattr(app, "safety_checker", tiny_checker(FLAG_ALL))
+    monkeypatch.setenv("ENABLE_WATERMARK", "false")
+
+    job = run_job(app, mock_pipeline(), GenerationRequest(prompt="cat", width=64, height=64, num_inference_steps=3))
+
+    assert job.state == "completed"
+    assert app.messages[-1]["nsfw_content_detected"] is True
+    image = Image.open(io.BytesIO(base64.b64decode(job.result)))
+    assert image.size == (64, 64)
+    assert image.getextrema() == ((0, 0), (0, 0), (0, 0))
+
+
+def test_worker_keeps_an_image_not_flagged(app, monkeypatch):
+    monkeypatch.setattr(app.args, "safety_check", True)
+    monkeypatch.setattr(app, "safety_checker", tiny_checker(FLAG_NONE))
+    monkeypatch.setenv("ENABLE_WATERMARK", "false")
+
+    job = run_job(app, mock_pipeline(), GenerationRequest(prompt="cat", width=64, height=64, num_inference_steps=3))
+
+    assert job.state == "completed"
+    assert app.messages[-1]["nsfw_content_detected"] is False
+    image = Image.open(io.BytesIO(base64.b64decode(job.result)))
+    assert image.getextrema() != ((0, 0), (0, 0), (0, 0))
+
+
+@pytest.mark.parametrize(
+    "use_refiner,flagged_step",
+    # 10 steps, the base pipeline runs 8 of them with the refiner
+    [(False, 9), (True, 7)],
+)
+def test_worker_stops_a_job_with_a_flagged_preview(app, monkeypatch, use_refiner, flagged_step):
+    checker = tiny_checker(FLAG_ALL)
+    screened = []
+    score = checker.score
+
+    async def batched_score(image):
+        screened.append(image)
+        return await score(image)
+
+    monkeypatch.setattr(checker, "score", batched_score)
+    monkeypatch.setattr(app, "safety_checker", checker)
+    monkeypatch.setattr(app, "screening_fractions", [0.9])
+
+    pipeline = mock_pipeline(use_refiner)
+    job = run_job(app, pipeline, GenerationRequest(prompt="cat", width=64, height=64, num_inference_steps=10))
+
+    assert job.state == "failed"
+    assert job.flagged_step == flagged_step
+    assert len(screened) == 1
+    assert app.messages[-1]["nsfw_content_detected"] is True
+    progress = [message for message in app.messages if message.get("status") == "progress"]
+    # The flagged preview is not sent and the refiner never runs
+    assert [message["step"] for message in progress] == list(range(flagged_step))
+    assert all(message["pipeline"] == "base" for message in progress)
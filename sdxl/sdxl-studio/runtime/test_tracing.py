@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from tracing import ProfilerCapture  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def app():
+    # app.py parses its command line at import time
+    argv = sys.argv
+    sys.argv = ["app.py", "--model-type", "mock", "--device", "cpu"]
+    try:
+        import app
+    finally:
+        sys.argv = argv
+    return app
+
+
+def test_profile_is_written_when_the_job_fails(tmp_path):
+    profiler = ProfilerCapture(str(tmp_path))
+
+    with pytest.raises(RuntimeError):
+        with profiler.profile("failed-job"):
+            raise RuntimeError("pipeline error")
+
+    assert os.path.exists(tmp_path / "failed-job.profile.json")
+
+
+def test_admin_endpoints_are_disabled_without_a_token(app, monkeypatch):
+    monkeypatch.setattr(app.args, "admin_token", None)
+    monkeypatch.setattr(app.profiler, "remaining", 0)
+
+    response = TestClient(app.app).post("/admin/profile", json={"jobs": 1})
+
+    assert response.status_code == 403
+    assert app.profiler.remaining == 0
+
+
+def test_admin_endpoints_check_the_token_and_the_job_count(app, monkeypatch):
+    monkeypatch.setattr(app.args, "admin_token", "secret")
+    monkeypatch.setattr(app.profiler, "remaining", 0)
+    client = TestClient(app.app)
+
+    assert client.post("/admin/profile", json={"jobs": 1}).status_code == 403
+    assert client.post("/admin/profile", json={"jobs": 1}, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    too_many = client.post(
+        "/admin/profile", json={"jobs": app.MAX_PROFILED_JOBS + 1}, headers={"X-Admin-Token": "secret"}
+    )
+    assert too_many.status_code == 422
+    assert app.profiler.remaining == 0
+
+    response = client.post("/admin/profile", json={"jobs": 2}, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert app.profiler.remaining == 2
@@ -0,0 +1,160 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+_log = logging.getLogger(__name__)
+
+# Trace of the job being processed. asyncio.to_thread copies the context, so
+# predict and the step callbacks running in the worker thread see it too.
+current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Stage spans of one job."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Dict] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, start: float, end: float, **attributes):
+        """Record a span, start and end are time.time() values."""
+        with self._lock:
+            self.spans.append({"name": name, "start": start, "end": end, "attributes": attributes})
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.time(), **attributes)
+
+    def summary(self) -> Dict[str, float]:
+        """Total seconds spent per stage."""
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]] = totals.get(span["name"], 0.0) + span["end"] - span["start"]
+        return {name: round(seconds, 4) for name, seconds in totals.items()}
+
+    def to_chrome_trace(self) -> Dict:
+        """Export the spans in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        tracks = {"job": 0}
+        events = []
+        with self._lock:
+            for span in self.spans:
+                track = tracks.setdefault(span["attributes"].get("pipeline", "job"), len(tracks))
+                events.append(
+                    {
+                        "name": span["name"],
+                        "ph": "X",
+                        "ts": span["start"] * 1e6,
+                        "dur": (span["end"] - span["start"]) * 1e6,
+                        "pid": 0,
+                        "tid": track,
+                        "args": span["attributes"],
+                    }
+                )
+        events.append({"name": "process_name", "ph": "M", "pid": 0, "args": {"name": f"job {self.job_id}"}})
+        for name, track in tracks.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": track, "args": {"name": name}})
+        return {"traceEvents": events, "otherData": {"trace_id": self.trace_id, "job_id": self.job_id}}
+
+    def export(self, directory: Optional[str]):
+        """Write the trace to the given directory if trace export is enabled."""
+        if not directory:
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"{self.job_id}.trace.json"), "w") as f:
+                json.dump(self.to_chrome_trace(), f)
+        except OSError as e:
+            _log.error(f"Could not export trace of job {self.job_id}: {e}")
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Record a span on the current trace, if any."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.span(name, **attributes):
+        yield
+
+
+def traced(name: str, func):
+    """Wrap a function so that each call is recorded as a span on the current trace."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_pipeline(pipeline):
+    """Trace text encoding and VAE decoding of a diffusers pipeline."""
+    if pipeline is None:
+        return
+    if hasattr(pipeline, "encode_prompt"):
+        pipeline.encode_prompt = traced("text_encoding", pipeline.encode_prompt)
+    vae = getattr(pipeline, "vae", None)
+    if vae is not None and hasattr(vae, "decode"):
+        vae.decode = traced("vae_decode", vae.decode)
+
+
+class ProfilerCapture:
+    """
+    Arms a torch.profiler capture for the next N jobs, each written as a Chrome trace,
+    so production pods can be profiled without a restart.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.remaining = 0
+        self._lock = threading.Lock()
+
+    def arm(self, jobs: int):
+        with self._lock:
+            self.remaining = jobs
+        _log.info(f"Profiler armed for the next {jobs} job(s), traces in {self.directory}")
+
+    def take(self) -> bool:
+        """Return True if the next job must be profiled."""
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    @contextlib.contextmanager
+    def profile(self, job_id: str):
+        import torch
+
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        profiler = torch.profiler.profile(activities=activities, record_shapes=True, with_stack=False)
+        try:
+            with profiler:
+                yield
+        finally:
+            # Failed, cancelled and preempted jobs are the ones worth a trace
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"{job_id}.profile.json")
+                profiler.export_chrome_trace(path)
+                _log.info(f"Profiler trace of job {job_id} written to {path}")
+            except Exception as e:
+                _log.error(f"Could not write the profiler trace of job {job_id}: {e}")
@@ -1,5 +1,6 @@
 import gc
 import logging
+from contextlib import nullcontext
 import io
 import base64
 from typing import Dict
@@ -9,11 +10,16 @@ import torch
 from diffusers import AutoencoderKLWan, WanPipeline
 from diffusers.utils import export_to_video
 
+import tracing
 from classes import GenerationRequest
+from preemption import Checkpoint, Preempted, resume_scheduler, snapshot_scheduler
 
 _log = logging.getLogger(__name__)
 
 class WanModelPipeline:
+    # Long video jobs can be checkpointed at a step boundary and resumed later
+    supports_preemption = True
+
     def __init__(self, args):
         self.model_id: str = args.model_id or "Wan-AI/Wan2.1-T2V-1.3B-Diffusers"
         self.device = args.device or "cuda"
@@ -64,6 +70,7 @@ class WanModelPipeline:
                 # pipeline = pipeline.to("cuda")
 
             pipeline.enable_model_cpu_offload()
+            tracing.instrument_pipeline(pipeline)
             self.pipeline = pipeline
             self.ready = True
             _log.info("WAN model loaded successfully")
@@ -74,7 +81,18 @@ class WanModelPipeline:
             _log.error(traceback.format_exc())
             raise
 
-    def predict(self, payload: GenerationRequest, callback_func_base: callable, callback_func_refiner: callable = None) -> None:
+    def predict(
+        self,
+        payload: GenerationRequest,
+        callback_func_base: callable,
+        callback_func_refiner: callable = None,
+        checkpoint: Checkpoint = None,
+        preempt: callable = None,
+    ) -> None:
+        """
+        Generate a video. If `preempt` returns True after a step, raise Preempted with a
+        checkpoint of the denoising loop; passing it back as `checkpoint` resumes the job.
+        """
         # Extract parameters from the request
         prompt = payload.prompt
         negative_prompt = getattr(payload, 'negative_prompt', None)
@@ -93,31 +111,50 @@ class WanModelPipeline:
         # Log the parameters
         _log.info(f"Generating video with WAN: prompt='{prompt}', height={height}, width={width}, frames={num_frames}, fps={self.fps}")
         
+        # Steps already done before the job was preempted
+        start_step = checkpoint.step if checkpoint is not None else 0
+
         # Create a custom callback to wrap the provided one
         def video_callback_wrapper(_pipe, step, _timestep, callback_kwargs):
+            step += start_step
             # Extract latents or intermediate results if available
             if "latents" in callback_kwargs:
                 latents = callback_kwargs["latents"]
                 _log.info(f"WAN latents shape at step {step}: {latents.shape}, dtype: {latents.dtype}")
             
             # Call the original callback
-            return callback_func_base(_pipe, step, _timestep, callback_kwargs)
+            callback_outputs = callback_func_base(_pipe, step, _timestep, callback_kwargs) if callback_func_base else {}
+
+            # Stop at this step boundary if a shorter job must run first
+            if preempt is not None and step < num_inference_steps - 1 and not _pipe.interrupt and preempt():
+                latents = callback_outputs.get("latents", callback_kwargs["latents"])
+                raise Preempted(Checkpoint(step + 1, latents, snapshot_scheduler(_pipe.scheduler)))
+            return callback_outputs
         
         # Generate the video
         try:
-            _log.info("Starting WAN pipeline inference")
-            result = self.pipeline(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                height=height,
-                width=width,
-                num_frames=num_frames,
-                guidance_scale=guidance_scale,
-                num_inference_steps=num_inference_steps,
-                generator=generator,
-                callback_on_step_end=video_callback_wrapper if callback_func_base else None
-            )
+            _log.info(f"Starting WAN pipeline inference from step {start_step}")
+            resume = resume_scheduler(self.pipeline.scheduler, checkpoint) if checkpoint is not None else nullcontext()
+            with tracing.span("base_pipeline", pipeline="base"), resume:
+                result = self.pipeline(
+                    prompt=prompt,
+                    negative_prompt=negative_prompt,
+                    height=height,
+                    width=width,
+                    num_frames=num_frames,
+                    guidance_scale=guidance_scale,
+                    num_inference_steps=num_inference_steps,
+                    generator=generator,
+                    # Initial latents are drawn from the generator, a resumed job starts from its checkpoint
+                    latents=checkpoint.restore_latents() if checkpoint is not None else None,
+                    callback_on_step_end=video_callback_wrapper if callback_func_base or preempt else None
+                )
             
+            if self.pipeline.interrupt:
+                # Cancelled, skip the video export
+                _log.info("WAN pipeline inference interrupted")
+                return None
+
             _log.info("WAN pipeline inference completed successfully")
             
             # Export video to bytes for preview - do this in a separate try block
@@ -127,7 +164,8 @@ class WanModelPipeline:
             # Save video to a temporary file immediately
             temp_video_path = "/tmp/temp_output.mp4"
             try:
-                export_to_video(video_frames, temp_video_path, fps=self.fps)
+                with tracing.span("video_export"):
+                    export_to_video(video_frames, temp_video_path, fps=self.fps)
                 _log.info(f"Video saved to {temp_video_path} with {len(video_frames)} frames at {self.fps} fps")
             except Exception as video_save_error:
                 _log.error(f"Error saving video: {video_save_error}")
@@ -176,6 +214,9 @@ class WanModelPipeline:
                 
                 return placeholder
             
+        except Preempted as e:
+            _log.info(f"WAN pipeline inference preempted: {e}")
+            raise
         except Exception as e:
             _log.error(f"Error during WAN inference: {e}")
             import traceback
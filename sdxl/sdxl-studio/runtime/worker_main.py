@@ -0,0 +1,50 @@
+"""
+Worker tier entry point: processes the jobs of the shared queue backend and publishes
+their progress, previews and results over pub/sub, without serving the HTTP API.
+
+    python pubsub.py --port 7070
+    python app.py --role api --queue-backend sqlite --pubsub-url tcp://localhost:7070
+    python worker_main.py --queue-backend sqlite --pubsub-url tcp://localhost:7070 --port 9090
+
+Takes the same options as app.py. Prometheus metrics are served on --port.
+"""
+import asyncio
+import logging
+import signal
+
+from prometheus_client import start_http_server
+
+import app
+import metrics
+
+_log = logging.getLogger(__name__)
+
+
+async def main():
+    if not (app.broker.remote and app.queue_backend.durable):
+        raise SystemExit("The worker tier requires --pubsub-url and a shared queue backend (--queue-backend sqlite)")
+    app.worker_only = True
+    # Cancellations requested through any API replica
+    app.broker.subscribe(app.CONTROL_CHANNEL, app.on_control_message)
+    await app.broker.start()
+    start_http_server(app.args.port)
+
+    queue_task = asyncio.create_task(app.process_queue())
+    lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    stop_task = asyncio.create_task(stop.wait())
+    await asyncio.wait({queue_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+    _log.info("Stopping the workers")
+    stop_task.cancel()
+    lag_task.cancel()
+    await app.stop_workers(queue_task)
+    await app.broker.close()
+    app.queue_backend.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,168 @@
+"""
+CPU benchmark of the batched safety checking and of its backends.
+
+Sends requests of N PNG images, base64 or raw, to SafetyChecker.predict, for each backend
+and batch size, and reports the images checked per second as JSON. A batch size of 1 is
+one image per request, as before batching. The ONNX Runtime backends are also compared
+with the torch backend: cosine of their embeddings and agreement of their flags. By
+default the checker is a tiny random-weight CLIP, which needs no download and measures
+the serving overhead; --pretrained uses the real models:
+
+    python benchmarks/bench_safety_checker.py --images 64 --batch-sizes 1 4 8 16 --backends torch onnx-int8
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+RUNTIME_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUNTIME_DIR)
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+from diffusers.pipelines.stable_diffusion import StableDiffusionSafetyChecker  # noqa: E402
+from kserve import InferInput, InferRequest  # noqa: E402
+from PIL import Image as PIL_Image  # noqa: E402
+from transformers import CLIPConfig, CLIPImageProcessor  # noqa: E402
+
+from safety_checker.concept_store import ConceptStore  # noqa: E402
+from safety_checker.safety_checker import SafetyChecker, image_bytes  # noqa: E402
+
+
+class TinySafetyChecker(SafetyChecker):
+    """SafetyChecker with a tiny random-weight CLIP vision model."""
+
+    def load(self):
+        torch.manual_seed(0)
+        config = CLIPConfig(
+            text_config={"hidden_size": 32, "intermediate_size": 37, "num_attention_heads": 4, "num_hidden_layers": 2},
+            vision_config={
+                "hidden_size": 32,
+                "intermediate_size": 37,
+                "num_attention_heads": 4,
+                "num_hidden_layers": 2,
+                "image_size": 224,
+                "patch_size": 32,
+            },
+            projection_dim=32,
+        )
+        self.feature_extractor = CLIPImageProcessor()
+        self.safety_checker = StableDiffusionSafetyChecker(config).to(self.device, self.dtype).eval()
+        self.concept_store = ConceptStore(config.projection_dim, self.concept_store_dir)
+        self.load_backend()
+        self.ready = True
+
+
+def encoded_images(count, size, raw=False):
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        buffer = BytesIO()
+        PIL_Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(buffer, format="PNG")
+        images.append(buffer.getvalue() if raw else base64.b64encode(buffer.getvalue()).decode())
+    return images
+
+
+def make_request(images):
+    infer_input = InferInput(name="image", shape=[len(images)], datatype="BYTES", data=images)
+    return InferRequest(model_name="safety-checker", infer_inputs=[infer_input])
+
+
+def accuracy(model, reference, images):
+    """Agreement of the embeddings and flags of a backend with the torch backend."""
+    pixel_values = torch.from_numpy(np.stack([model.preprocess_image(image_bytes(image))[0] for image in images]))
+    embeds, reference_embeds = model.embed(pixel_values), reference.embed(pixel_values)
+    cosine = (embeds * reference_embeds).sum(dim=-1)
+    flags = model.concept_flags(embeds) == reference.concept_flags(reference_embeds)
+    return {
+        "cosine_min": cosine.min().item(),
+        "cosine_mean": cosine.mean().item(),
+        "flag_agreement": flags.float().mean().item(),
+    }
+
+
+def run_case(model, images, batch_size):
+    # Warm up
+    model.predict(make_request(images[:batch_size]))
+    start = time.perf_counter()
+    for index in range(0, len(images), batch_size):
+        model.predict(make_request(images[index : index + batch_size]))
+    elapsed = time.perf_counter() - start
+    return {"images_per_second": len(images) / elapsed, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--image-size", type=int, default=512)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--preprocess-workers", type=int, default=4)
+    parser.add_argument(
+        "--embedding-cache-size", type=int, default=0, help="Off by default, the warm up would fill the cache"
+    )
+    parser.add_argument(
+        "--backends", nargs="+", choices=["torch", "onnx", "onnx-int8"], default=["torch", "onnx", "onnx-int8"]
+    )
+    parser.add_argument("--onnx-threads", type=int, default=0)
+    parser.add_argument("--raw", action="store_true", help="Send raw PNG bytes, as gRPC clients do, instead of base64")
+    parser.add_argument("--pretrained", action="store_true", help="Use the real safety checker, downloads it")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    bench_args = parser.parse_args()
+
+    if bench_args.pretrained:
+        # The banned image is read from the working directory
+        os.chdir(RUNTIME_DIR)
+    model_class = SafetyChecker if bench_args.pretrained else TinySafetyChecker
+    images = encoded_images(bench_args.images, bench_args.image_size, bench_args.raw)
+
+    onnx_dir = tempfile.mkdtemp(prefix="bench-safety-checker-")
+
+    def make_model(backend, batch_size):
+        return model_class(
+            f"bench-{backend}-{batch_size}",
+            max_batch_size=batch_size,
+            preprocess_workers=bench_args.preprocess_workers,
+            embedding_cache_size=bench_args.embedding_cache_size,
+            backend=backend,
+            onnx_dir=onnx_dir,
+            onnx_threads=bench_args.onnx_threads,
+        )
+
+    results, accuracies = {}, {}
+    reference = make_model("torch", max(bench_args.batch_sizes))
+    for backend in bench_args.backends:
+        for batch_size in bench_args.batch_sizes:
+            model = make_model(backend, batch_size)
+            case = run_case(model, images, batch_size)
+            results[f"{backend}_batch_{batch_size}"] = case
+            print(f"{backend}, batch {batch_size}: {case['images_per_second']:.2f} images/s", file=sys.stderr)
+        if backend != "torch":
+            accuracies[backend] = accuracy(model, reference, images)
+            print(f"{backend} against torch: {accuracies[backend]}", file=sys.stderr)
+
+    report = {
+        "torch": torch.__version__,
+        "threads": torch.get_num_threads(),
+        "pretrained": bench_args.pretrained,
+        "raw": bench_args.raw,
+        "embedding_cache_size": bench_args.embedding_cache_size,
+        "images": bench_args.images,
+        "image_size": bench_args.image_size,
+        "preprocess_workers": bench_args.preprocess_workers,
+        "onnx_threads": bench_args.onnx_threads,
+        "results": results,
+        "accuracy": accuracies,
+    }
+    output = json.dumps(report, indent=2)
+    if bench_args.output:
+        with open(bench_args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,76 @@
 import argparse
+import os
 import kserve
 from kserve import logging
 
+from .admin import start_admin_server
 from .safety_checker import SafetyChecker
 
 parser = argparse.ArgumentParser(parents=[kserve.model_server.parser])
+parser.add_argument(
+    "--max_batch_size", type=int, default=32, help="Maximum number of images checked in one forward pass"
+)
+parser.add_argument(
+    "--preprocess_workers", type=int, default=4, help="Threads decoding and resizing the images"
+)
+parser.add_argument(
+    "--embedding_cache_size", type=int, default=4096, help="Image embeddings kept for repeated checks, 0 disables the cache"
+)
+parser.add_argument(
+    "--phash_distance",
+    type=int,
+    default=None,
+    help="Reuse the embedding of a cached image whose perceptual hash differs by at most this many bits, off by default",
+)
+parser.add_argument(
+    "--concept_store_dir",
+    type=str,
+    default="concepts",
+    help="Directory persisting the custom concepts, mount a volume to keep them across restarts",
+)
+parser.add_argument(
+    "--admin_port", type=int, default=None, help="Port of the concept admin API, off by default"
+)
+parser.add_argument(
+    "--admin_host",
+    type=str,
+    default="127.0.0.1",
+    help="Address the concept admin API listens on, localhost by default, others require --admin_token",
+)
+parser.add_argument(
+    "--admin_token",
+    type=str,
+    default=os.getenv("ADMIN_TOKEN", None),
+    help="Token required in the X-Admin-Token header of the concept admin API (default: no token)",
+)
+parser.add_argument(
+    "--backend",
+    choices=["torch", "onnx", "onnx-int8"],
+    default="torch",
+    help="Run the vision tower in PyTorch, or on CPU under ONNX Runtime, with int8 weights for onnx-int8",
+)
+parser.add_argument(
+    "--onnx_dir", type=str, default="onnx", help="Directory of the ONNX export, reused when it exists"
+)
+parser.add_argument(
+    "--onnx_threads", type=int, default=0, help="ONNX Runtime intra-op threads, 0 uses every core"
+)
 
 args, _ = parser.parse_known_args()
 
 if __name__ == "__main__":
     safety_checker = SafetyChecker(
         name=args.model_name,
+        max_batch_size=args.max_batch_size,
+        preprocess_workers=args.preprocess_workers,
+        embedding_cache_size=args.embedding_cache_size,
+        phash_distance=args.phash_distance,
+        concept_store_dir=args.concept_store_dir,
+        backend=args.backend,
+        onnx_dir=args.onnx_dir,
+        onnx_threads=args.onnx_threads,
     )
+    if args.admin_port:
+        start_admin_server(safety_checker, args.admin_port, args.admin_host, args.admin_token)
     server = kserve.ModelServer()
-    server.start(models=[safety_checker])
\ No newline at end of file
+    server.start(models=[safety_checker])
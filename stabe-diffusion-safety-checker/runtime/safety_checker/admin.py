@@ -0,0 +1,101 @@
+import base64
+import hmac
+import ipaddress
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Optional
+from urllib.parse import unquote
+
+from PIL import Image as PIL_Image
+
+_log = logging.getLogger(__name__)
+
+CONCEPTS_PATH = "/concepts"
+
+
+def start_admin_server(model, port: int, host: str = "127.0.0.1", token: Optional[str] = None) -> ThreadingHTTPServer:
+    """
+    Serve the concept admin API of a SafetyChecker on its own port, in a thread:
+
+    - GET /concepts lists the custom concepts
+    - POST /concepts adds or replaces a concept, from a JSON body with a `name`, a
+      `threshold` and either a base64 `image` or its `embedding`
+    - DELETE /concepts/<name> removes a concept
+
+    Changes apply to the next checks, without reloading the model. With a `token`,
+    every request needs it in the X-Admin-Token header. It is required to listen on
+    another address than localhost, as anyone reaching the port could remove the
+    banned concepts.
+    """
+    if not token and not is_loopback(host):
+        raise ValueError(f"the concept admin API needs a token to listen on {host}")
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self.authorized():
+                return
+            if self.path.rstrip("/") != CONCEPTS_PATH:
+                return self.reply(404, {"error": "not found"})
+            self.reply(200, {"concepts": model.concept_store.concepts()})
+
+        def do_POST(self):
+            if not self.authorized():
+                return
+            if self.path.rstrip("/") != CONCEPTS_PATH:
+                return self.reply(404, {"error": "not found"})
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                name, threshold = str(body["name"]), float(body["threshold"])
+                if "embedding" in body:
+                    model.concept_store.add(name, body["embedding"], threshold)
+                else:
+                    image = PIL_Image.open(BytesIO(base64.b64decode(body["image"]))).convert("RGB")
+                    model.add_nsfw_embedding(image, threshold, name)
+            except (KeyError, ValueError, OSError) as e:
+                return self.reply(400, {"error": f"invalid concept: {e}"})
+            self.reply(200, {"concepts": model.concept_store.concepts()})
+
+        def do_DELETE(self):
+            if not self.authorized():
+                return
+            prefix = CONCEPTS_PATH + "/"
+            if not self.path.startswith(prefix):
+                return self.reply(404, {"error": "not found"})
+            if not model.concept_store.remove(unquote(self.path[len(prefix) :])):
+                return self.reply(404, {"error": "unknown concept"})
+            self.reply(200, {"concepts": model.concept_store.concepts()})
+
+        def authorized(self) -> bool:
+            """Check the admin token, replies with a 403 if it is wrong."""
+            if token and not hmac.compare_digest(self.headers.get("X-Admin-Token", ""), token):
+                self.reply(403, {"error": "invalid admin token"})
+                return False
+            return True
+
+        def reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            _log.info(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="concept-admin", daemon=True).start()
+    _log.info(f"Concept admin API listening on {host}:{port}")
+    return server
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
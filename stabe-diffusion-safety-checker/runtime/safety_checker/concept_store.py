@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+_log = logging.getLogger(__name__)
+
+INDEX_FILE = "concepts.json"
+
+
+class ConceptStore:
+    """
+    Custom banned concepts: a name, a threshold and a normalized image embedding each.
+    With a `directory`, they are persisted there as an embedding matrix in a .npy file,
+    memory-mapped at startup, and a JSON index of the names and thresholds. Every change
+    writes a new matrix then replaces the index, so a crash never leaves them out of
+    sync. `version` changes with the concepts, for the users caching them. Embeddings
+    must have `dim` elements, the projection size of the checker model.
+    """
+
+    def __init__(self, dim: int, directory: Optional[str] = None):
+        self.dim = dim
+        self.directory = directory
+        self._names: List[str] = []
+        self._thresholds = np.zeros(0, dtype=np.float32)
+        self._embeddings: Optional[np.ndarray] = None  # [concepts, dim]
+        self._lock = threading.Lock()
+        self.version = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def concepts(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {"name": name, "threshold": float(threshold)} for name, threshold in zip(self._names, self._thresholds)
+            ]
+
+    def snapshot(self) -> Tuple[int, Optional[np.ndarray], np.ndarray]:
+        """Version, embeddings and thresholds of the concepts, consistent with each other."""
+        with self._lock:
+            return self.version, self._embeddings, self._thresholds
+
+    def add(self, name: str, embedding: np.ndarray, threshold: float):
+        """Add a concept, or replace the concept with the same name."""
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if embedding.shape[0] != self.dim:
+            raise ValueError(f"expected an embedding of size {self.dim}, got {embedding.shape[0]}")
+        norm = np.linalg.norm(embedding)
+        if norm == 0:
+            raise ValueError("the embedding of a concept cannot be zero")
+        with self._lock:
+            names = [existing for existing in self._names if existing != name]
+            keep = [index for index, existing in enumerate(self._names) if existing != name]
+            rows = [self._embeddings[keep]] if self._embeddings is not None else []
+            embeddings = np.concatenate(rows + [(embedding / norm)[None]])
+            thresholds = np.append(self._thresholds[keep], np.float32(threshold))
+            self._replace(names + [name], thresholds, embeddings)
+        _log.info(f"Added the concept {name} with the threshold {threshold}")
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            if name not in self._names:
+                return False
+            keep = [index for index, existing in enumerate(self._names) if existing != name]
+            embeddings = self._embeddings[keep] if keep else None
+            self._replace([self._names[index] for index in keep], self._thresholds[keep], embeddings)
+        _log.info(f"Removed the concept {name}")
+        return True
+
+    def _replace(self, names: List[str], thresholds: np.ndarray, embeddings: Optional[np.ndarray]):
+        self.version += 1
+        if self.directory:
+            embeddings = self._save(names, thresholds, embeddings)
+        self._names, self._thresholds, self._embeddings = names, thresholds, embeddings
+
+    def _save(self, names: List[str], thresholds: np.ndarray, embeddings: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Persist the concepts, returns the embeddings memory-mapped from their new file."""
+        previous = self._index().get("embeddings")
+        embeddings_file = f"embeddings-{self.version}.npy" if embeddings is not None else None
+        if embeddings_file:
+            np.save(os.path.join(self.directory, embeddings_file), embeddings)
+        index = {
+            "embeddings": embeddings_file,
+            "concepts": [{"name": name, "threshold": float(threshold)} for name, threshold in zip(names, thresholds)],
+        }
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+        if previous and previous != embeddings_file:
+            os.remove(os.path.join(self.directory, previous))
+        if embeddings_file:
+            return np.load(os.path.join(self.directory, embeddings_file), mmap_mode="r")
+        return None
+
+    def _index(self) -> Dict:
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _load(self):
+        index = self._index()
+        concepts = index.get("concepts", [])
+        if not concepts:
+            return
+        embeddings = np.load(os.path.join(self.directory, index["embeddings"]), mmap_mode="r")
+        if embeddings.ndim != 2 or embeddings.shape != (len(concepts), self.dim):
+            # Written for another checker model, every check would fail against it
+            raise ValueError(
+                f"the concepts in {self.directory} have embeddings of shape {embeddings.shape}, "
+                f"expected ({len(concepts)}, {self.dim})"
+            )
+        self._names = [concept["name"] for concept in concepts]
+        self._thresholds = np.array([concept["threshold"] for concept in concepts], dtype=np.float32)
+        self._embeddings = embeddings
+        self.version = int(index["embeddings"].split("-")[1].split(".")[0])
+        _log.info(f"Loaded {len(concepts)} concepts from {self.directory}")
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from PIL import Image as PIL_Image
+
+
+def content_hash(image_bytes: bytes) -> bytes:
+    """Key of an encoded image, the same bytes give the same key."""
+    return hashlib.blake2b(image_bytes, digest_size=16).digest()
+
+
+def perceptual_hash(image: PIL_Image.Image) -> int:
+    """
+    64-bit difference hash of an image: whether each pixel of a 9x8 grayscale thumbnail
+    is brighter than its right neighbour. Re-encoded or slightly changed images differ
+    in a few bits.
+    """
+    pixels = image.convert("L").resize((9, 8), PIL_Image.Resampling.BILINEAR).tobytes()
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return value
+
+
+class EmbeddingCache:
+    """
+    LRU cache of image embeddings, keyed by the content hash of the encoded image. With
+    a `phash_distance`, an image also matches a cached image whose perceptual hash
+    differs by at most this number of bits. Only embeddings are cached: the concept
+    scores are computed again at each check, so changing the concepts needs no flush.
+    """
+
+    def __init__(self, max_entries: int = 4096, phash_distance: Optional[int] = None):
+        self.max_entries = max_entries
+        self.phash_distance = phash_distance
+        self._entries: "OrderedDict[bytes, Any]" = OrderedDict()  # content hash -> embedding
+        self._phashes: Dict[int, bytes] = {}  # perceptual hash -> content hash
+        self._phash_of: Dict[bytes, int] = {}  # content hash -> perceptual hash
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: bytes):
+        """Embedding of the image with this content hash, or None."""
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return embedding
+
+    def get_similar(self, phash: Optional[int]):
+        """Embedding of a cached image close to this perceptual hash, or None."""
+        if phash is None or self.phash_distance is None:
+            self.misses += 1
+            return None
+        with self._lock:
+            key = self._phashes.get(phash)
+            if key is None and self.phash_distance > 0:
+                key = next(
+                    (key for other, key in self._phashes.items() if bin(other ^ phash).count("1") <= self.phash_distance),
+                    None,
+                )
+            if key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.near_hits += 1
+            return self._entries[key]
+
+    def put(self, key: bytes, embedding, phash: Optional[int] = None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            if phash is not None and self.phash_distance is not None:
+                self._phashes[phash] = key
+                self._phash_of[key] = phash
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                evicted_phash = self._phash_of.pop(evicted, None)
+                if self._phashes.get(evicted_phash) == evicted:
+                    del self._phashes[evicted_phash]
@@ -0,0 +1,68 @@
+import logging
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+_log = logging.getLogger(__name__)
+
+
+class VisionEmbedding(nn.Module):
+    """CLIP vision tower and projection of the safety checker, to normalized embeddings."""
+
+    def __init__(self, safety_checker):
+        super().__init__()
+        self.vision_model = safety_checker.vision_model
+        self.visual_projection = safety_checker.visual_projection
+
+    def forward(self, pixel_values):
+        pooled_output = self.vision_model(pixel_values)[1]
+        return nn.functional.normalize(self.visual_projection(pooled_output), dim=-1)
+
+
+def export_onnx(safety_checker, directory: str, quantize: bool = False) -> str:
+    """
+    Export the vision tower and projection of a float32 safety checker to ONNX, with a
+    dynamic batch size, and optionally quantize its weights to int8. Returns the path of
+    the model, an existing export is reused.
+    """
+    path = os.path.join(directory, "vision.onnx")
+    quantized_path = os.path.join(directory, "vision-int8.onnx")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        image_size = safety_checker.vision_model.config.image_size
+        _log.info(f"Exporting the safety checker to {path}")
+        torch.onnx.export(
+            VisionEmbedding(safety_checker).eval(),
+            torch.zeros(1, 3, image_size, image_size),
+            path,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=17,
+        )
+    if not quantize:
+        return path
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        _log.info(f"Quantizing the safety checker to {quantized_path}")
+        quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+class OnnxVisionEmbedding:
+    """VisionEmbedding running under ONNX Runtime on CPU."""
+
+    def __init__(self, path: str, threads: int = 0):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        # 0 lets ONNX Runtime use every core
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {"pixel_values": pixel_values.astype(np.float32, copy=False)})[0]
@@ -1,8 +1,10 @@
 import kserve
 import numpy as np
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 
 from diffusers import StableDiffusionXLPipeline
@@ -10,39 +12,100 @@ from diffusers.pipelines.stable_diffusion import StableDiffusionSafetyChecker
 from transformers import CLIPImageProcessor, CLIPTokenizer, CLIPModel
 import torch 
 import torch.nn as nn
-from torchvision.transforms.functional import pil_to_tensor, to_pil_image
 from PIL import Image as PIL_Image
 
 from kserve import InferResponse, InferRequest
+from kserve.errors import InvalidInput
 from kserve.logging import logger
 from kserve.utils.utils import get_predict_response
 
+from .concept_store import ConceptStore
+from .embedding_cache import EmbeddingCache, content_hash, perceptual_hash
+from .onnx_backend import OnnxVisionEmbedding, export_onnx
+
 class SafetyChecker(kserve.Model):
-    def __init__(self, name: str):
+    def __init__(
+        self,
+        name: str,
+        max_batch_size: int = 32,
+        preprocess_workers: int = 4,
+        embedding_cache_size: int = 4096,
+        phash_distance: Optional[int] = None,
+        concept_store_dir: Optional[str] = None,
+        backend: str = "torch",
+        onnx_dir: str = "onnx",
+        onnx_threads: int = 0,
+    ):
         super().__init__(name)
         self.name = name
-        self.ready = True
+        self.ready = False
         self.modify = True
+        self.max_batch_size = max_batch_size
+        self.embedding_cache = EmbeddingCache(embedding_cache_size, phash_distance)
+        self.concept_store_dir = concept_store_dir
+        self.concept_store = None  # Created once the model gives the embedding size
+        self._concepts = None  # (store version, concept matrix, thresholds), see concept_matrix
+        self._concepts_lock = threading.Lock()
+
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.onnx_threads = onnx_threads
+        self.onnx_embedding = None
+        # The ONNX Runtime backends are for CPU-only nodes
+        self.device = "cuda" if torch.cuda.is_available() and backend == "torch" else "cpu"
+        # Half precision is slower than float32 on CPU, when it is supported at all
+        self.dtype = torch.float16 if self.device == "cuda" else torch.float32
 
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.dtype=torch.float16
+        # Decoding and resizing run in threads, PIL releases the GIL
+        self.preprocess_pool = ThreadPoolExecutor(max_workers=preprocess_workers, thread_name_prefix="preprocess")
+        self.load()
 
+    def load(self):
         self.feature_extractor = CLIPImageProcessor.from_pretrained("openai/clip-vit-base-patch32")
         self.safety_checker = StableDiffusionSafetyChecker.from_pretrained(
-            "CompVis/stable-diffusion-safety-checker").to(self.device)
+            "CompVis/stable-diffusion-safety-checker").to(self.device, self.dtype)
+        self.concept_store = ConceptStore(self.safety_checker.config.projection_dim, self.concept_store_dir)
+        self.load_backend()
 
-        if self.modify:
+        # Persisted concepts are loaded from the store, only new ones go through CLIP
+        if self.modify and "green-fedora" not in self.concept_store:
             image_to_ban = PIL_Image.open("green-fedora.png").convert("RGB")
-            self.add_nsfw_embedding(image_to_ban, 0.6)
+            self.add_nsfw_embedding(image_to_ban, 0.6, "green-fedora")
+        self.ready = True
 
-    def add_nsfw_embedding(self, image: PIL_Image, weight: int):
-        safety_checker_input = self.feature_extractor(image, return_tensors="pt").to(self.device)
+    def load_backend(self):
+        """Run the vision tower under ONNX Runtime for the onnx backends, the torch backend needs nothing."""
+        if self.backend == "torch":
+            return
+        path = export_onnx(self.safety_checker, self.onnx_dir, quantize=self.backend == "onnx-int8")
+        self.onnx_embedding = OnnxVisionEmbedding(path, self.onnx_threads)
+        # Only the concepts of the checker are used from now on
+        self.safety_checker.vision_model = None
+        logger.info(f"Using the {self.backend} backend from {path}")
 
-        pooled_output  = self.safety_checker.vision_model(safety_checker_input.pixel_values.to(self.dtype))[1]
-        image_embeds = self.safety_checker.visual_projection(pooled_output)
-        
-        self.safety_checker.concept_embeds = nn.Parameter(torch.cat([self.safety_checker.concept_embeds, image_embeds]))
-        self.safety_checker.concept_embeds_weights = nn.Parameter(torch.cat([self.safety_checker.concept_embeds_weights, torch.Tensor([0.6]).to(self.device)]))
+    def add_nsfw_embedding(self, image: PIL_Image, weight: float, name: str):
+        """Ban the images close to this one, from now on."""
+        pixel_values = self.feature_extractor(image, return_tensors="pt").pixel_values
+        self.concept_store.add(name, self.embed(pixel_values)[0].cpu().numpy(), weight)
+
+    def concept_matrix(self) -> Tuple[torch.Tensor, torch.Tensor, int]:
+        """
+        Normalized embeddings and thresholds of every concept: the special care concepts
+        of the model, then its concepts, then the custom ones. Rebuilt when the custom
+        concepts change. Also returns the number of special care concepts.
+        """
+        version, custom_embeds, custom_thresholds = self.concept_store.snapshot()
+        with self._concepts_lock:
+            if self._concepts is None or self._concepts[0] != version:
+                checker = self.safety_checker
+                embeds = [checker.special_care_embeds.float(), checker.concept_embeds.float()]
+                thresholds = [checker.special_care_embeds_weights.float(), checker.concept_embeds_weights.float()]
+                if custom_embeds is not None:
+                    embeds.append(torch.tensor(np.asarray(custom_embeds), device=self.device))
+                    thresholds.append(torch.tensor(custom_thresholds, device=self.device))
+                matrix = nn.functional.normalize(torch.cat(embeds).detach(), dim=-1)
+                self._concepts = (version, matrix, torch.cat(thresholds).detach())
+            return self._concepts[1], self._concepts[2], self.safety_checker.special_care_embeds.shape[0]
 
 
     def predict(self,
@@ -50,19 +113,83 @@ class SafetyChecker(kserve.Model):
         headers: Dict[str, str] = None,
         response_headers: Dict[str, str] = None,
     ) -> InferResponse:
+        # Every element of every input is an image, flags are returned in the same order
+        images = [image_bytes(image) for infer_input in payload.inputs for image in input_images(infer_input)]
+        if not images:
+            raise InvalidInput("no image in the request")
+
+        keys = [content_hash(image) for image in images]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+        logger.info(f"Checking {len(images)} images, {len(missing)} not cached")
+        if missing:
+            to_embed, pixel_values, phashes = [], [], {}
+            for index, (image_pixels, phash) in zip(
+                missing, self.preprocess_pool.map(self.preprocess_image, [images[index] for index in missing])
+            ):
+                embeddings[index] = self.embedding_cache.get_similar(phash)
+                if embeddings[index] is None:
+                    to_embed.append(index)
+                    pixel_values.append(image_pixels)
+                    phashes[index] = phash
+            for start in range(0, len(to_embed), self.max_batch_size):
+                batch = to_embed[start : start + self.max_batch_size]
+                batch_embeds = self.embed(torch.from_numpy(np.stack(pixel_values[start : start + self.max_batch_size])))
+                for index, embedding in zip(batch, batch_embeds.cpu()):
+                    embeddings[index] = embedding
+                    self.embedding_cache.put(keys[index], embedding, phashes[index])
+
+        has_nsfw_concept = self.concept_flags(torch.stack(embeddings).to(self.device))
+        return get_predict_response(payload, has_nsfw_concept.numpy(), self.name)
+
+    def preprocess_image(self, image_data: bytes) -> Tuple[np.ndarray, Optional[int]]:
+        """CLIP input of an encoded image, and its perceptual hash when near duplicates are looked up."""
+        try:
+            image = PIL_Image.open(BytesIO(image_data)).convert("RGB")
+        except OSError as e:
+            raise InvalidInput(f"undecodable image: {e}")
+        phash = perceptual_hash(image) if self.embedding_cache.phash_distance is not None else None
+        return self.feature_extractor(image, return_tensors="np").pixel_values[0], phash
+
+    @torch.inference_mode()
+    def embed(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Normalized CLIP embeddings of a batch of images, in one forward pass."""
+        if self.onnx_embedding is not None:
+            return torch.from_numpy(self.onnx_embedding(pixel_values.numpy()))
+        pooled_output = self.safety_checker.vision_model(pixel_values.to(self.device, self.dtype))[1]
+        image_embeds = self.safety_checker.visual_projection(pooled_output)
+        return nn.functional.normalize(image_embeds.float(), dim=-1)
 
-        logger.info(payload)
+    @torch.inference_mode()
+    def concept_flags(self, image_embeds: torch.Tensor) -> torch.Tensor:
+        """
+        NSFW flags of normalized embeddings, scored like StableDiffusionSafetyChecker.forward_onnx
+        against every concept in one matmul. The checker's forward also copies the images
+        to black out the flagged ones, only the flags are needed here.
+        """
+        matrix, thresholds, special_count = self.concept_matrix()
+        scores = image_embeds @ matrix.T - thresholds
+        special_care = torch.any(scores[:, :special_count] > 0, dim=1)
+        concept_scores = scores[:, special_count:] + special_care.unsqueeze(1) * 0.01
+        return torch.any(concept_scores > 0, dim=1).cpu()
 
-        image_data = payload.inputs[0].data
 
-        logger.info(image_data)
+def input_images(infer_input) -> List:
+    """
+    Images of a request input, one per element: base64 strings in JSON, raw image
+    bytes in the `bytes_contents` or the `raw_input_contents` of gRPC requests.
+    """
+    try:
+        return infer_input.as_numpy().reshape(-1).tolist()
+    except ValueError as e:
+        raise InvalidInput(f"invalid input {infer_input.name}: {e}")
 
-        # Decode the base64 image
-        image_bytes = base64.b64decode(image_data[0])
-        image = PIL_Image.open(BytesIO(image_bytes)).convert("RGB")
 
-        safety_checker_input = self.feature_extractor(image, return_tensors="pt").to(self.device)
-        image, has_nsfw_concept = self.safety_checker(
-            images=pil_to_tensor(image).unsqueeze(0), clip_input=safety_checker_input.pixel_values.to(self.dtype)
-        )
-        return get_predict_response(payload, np.asarray(has_nsfw_concept), self.name)
\ No newline at end of file
+def image_bytes(image_data) -> bytes:
+    """Encoded image of a request element, raw bytes or a base64 string."""
+    if isinstance(image_data, (bytes, bytearray)):
+        return bytes(image_data)
+    try:
+        return base64.b64decode(image_data)
+    except (TypeError, ValueError) as e:
+        raise InvalidInput(f"invalid base64 image: {e}")
@@ -0,0 +1,57 @@
+import json
+from types import SimpleNamespace
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from safety_checker.admin import start_admin_server
+from safety_checker.concept_store import ConceptStore
+
+
+def call(server, method, path, body=None, headers=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = Request(f"http://127.0.0.1:{server.server_port}{path}", data=data, method=method, headers=headers or {})
+    try:
+        with urlopen(request) as response:
+            return response.status, json.load(response)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_concepts_change_at_runtime():
+    model = SimpleNamespace(concept_store=ConceptStore(2))
+    server = start_admin_server(model, 0)
+    try:
+        assert call(server, "GET", "/concepts") == (200, {"concepts": []})
+        # The size of the embeddings is the one of the model, even for the first concept
+        assert call(server, "POST", "/concepts", {"name": "red hat", "threshold": 0.5, "embedding": [1, 0, 0]})[0] == 400
+        status, body = call(server, "POST", "/concepts", {"name": "red hat", "threshold": 0.5, "embedding": [1, 0]})
+        assert (status, body) == (200, {"concepts": [{"name": "red hat", "threshold": 0.5}]})
+        assert call(server, "POST", "/concepts", {"name": "cat", "embedding": [1, 0]})[0] == 400
+        assert call(server, "DELETE", "/concepts/red%20hat") == (200, {"concepts": []})
+        assert call(server, "DELETE", "/concepts/red%20hat")[0] == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_token_is_required_when_set():
+    model = SimpleNamespace(concept_store=ConceptStore(2))
+    model.concept_store.add("red hat", [1, 0], 0.5)
+    server = start_admin_server(model, 0, token="secret")
+    try:
+        assert call(server, "DELETE", "/concepts/red%20hat")[0] == 403
+        assert call(server, "DELETE", "/concepts/red%20hat", headers={"X-Admin-Token": "wrong"})[0] == 403
+        assert call(server, "DELETE", "/concepts/red%20hat", headers={"X-Admin-Token": "secret"}) == (
+            200,
+            {"concepts": []},
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_listening_beyond_localhost_needs_a_token():
+    with pytest.raises(ValueError):
+        start_admin_server(SimpleNamespace(concept_store=ConceptStore(2)), 0, host="0.0.0.0")
@@ -0,0 +1,65 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from safety_checker.concept_store import INDEX_FILE, ConceptStore
+
+
+def test_concepts_are_normalized_and_replaced_by_name():
+    store = ConceptStore(2)
+    store.add("hat", [3.0, 4.0], 0.6)
+    store.add("cat", [1.0, 0.0], 0.5)
+    store.add("hat", [0.0, 2.0], 0.7)
+    version, embeddings, thresholds = store.snapshot()
+    assert [concept["name"] for concept in store.concepts()] == ["cat", "hat"]
+    np.testing.assert_allclose(embeddings, [[1.0, 0.0], [0.0, 1.0]])
+    np.testing.assert_allclose(thresholds, [0.5, 0.7])
+    assert version == 3
+
+
+def test_wrong_dimension_is_rejected():
+    store = ConceptStore(2)
+    # Even when the store is empty
+    with pytest.raises(ValueError):
+        store.add("hat", [1.0, 0.0, 0.0], 0.6)
+    store.add("hat", [1.0, 0.0], 0.6)
+    for embedding in ([1.0, 0.0, 0.0], [0.0, 0.0]):
+        with pytest.raises(ValueError):
+            store.add("cat", embedding, 0.5)
+    assert len(store) == 1
+
+
+def test_store_of_another_dimension_is_rejected(tmp_path):
+    ConceptStore(2, str(tmp_path)).add("hat", [1.0, 0.0], 0.6)
+    with pytest.raises(ValueError):
+        ConceptStore(3, str(tmp_path))
+
+
+def test_concepts_persist_memory_mapped(tmp_path):
+    store = ConceptStore(2, str(tmp_path))
+    store.add("hat", [1.0, 0.0], 0.6)
+    store.add("cat", [0.0, 1.0], 0.5)
+    store.remove("hat")
+
+    reloaded = ConceptStore(2, str(tmp_path))
+    version, embeddings, thresholds = reloaded.snapshot()
+    assert isinstance(embeddings, np.memmap)
+    assert reloaded.concepts() == [{"name": "cat", "threshold": 0.5}]
+    np.testing.assert_allclose(embeddings, [[0.0, 1.0]])
+    assert version == store.version
+    # Only the current matrix is kept
+    assert sorted(os.listdir(tmp_path)) == [INDEX_FILE, json.load(open(tmp_path / INDEX_FILE))["embeddings"]]
+
+
+def test_removing_every_concept(tmp_path):
+    store = ConceptStore(2, str(tmp_path))
+    store.add("hat", [1.0, 0.0], 0.6)
+    assert store.remove("hat")
+    assert not store.remove("hat")
+    assert store.snapshot()[1] is None
+    assert len(ConceptStore(2, str(tmp_path))) == 0
+    # Later matrices do not reuse the name of a removed one
+    store.add("cat", [0.0, 1.0], 0.5)
+    assert ConceptStore(2, str(tmp_path)).concepts() == [{"name": "cat", "threshold": 0.5}]
@@ -0,0 +1,60 @@
+import random
+
+from PIL import Image as PIL_Image
+
+from safety_checker.embedding_cache import EmbeddingCache, content_hash, perceptual_hash
+
+
+def noise(seed, size=64):
+    rng = random.Random(seed)
+    return PIL_Image.frombytes("RGB", (size, size), bytes(rng.randrange(256) for _ in range(size * size * 3)))
+
+
+def test_same_bytes_hit():
+    cache = EmbeddingCache(max_entries=4)
+    cache.put(content_hash(b"image"), "embedding")
+    assert cache.get(content_hash(b"image")) == "embedding"
+    assert cache.get(content_hash(b"other")) is None
+    assert cache.hits == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put(b"a", 1)
+    cache.put(b"b", 2)
+    cache.get(b"a")
+    cache.put(b"c", 3)
+    assert (cache.get(b"a"), cache.get(b"b"), cache.get(b"c")) == (1, None, 3)
+    assert len(cache) == 2
+
+
+def test_disabled_cache_keeps_nothing():
+    cache = EmbeddingCache(max_entries=0)
+    cache.put(b"a", 1)
+    assert cache.get(b"a") is None
+
+
+def test_near_duplicates_match_by_perceptual_hash():
+    image = noise(0)
+    resized = noise(0).resize((48, 48)).resize((64, 64))
+    assert bin(perceptual_hash(image) ^ perceptual_hash(resized)).count("1") <= 4
+
+    cache = EmbeddingCache(max_entries=4, phash_distance=4)
+    cache.put(b"original", "embedding", perceptual_hash(image))
+    assert cache.get_similar(perceptual_hash(resized)) == "embedding"
+    assert cache.get_similar(perceptual_hash(noise(1))) is None
+    assert (cache.near_hits, cache.misses) == (1, 1)
+
+
+def test_near_duplicates_off_by_default():
+    cache = EmbeddingCache(max_entries=4)
+    cache.put(b"original", "embedding", perceptual_hash(noise(0)))
+    assert cache.get_similar(perceptual_hash(noise(0))) is None
+
+
+def test_evicted_entry_no_longer_matches():
+    cache = EmbeddingCache(max_entries=1, phash_distance=0)
+    cache.put(b"a", 1, 0b1010)
+    cache.put(b"b", 2, 0b0101)
+    assert cache.get_similar(0b1010) is None
+    assert cache.get_similar(0b0101) == 2
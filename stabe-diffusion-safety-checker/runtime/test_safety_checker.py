@@ -0,0 +1,158 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from diffusers.pipelines.stable_diffusion import StableDiffusionSafetyChecker
+from kserve import InferInput, InferRequest
+from kserve.errors import InvalidInput
+from PIL import Image as PIL_Image
+from transformers import CLIPConfig, CLIPImageProcessor
+
+from safety_checker.concept_store import ConceptStore
+from safety_checker.embedding_cache import EmbeddingCache
+from safety_checker.safety_checker import SafetyChecker, image_bytes, input_images
+
+# Images whose embeddings become concepts, and the one that becomes a special care concept
+CONCEPT_IMAGES = [0, 3, 6]
+SPECIAL_CARE_IMAGES = [5]
+
+
+class TinySafetyChecker(SafetyChecker):
+    """SafetyChecker with a tiny random-weight CLIP vision model."""
+
+    def load(self):
+        torch.manual_seed(0)
+        config = CLIPConfig(
+            text_config={"hidden_size": 32, "intermediate_size": 37, "num_attention_heads": 4, "num_hidden_layers": 2},
+            vision_config={
+                "hidden_size": 32,
+                "intermediate_size": 37,
+                "num_attention_heads": 4,
+                "num_hidden_layers": 2,
+                "image_size": 32,
+                "patch_size": 8,
+            },
+            projection_dim=32,
+        )
+        self.feature_extractor = CLIPImageProcessor(size={"shortest_edge": 32}, crop_size={"height": 32, "width": 32})
+        self.safety_checker = StableDiffusionSafetyChecker(config).to(self.device, self.dtype).eval()
+        self.concept_store = ConceptStore(config.projection_dim, self.concept_store_dir)
+        self.load_backend()
+        self.ready = True
+
+
+def encoded_images(count):
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        buffer = BytesIO()
+        PIL_Image.fromarray(rng.integers(0, 256, (48, 48, 3), dtype=np.uint8)).save(buffer, format="PNG")
+        images.append(buffer.getvalue())
+    return images
+
+
+def make_request(*inputs):
+    infer_inputs = [
+        InferInput(f"image-{index}", [len(images)], "BYTES", data=[base64.b64encode(image).decode() for image in images])
+        for index, images in enumerate(inputs)
+    ]
+    return InferRequest("safety-checker", infer_inputs)
+
+
+def pixel_values(model, images):
+    return torch.from_numpy(np.stack([model.preprocess_image(image)[0] for image in images]))
+
+
+def ban_images(models, embeds):
+    """
+    Replace the concepts of the checkers by the directions of some images away from the
+    mean embedding, the random embeddings are all close to it. Each threshold is halfway
+    between the score of its image and the highest score of the other images.
+    """
+    directions = nn.functional.normalize(embeds - embeds.mean(dim=0), dim=-1)
+    scores = embeds @ directions.T
+    others = scores.masked_fill(torch.eye(len(embeds), dtype=torch.bool), -1).max(dim=0).values
+    thresholds = (scores.diagonal() + others) / 2
+    for model in models:
+        checker = model.safety_checker
+        checker.concept_embeds = nn.Parameter(directions[CONCEPT_IMAGES])
+        checker.concept_embeds_weights = nn.Parameter(thresholds[CONCEPT_IMAGES])
+        checker.special_care_embeds = nn.Parameter(directions[SPECIAL_CARE_IMAGES])
+        checker.special_care_embeds_weights = nn.Parameter(thresholds[SPECIAL_CARE_IMAGES])
+        model._concepts = None
+
+
+def flags(response) -> list:
+    return response.outputs[0].as_numpy().tolist()
+
+
+def test_images_from_json_and_binary_inputs():
+    json_input = InferInput("image", [2], "BYTES", data=["YWI=", "Y2Rl"])
+    assert [image_bytes(image) for image in input_images(json_input)] == [b"ab", b"cde"]
+
+    binary_input = InferInput("image", [2], "BYTES")
+    binary_input.set_data_from_numpy(np.array([b"ab", b"cde"], dtype=np.object_), binary_data=True)
+    assert [image_bytes(image) for image in input_images(binary_input)] == [b"ab", b"cde"]
+
+
+def test_undecodable_images_are_invalid_input():
+    # Only what predict uses before the model runs
+    model = SafetyChecker.__new__(SafetyChecker)
+    model.embedding_cache = EmbeddingCache(0)
+    model.preprocess_pool = ThreadPoolExecutor(max_workers=1)
+
+    request = InferRequest("safety-checker", [InferInput("image", [1], "BYTES", data=["bm90IGFuIGltYWdl"])])
+    with pytest.raises(InvalidInput):
+        model.predict(request)
+    with pytest.raises(InvalidInput):
+        image_bytes("not base64!")
+
+
+def test_predict_flags_like_the_checker_forward():
+    model = TinySafetyChecker("safety-checker", embedding_cache_size=0)
+    images = encoded_images(8)
+    clip_input = pixel_values(model, images)
+    ban_images([model], model.embed(clip_input))
+
+    expected = model.safety_checker(clip_input, np.zeros((len(images), 4, 4, 3)))[1]
+
+    assert any(expected) and not all(expected)
+    assert flags(model.predict(make_request(images))) == expected
+    assert model.concept_flags(model.embed(clip_input)).tolist() == expected
+
+
+def test_batched_flags_keep_the_request_order():
+    model = TinySafetyChecker("safety-checker", max_batch_size=3, embedding_cache_size=0)
+    images = encoded_images(8)
+    ban_images([model], model.embed(pixel_values(model, images)))
+    single = [flags(model.predict(make_request([image])))[0] for image in images]
+    batches = []
+    embed = model.embed
+    model.embed = lambda batch: batches.append(len(batch)) or embed(batch)
+
+    # Reversed, so the flags of an unordered batch would not match
+    response = model.predict(make_request(images[:3][::-1], images[3:][::-1]))
+
+    assert batches == [3, 3, 2]
+    assert response.outputs[0].shape == [len(images)]
+    assert flags(response) == single[:3][::-1] + single[3:][::-1]
+    assert any(single) and not all(single)
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_onnx_backends_agree_with_torch(backend, tmp_path):
+    pytest.importorskip("onnxruntime")
+    reference = TinySafetyChecker("safety-checker", embedding_cache_size=0)
+    model = TinySafetyChecker("safety-checker", embedding_cache_size=0, backend=backend, onnx_dir=str(tmp_path))
+    images = encoded_images(8)
+    reference_embeds = reference.embed(pixel_values(reference, images))
+    ban_images([reference, model], reference_embeds)
+
+    embeds = model.embed(pixel_values(model, images))
+
+    assert (embeds * reference_embeds).sum(dim=-1).min() > (0.9999 if backend == "onnx" else 0.999)
+    assert flags(model.predict(make_request(images))) == flags(reference.predict(make_request(images)))